@@ -0,0 +1,88 @@
+import atexit
+import threading
+
+from chess_repertoire.apps.game.metrics import METRICS
+
+class WriteBehindBuffer():
+    """
+    In-memory buffer of records written in batches by a background thread.
+
+    `add` only appends to the buffer, so requests never wait on the write.
+    The thread hands the pending records to `write` every `max_age` seconds,
+    or as soon as `max_size` records are pending, then calls `close` (e.g. to
+    release its DB connection). Wakes with nothing pending do neither. A failed batch is put back for the next flush
+    unless the buffer already holds `max_pending` records, in which case it is
+    dropped and counted. Pending records are also written at exit, unless
+    `flush_at_exit` is turned off (e.g. by the test runner, whose database is
+    gone by then).
+    """
+
+    def __init__(self, write, max_size, max_age, max_pending=None, close=None):
+        self.write = write
+        self.close = close
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_pending = max_pending or 10 * max_size
+        self.flush_at_exit = True
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, record):
+        with self._lock:
+            self._pending.append(record)
+            full = len(self._pending) >= self.max_size
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self._exit)
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Writes the pending records right away and returns how many were written."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return 0
+        try:
+            with METRICS.timer('write_behind_flush'):
+                self.write(batch)
+        except Exception:
+            with self._lock:
+                if len(self._pending) + len(batch) <= self.max_pending:
+                    self._pending[:0] = batch
+                    return 0
+            METRICS.increment('write_behind_dropped', len(batch))
+            raise
+        METRICS.increment('write_behind_written', len(batch))
+        return len(batch)
+
+    def discard(self):
+        """Drops the pending records without writing them and returns how many were dropped."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return len(batch)
+
+    def _exit(self):
+        if self.flush_at_exit:
+            self.flush()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.max_age)
+            self._wake.clear()
+            if not self._pending:
+                continue
+            try:
+                self.flush()
+            except Exception:
+                # -- The batch is counted as dropped, the thread keeps serving the next ones -- #
+                pass
+            finally:
+                if self.close is not None:
+                    self.close()
@@ -1,14 +1,261 @@
-import chess.pgn as pgn
 import chess.svg as svg
+import hashlib
+import os
 import random
+import threading
 
-from chess_repertoire.apps.repertoire.constants import CHESS_BOARD_SIZE
+from collections import OrderedDict
+from concurrent.futures import Future
 
+from chess_repertoire.apps.repertoire.constants import (
+    BOARD_CACHE_DIR, BOARD_CACHE_DIR_MAX_BYTES, BOARD_CACHE_MAX_BYTES, CHESS_BOARD_SIZE, PGN_CACHE_MAX_BYTES,
+    SUBTREE_MAX_NODES
+)
+
+from .metrics import METRICS
+from .tree import load_tree
 from .utils import get_current_color, NAG_TO_EXPRESSION
 
+class LRUCache():
+    """
+    Thread-safe LRU mapping bounded by the total weight (bytes) of its values.
+
+    Every entry may carry a `version`; looking it up with a different version
+    counts as a miss, so callers can validate entries against file metadata.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, key, version=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            return None
+
+    def store(self, key, value, weight, version=None):
+        with self._lock:
+            self._discard(key)
+            if weight <= self.max_bytes:
+                self._entries[key] = (version, value, weight)
+                self.size += weight
+                while self.size > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
+
+    @property
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'size': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= entry[2]
+
+class GameTreeCache(LRUCache):
+    """
+    Process-wide LRU cache of compiled PGN game trees.
+
+    Entries are keyed by path and validated against the file's mtime and size,
+    so a PGN rewritten through ModifyVariation is loaded again on next access.
+    The total size of the cached trees is kept under `max_bytes`. Cached trees
+    are shared between requests and must be treated as read-only: controllers
+    only move a cursor (`ChessBase.node_id`) over them. Concurrent misses on
+    the same file and version are coalesced: the first request loads the tree
+    and the others wait for it instead of parsing the PGN again.
+    """
+
+    def __init__(self, max_bytes=PGN_CACHE_MAX_BYTES):
+        super().__init__(max_bytes)
+        self._loading = {}
+
+    @staticmethod
+    def signature(pgn_file):
+        stat = os.stat(pgn_file)
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def version(pgn_file, signature):
+        token = f'{pgn_file}:{signature[0]}:{signature[1]}'.encode()
+        return hashlib.blake2b(token, digest_size=8).hexdigest()
+
+    @staticmethod
+    def file_version(pgn_file):
+        """Version the tree of `pgn_file` has (or would have once loaded), from the file metadata only."""
+        key = os.path.abspath(pgn_file)
+        return GameTreeCache.version(key, GameTreeCache.signature(key))
+
+    def get(self, pgn_file):
+        """Returns the CompiledTree of `pgn_file`, loading it only on a miss."""
+        key = os.path.abspath(pgn_file)
+        signature = GameTreeCache.signature(key)
+        tree = self.lookup(key, signature)
+        if tree is not None:
+            return tree
+
+        # -- Only the first miss of a file version loads it, later ones wait for its result -- #
+        with self._lock:
+            loading = self._loading.get((key, signature))
+            if loading is None:
+                loading = self._loading[(key, signature)] = Future()
+                leader = True
+            else:
+                leader = False
+        if not leader:
+            METRICS.increment('tree_load_coalesced')
+            return loading.result()
+
+        try:
+            tree = load_tree(key, GameTreeCache.version(key, signature))
+            self.store(key, tree, tree.nbytes, signature)
+            loading.set_result(tree)
+            return tree
+        except BaseException as e:
+            loading.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._loading[(key, signature)]
+
+    def invalidate(self, pgn_file):
+        super().invalidate(os.path.abspath(pgn_file))
+
+class BoardRenderCache(LRUCache):
+    """
+    Content-addressed cache of rendered SVG boards.
+
+    Boards are keyed by everything that affects the drawing (FEN, arrows,
+    orientation, last move and size), so repeated positions while drilling
+    the same lines are rendered once. If `directory` is set, renders are also
+    persisted there under the SHA-1 of their key and survive restarts. The
+    directory is bounded too: once its renders weigh more than
+    `directory_max_bytes`, the least recently used ones (by mtime, touched on
+    every read) are removed down to three quarters of it.
+    """
+
+    def __init__(self, max_bytes=BOARD_CACHE_MAX_BYTES, directory=BOARD_CACHE_DIR,
+                 directory_max_bytes=BOARD_CACHE_DIR_MAX_BYTES):
+        super().__init__(max_bytes)
+        self.directory = directory
+        self.directory_max_bytes = directory_max_bytes
+        self.directory_size = 0
+        self._directory_lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.directory_size = self._prune()
+
+    @staticmethod
+    def key(fen, arrows, flipped, lastmove, size):
+        arrows = ','.join(f'{arrow.tail}-{arrow.head}-{arrow.color}' for arrow in arrows)
+        token = f'{fen}|{arrows}|{int(flipped)}|{lastmove.uci() if lastmove else ""}|{size}'
+        return hashlib.sha1(token.encode()).hexdigest()
+
+    def render(self, board, arrows, flipped, lastmove, size):
+        """Returns the SVG of the board, rendering it only on a miss."""
+        key = BoardRenderCache.key(board.fen(), arrows, flipped, lastmove, size)
+        image = self.lookup(key)
+        if image is None:
+            image = self._read(key)
+            if image is None:
+                with METRICS.timer('svg_render'):
+                    image = svg.board(
+                        board=board,
+                        size=size,
+                        arrows=arrows,
+                        flipped=flipped,
+                        lastmove=lastmove
+                    )
+                self._write(key, image)
+            self.store(key, image, len(image))
+        return image
+
+    def _read(self, key):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, f'{key}.svg')
+        try:
+            with open(path) as file:
+                image = file.read()
+            os.utime(path)
+            return image
+        except OSError:
+            return None
+
+    def _write(self, key, image):
+        if not self.directory:
+            return
+        target = os.path.join(self.directory, f'{key}.svg')
+        temporary = f'{target}.{os.getpid()}.tmp'
+        try:
+            with open(temporary, 'w') as file:
+                file.write(image)
+            os.replace(temporary, target)
+        except OSError:
+            return
+        with self._directory_lock:
+            self.directory_size += len(image)
+            if self.directory_size > self.directory_max_bytes:
+                self.directory_size = self._prune()
+
+    def _prune(self):
+        """Removes the least recently used renders of the directory if over budget, returns the size left."""
+        # -- Other processes may share the directory: the files, not this process, are the reference -- #
+        renders = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.svg'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    renders.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        size = sum(render[1] for render in renders)
+        if size <= self.directory_max_bytes:
+            return size
+        renders.sort()
+        for _, weight, path in renders:
+            if size <= self.directory_max_bytes * 3 // 4:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= weight
+        return size
+
+GAME_TREE_CACHE = GameTreeCache()
+BOARD_RENDER_CACHE = BoardRenderCache()
+
 class ChessBase():
     def __init__(self, pgn_file, color, size=CHESS_BOARD_SIZE):
-        self.state = ChessBase.read_pgn_file(pgn_file)
+        self.tree = ChessBase.read_pgn_file(pgn_file)
+        self.node_id = 0
         self.color = True if color else False
         self.pgn_path = pgn_file
         self.size = size
@@ -16,50 +263,75 @@ class ChessBase():
 
     @staticmethod
     def read_pgn_file(pgn_file):
-        with open(pgn_file) as file:
-            return pgn.read_game(file)
+        return GAME_TREE_CACHE.get(pgn_file)
 
     @property
     def board(self):
-        return svg.board(
-            board=self.state.board(),
-            size=self.size,
+        return BOARD_RENDER_CACHE.render(
+            board=self.tree.board(self.node_id),
             arrows=self.arrows,
             flipped=self.color,
-            lastmove=self.state.move
+            lastmove=self.tree.move(self.node_id),
+            size=self.size
         )
-    
+
+    @property
+    def fen(self):
+        return self.tree.fen(self.node_id)
+
+    @property
+    def ply(self):
+        return self.tree.ply(self.node_id)
+
+    @property
+    def cursor(self):
+        """Session representation of the current node: [tree version, node ID]."""
+        return [self.tree.version, self.node_id]
+
+    def goto(self, cursor):
+        """Jumps to the node of `cursor`, or to the root if it belongs to another tree."""
+        if cursor and cursor[0] == self.tree.version and 0 <= cursor[1] < len(self.tree):
+            self.node_id = cursor[1]
+        else:
+            self.node_id = 0
+
     @property
     def nag(self):
-        nag = list(self.state.nags)
-        return NAG_TO_EXPRESSION[nag[0] if nag else 0]
+        return NAG_TO_EXPRESSION.get(self.tree.nag(self.node_id), '')
 
     @property
     def is_checkmate(self):
-        return self.state.board().is_checkmate()
+        return self.tree.is_checkmate(self.node_id)
     
     @property
     def possible_moves(self):
-        uci_moves = [self.state.variations[x].move for x in range(len(self.state.variations))]
-        self.moves = []
-        for move in uci_moves:
-            self.moves.append(self.state.board().san(move))
+        self.moves = self.tree.child_sans(self.node_id)
         return self.moves
+
+    @property
+    def legal_moves(self):
+        return list(self.tree.hints(self.node_id))
     
     @property
     def show_hints(self):
-        uci_moves = [self.state.variations[x].move for x in range(len(self.state.variations))]
-        for move in uci_moves:
+        for hint in self.tree.hints(self.node_id):
             self.arrows.append(svg.Arrow(
-                move.from_square, move.to_square, color='blue'
+                hint['from'], hint['to'], color='blue'
             ))
 
+    def subtree(self, plies, max_nodes=SUBTREE_MAX_NODES):
+        """Compact serialisation of the next `plies` plies from the current node."""
+        subtree = self.tree.subtree(self.node_id, plies, max_nodes)
+        subtree['nag'] = [NAG_TO_EXPRESSION.get(nag, '') for nag in subtree.pop('nags')]
+        subtree['version'] = self.tree.version
+        return subtree
+
     def next_move(self, move):
         self.possible_moves
         index = self.moves.index(move)
-        self.state = self.state.variations[index]
+        self.node_id = self.tree.children(self.node_id)[index]
 
-    def run_visited_moves(self, run_moves):
+    def resume(self, cursor):
         raise NotImplementedError('Yout are using the Base class. Use ChessReviewer or ChessPractice')
 
     def restart(self):
@@ -68,34 +340,62 @@ class ChessBase():
 class ChessReviewer(ChessBase):
     """Allows Reviewing a certain Variation"""
 
-    def run_visited_moves(self, run_moves):
-        for move in run_moves:
-            self.next_move(move)
+    def resume(self, cursor):
+        with METRICS.timer('resume'):
+            self.goto(cursor)
+        return self.cursor
         
     def undo_move(self):
-        self.state = self.state.parent
+        parent_id = self.tree.parent(self.node_id)
+        if parent_id >= 0:
+            self.node_id = parent_id
 
     def restart(self):
-        self.state = ChessBase.read_pgn_file(self.pgn_path)
+        self.node_id = 0
+        return self.cursor
 
 class ChessPractice(ChessBase):
+    """
+    Allows Practicing a certain Variation.
+
+    Opponent replies are random unless a line is followed (see `follow`),
+    then they stay on that line for as long as the player does.
+    """
+
+    def __init__(self, pgn_file, color, size=CHESS_BOARD_SIZE):
+        super().__init__(pgn_file, color, size)
+        self.line = frozenset()
+
+    def follow(self, cursor):
+        """Follows the line ending at the node of `cursor` ([tree version, leaf node ID])."""
+        line = set()
+        if cursor and cursor[0] == self.tree.version and 0 <= cursor[1] < len(self.tree):
+            node_id = cursor[1]
+            while node_id >= 0:
+                line.add(node_id)
+                node_id = self.tree.parent(node_id)
+        self.line = frozenset(line)
 
-    def run_visited_moves(self, run_moves):
-        for move in run_moves:
-            self.next_move(move)
-        if self.color != get_current_color(run_moves):
-            opp_move = self.opponent_move()
-            if opp_move:
-                self.next_move(opp_move)
-                run_moves.append(opp_move)
-        return run_moves
+    def resume(self, cursor):
+        with METRICS.timer('resume'):
+            self.goto(cursor)
+            if self.color != get_current_color(self.ply):
+                opp_move = self.opponent_move()
+                if opp_move:
+                    self.next_move(opp_move)
+        return self.cursor
         
     def check_if_correct(self, move):
         return True if move in self.possible_moves else False
     
     def opponent_move(self):
         moves = self.possible_moves
-        return random.choice(moves) if moves else None
+        if not moves:
+            return None
+        for index, child in enumerate(self.tree.children(self.node_id)):
+            if child in self.line:
+                return moves[index]
+        return random.choice(moves)
     
     def player_move(self, move):
         self.next_move(move)
@@ -104,7 +404,5 @@ class ChessPractice(ChessBase):
         return opp_move
     
     def restart(self):
-        self.state = ChessBase.read_pgn_file(self.pgn_path)
-        moves = self.run_visited_moves([])
-        return moves
+        return self.resume(None)
         
\ No newline at end of file
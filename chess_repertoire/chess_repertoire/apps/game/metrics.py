@@ -0,0 +1,129 @@
+import contextvars
+import threading
+import time
+
+class NullTimer():
+    """Timer handed out while metrics are disabled: entering it does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Timer():
+    __slots__ = ('metrics', 'phase', 'start')
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.phase, time.perf_counter() - self.start)
+        return False
+
+class Metrics():
+    """
+    Process-wide timers and counters of the game layer.
+
+    `timer(phase)` measures a block of code and `increment(event)` counts an
+    event. Phases timed while a request is being handled (between
+    `begin_request` and `end_request`) are also summed per request, for
+    Server-Timing headers. The phases of a request are held in a context
+    variable, so they follow async requests into their worker threads. While
+    disabled, hooks return right away.
+    """
+
+    PREFIX = 'chess_repertoire'
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._phases = {}
+        self._requests = {}
+        self._events = {}
+        self._lock = threading.Lock()
+        self._request_phases = contextvars.ContextVar('request_phases', default=None)
+
+    def timer(self, phase):
+        return Timer(self, phase) if self.enabled else NULL_TIMER
+
+    def observe(self, phase, seconds):
+        with self._lock:
+            summary = self._phases.setdefault(phase, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+        phases = self._request_phases.get()
+        if phases is not None:
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def increment(self, event, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._events[event] = self._events.get(event, 0) + value
+
+    def begin_request(self):
+        self._request_phases.set({})
+
+    def end_request(self, view, seconds):
+        """Records the duration of a request and returns the time of each of its phases."""
+        phases = self._request_phases.get()
+        self._request_phases.set(None)
+        with self._lock:
+            summary = self._requests.setdefault(view, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+        return phases
+
+    def reset(self):
+        with self._lock:
+            self._phases.clear()
+            self._requests.clear()
+            self._events.clear()
+
+    def export(self, caches=None):
+        """Prometheus text exposition of the metrics and of the given cache `stats`."""
+        prefix = Metrics.PREFIX
+        with self._lock:
+            phases = sorted(self._phases.items())
+            requests = sorted(self._requests.items())
+            events = sorted(self._events.items())
+
+        lines = []
+        for name, label, summaries, description in (
+            ('phase_seconds', 'phase', phases, 'Time spent in each phase of the game layer.'),
+            ('request_seconds', 'view', requests, 'Time spent handling requests, per view.'),
+        ):
+            lines += [f'# HELP {prefix}_{name} {description}', f'# TYPE {prefix}_{name} summary']
+            for value, (count, seconds) in summaries:
+                lines.append(f'{prefix}_{name}_count{{{label}="{value}"}} {count}')
+                lines.append(f'{prefix}_{name}_sum{{{label}="{value}"}} {seconds:.6f}')
+
+        lines += [f'# HELP {prefix}_events_total Game events.', f'# TYPE {prefix}_events_total counter']
+        lines += [f'{prefix}_events_total{{event="{event}"}} {count}' for event, count in events]
+
+        for name, field, kind, description in (
+            ('cache_hits_total', 'hits', 'counter', 'Cache lookups served from memory.'),
+            ('cache_misses_total', 'misses', 'counter', 'Cache lookups that had to load or render.'),
+            ('cache_entries', 'entries', 'gauge', 'Entries held by the cache.'),
+            ('cache_bytes', 'size', 'gauge', 'Bytes held by the cache.'),
+        ):
+            lines += [f'# HELP {prefix}_{name} {description}', f'# TYPE {prefix}_{name} {kind}']
+            for cache, stats in sorted((caches or {}).items()):
+                lines.append(f'{prefix}_{name}{{cache="{cache}"}} {stats[field]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def server_timing(phases, total):
+        """Server-Timing header value of the phases of a request (durations in ms)."""
+        entries = [f'{phase};dur={seconds * 1000:.2f}' for phase, seconds in sorted(phases.items())]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+METRICS = Metrics()
@@ -0,0 +1,85 @@
+import heapq
+import threading
+import time
+
+from chess_repertoire.apps.repertoire.constants import DRILL_INDEX_MAX_AGE
+
+class DueIndex():
+    """
+    In-memory priority index of lines by due time.
+
+    Lines are kept in a min-heap across the whole repertoire and in one heap
+    per variation (their `scope`), so the next due line of either is found in
+    O(log n). Updating a line pushes a new entry and leaves the old one in
+    place: stale entries are dropped when they reach the top, and heaps are
+    rebuilt once they hold as many stale entries as live ones. The index is
+    reloaded after `max_age` seconds so it catches up with other processes.
+    """
+
+    def __init__(self, max_age=DRILL_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._due = {}
+        self._heaps = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self._due)
+
+    @property
+    def expired(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at > self.max_age
+
+    def load(self, entries):
+        """Replaces the index with the `(line, scope, due)` entries given."""
+        due, heaps = {}, {None: []}
+        for line, scope, timestamp in entries:
+            due[line] = (timestamp, scope)
+            heaps[None].append((timestamp, line))
+            heaps.setdefault(scope, []).append((timestamp, line))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        with self._lock:
+            self._due, self._heaps = due, heaps
+            self.loaded_at = time.monotonic()
+
+    def update(self, line, scope, timestamp):
+        with self._lock:
+            self._due[line] = (timestamp, scope)
+            for key in (None, scope):
+                heap = self._heaps.setdefault(key, [])
+                heapq.heappush(heap, (timestamp, line))
+                if len(heap) > 2 * len(self._due) + 16:
+                    self._rebuild()
+
+    def discard(self, line):
+        with self._lock:
+            self._due.pop(line, None)
+
+    def peek(self, scope=None):
+        """`(line, due)` of the next due line of `scope` (the whole index by default), or None."""
+        with self._lock:
+            heap = self._heaps.get(scope, [])
+            while heap:
+                timestamp, line = heap[0]
+                entry = self._due.get(line)
+                if entry is not None and entry[0] == timestamp and scope in (None, entry[1]):
+                    return line, timestamp
+                heapq.heappop(heap)
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._due, self._heaps = {}, {}
+            self.loaded_at = None
+
+    def _rebuild(self):
+        heaps = {None: []}
+        for line, (timestamp, scope) in self._due.items():
+            heaps[None].append((timestamp, line))
+            heaps.setdefault(scope, []).append((timestamp, line))
+        for heap in heaps.values():
+            heapq.heapify(heap)
+        self._heaps = heaps
+
+DUE_INDEX = DueIndex()
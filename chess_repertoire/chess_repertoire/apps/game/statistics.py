@@ -1,90 +1,197 @@
+import time
+import uuid
+
 from datetime import datetime
 
+from chess_repertoire.apps.repertoire.constants import PRACTICE_HISTORY_SIZE
+
+# -- Compact session record -- #
+# Statistics are stored as a flat list instead of a dictionary: times are
+# integer seconds (the start as an epoch, the rest relative to it) and every
+# history entry is a single integer `elapsed << 9 | move_id << 1 | correct`,
+# where `move_id` points into a small table of the SAN moves played. The
+# history is a ring buffer of `PRACTICE_HISTORY_SIZE` entries. The attempt
+# key identifies the practice in the database until the attempt is ended.
+(
+    OPENING, SLUG, START, LAST_ACTIVITY, CORRECT, INCORRECT, HINTS, COMPLETED,
+    HISTORY, POSITION, MOVES, ATTEMPT, VARIATION
+) = range(13)
+RECORD_SIZE = 13
+MAX_MOVES = 128
+
 class PracticeStatistics:
     """
     Static methods for managing practice session statistics in Django sessions.
 
-    All methods operate on request.session['practice_stats'] dictionary.
-    Statistics are tracked per variation and reset when switching variations
-    or navigating away from practice mode.
+    All methods operate on request.session['practice_stats'], a compact record
+    that `get_stats` expands into a dictionary. Statistics are tracked per
+    variation and reset when switching variations or navigating away from
+    practice mode.
     """
 
     SESSION_KEY = 'practice_stats'
 
     @staticmethod
-    def initialize_stats(session, opening_name, variation_slug):
+    def initialize_stats(session, opening_name, variation_slug, variation_id=None):
         """Initialize fresh statistics for a new practice session."""
-        now = datetime.now().isoformat()
-
-        session[PracticeStatistics.SESSION_KEY] = {
-            'variation_slug': variation_slug,
-            'opening_name': opening_name,
-            'start_time': now,
-            'last_activity': now,
-            'correct_moves': 0,
-            'incorrect_moves': 0,
-            'hints_used': 0,
-            'completed': False,
-            'move_history': []
-        }
+        session[PracticeStatistics.SESSION_KEY] = [
+            opening_name, variation_slug, int(time.time()), 0, 0, 0, 0, 0, [], 0, [],
+            uuid.uuid4().hex, variation_id
+        ]
         session.modified = True
 
     @staticmethod
     def get_stats(session):
         """Retrieve current statistics from session."""
-        return session.get(PracticeStatistics.SESSION_KEY)
+        record = PracticeStatistics._get_record(session)
+        if not record:
+            return None
+
+        start, moves, history = record[START], record[MOVES], record[HISTORY]
+        position = record[POSITION]
+        return {
+            'variation_slug': record[SLUG],
+            'opening_name': record[OPENING],
+            'start_time': PracticeStatistics._isoformat(start),
+            'last_activity': PracticeStatistics._isoformat(start + record[LAST_ACTIVITY]),
+            'correct_moves': record[CORRECT],
+            'incorrect_moves': record[INCORRECT],
+            'hints_used': record[HINTS],
+            'completed': bool(record[COMPLETED]),
+            'attempt': record[ATTEMPT],
+            'variation_id': record[VARIATION],
+            'move_history': [
+                {
+                    'move': moves[entry >> 1 & 0xFF],
+                    'correct': bool(entry & 1),
+                    'timestamp': PracticeStatistics._isoformat(start + (entry >> 9))
+                }
+                for entry in history[position:] + history[:position]
+            ]
+        }
 
     @staticmethod
     def record_move(session, move, correct):
         """Record a move attempt (correct or incorrect)."""
-        stats = PracticeStatistics.get_stats(session)
-        if not stats:
+        record = PracticeStatistics._get_record(session)
+        if not record:
             return
 
         # Update counters
-        if correct:
-            stats['correct_moves'] += 1
-        else:
-            stats['incorrect_moves'] += 1
+        record[CORRECT if correct else INCORRECT] += 1
 
-        # Update activity timestamp
-        stats['last_activity'] = datetime.now().isoformat()
+        # Update activity time
+        elapsed = PracticeStatistics._touch(record)
 
-        # Record in move history
-        stats['move_history'].append({
-            'move': move,
-            'correct': correct,
-            'timestamp': stats['last_activity']
-        })
+        # Record in move history, overwriting the oldest entry once full
+        entry = elapsed << 9 | PracticeStatistics._move_id(record, move) << 1 | int(correct)
+        history, position = record[HISTORY], record[POSITION]
+        if len(history) < PRACTICE_HISTORY_SIZE:
+            history.append(entry)
+        else:
+            history[position] = entry
+        record[POSITION] = (position + 1) % PRACTICE_HISTORY_SIZE
 
-        session[PracticeStatistics.SESSION_KEY] = stats
         session.modified = True
 
     @staticmethod
     def record_hint(session):
         """Record hint usage."""
-        stats = PracticeStatistics.get_stats(session)
-        if not stats:
+        record = PracticeStatistics._get_record(session)
+        if not record:
             return
 
-        stats['hints_used'] += 1
-        stats['last_activity'] = datetime.now().isoformat()
-
-        session[PracticeStatistics.SESSION_KEY] = stats
+        record[HINTS] += 1
+        PracticeStatistics._touch(record)
         session.modified = True
 
     @staticmethod
     def mark_completed(session):
         """Mark practice session as completed."""
-        stats = PracticeStatistics.get_stats(session)
-        if not stats:
+        record = PracticeStatistics._get_record(session)
+        if not record:
             return
 
-        stats['completed'] = True
-        stats['last_activity'] = datetime.now().isoformat()
+        record[COMPLETED] = 1
+        PracticeStatistics._touch(record)
+        session.modified = True
+
+    @staticmethod
+    def get_attempt(session):
+        """Key of the attempt of the practice, None once it is ended."""
+        record = PracticeStatistics._get_record(session)
+        return record[ATTEMPT] if record else None
 
-        session[PracticeStatistics.SESSION_KEY] = stats
+    @staticmethod
+    def get_progress(session):
+        """Attempt key and counters of the practice, to tell whether a request changed them."""
+        record = PracticeStatistics._get_record(session)
+        return (record[ATTEMPT], *record[CORRECT:COMPLETED + 1]) if record else None
+
+    @staticmethod
+    def get_attempt_stats(session):
+        """
+        Statistics of the attempt of the practice so far, with the start and
+        last activity as epoch seconds, or None if it was already ended.
+        """
+        record = PracticeStatistics._get_record(session)
+        if not record or record[ATTEMPT] is None:
+            return None
+
+        stats = PracticeStatistics.get_stats(session)
+        stats['started_at'] = record[START]
+        stats['ended_at'] = record[START] + record[LAST_ACTIVITY]
+        return stats
+
+    @staticmethod
+    def end_attempt(session):
+        """Ends the attempt of the practice and returns its statistics (see `get_attempt_stats`)."""
+        stats = PracticeStatistics.get_attempt_stats(session)
+        if stats is None:
+            return None
+
+        PracticeStatistics._get_record(session)[ATTEMPT] = None
         session.modified = True
+        return stats
+
+    @staticmethod
+    def _get_record(session):
+        record = session.get(PracticeStatistics.SESSION_KEY)
+        # -- Records in a former format are discarded -- #
+        return record if isinstance(record, list) and len(record) == RECORD_SIZE else None
+
+    @staticmethod
+    def _touch(record):
+        """Updates the last activity and returns the seconds elapsed since the start."""
+        elapsed = max(int(time.time()) - record[START], 0)
+        record[LAST_ACTIVITY] = elapsed
+        return elapsed
+
+    @staticmethod
+    def _move_id(record, move):
+        moves = record[MOVES]
+        if move in moves:
+            return moves.index(move)
+        if len(moves) == MAX_MOVES:
+            PracticeStatistics._compact_moves(record)
+            moves = record[MOVES]
+        moves.append(move)
+        return len(moves) - 1
+
+    @staticmethod
+    def _compact_moves(record):
+        """Drops the moves no longer referenced by the history and renumbers the entries."""
+        moves, history = record[MOVES], record[HISTORY]
+        used = sorted({entry >> 1 & 0xFF for entry in history})
+        renumber = {move_id: index for index, move_id in enumerate(used)}
+        record[MOVES] = [moves[move_id] for move_id in used]
+        record[HISTORY] = [
+            entry & ~(0xFF << 1) | renumber[entry >> 1 & 0xFF] << 1 for entry in history
+        ]
+
+    @staticmethod
+    def _isoformat(timestamp):
+        return datetime.fromtimestamp(timestamp).isoformat()
 
     @staticmethod
     def calculate_accuracy(stats):
@@ -0,0 +1,383 @@
+import chess
+import chess.pgn as pgn
+import os
+import struct
+import sys
+
+from array import array
+
+from chess_repertoire.apps.game.metrics import METRICS
+from chess_repertoire.apps.game.utils import NAG_TO_EXPRESSION, zobrist_key
+from chess_repertoire.apps.repertoire.constants import COMPILED_TREE_SUFFIX, TREE_MEMO_MAX_BYTES
+from pgn_analyzer.pgn_stream import iter_games
+
+# -- Format -- #
+# Header: magic, format version, source mtime (ns), source size, node count and
+# string blob length. It is followed by the per-node arrays (struct-of-arrays)
+# and a single UTF-8 blob holding every SAN, FEN and comment. The string of
+# index `k` is `blob[offsets[k]:offsets[k + 1]]`, where SANs take indexes
+# [0, n), FENs [n, 2n) and comments [2n, 3n).
+MAGIC = b'CRTREE'
+FORMAT_VERSION = 4
+HEADER = struct.Struct('<6sHqqII')
+ARRAYS = (
+    ('parents', 'i'),
+    ('first_children', 'i'),
+    ('next_siblings', 'i'),
+    ('plies', 'H'),
+    ('moves', 'H'),
+    ('nags', 'B'),
+    ('flags', 'B'),
+)
+
+# -- Node flags -- #
+FLAG_CHECKMATE = 1
+
+# -- Move packing -- #
+def pack_move(move):
+    if move is None:
+        return 0
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+def unpack_move(packed):
+    if not packed:
+        return None
+    return chess.Move(packed & 0x3F, packed >> 6 & 0x3F, packed >> 12 or None)
+
+# -- Compiled Tree -- #
+class CompiledTree():
+    """
+    Array-backed game tree built from a PGN, addressed by pre-order node IDs.
+
+    Every node is an integer: the root is 0 and children follow their parent,
+    so the arrays can be read directly from the sidecar file without building
+    python-chess GameNode objects. Strings are decoded lazily from the blob and
+    the replies of a node (hints and SANs) are memoized on first access. The
+    memo is bounded to `memo_max_bytes` and emptied when full; `nbytes`, the
+    weight of the tree in the cache, includes that budget.
+    """
+
+    def __init__(self, data, version=None):
+        header = HEADER.unpack_from(data)
+        if header[0] != MAGIC or header[1] != FORMAT_VERSION:
+            raise ValueError('Not a compiled tree or unsupported format version')
+        _, _, self.source_mtime, self.source_size, count, blob_size = header
+        self.version = version
+        self.memo_max_bytes = min(len(data), TREE_MEMO_MAX_BYTES)
+        self.nbytes = len(data) + self.memo_max_bytes
+        self._replies = {}
+        self._memo_bytes = 0
+
+        view, offset = memoryview(data), HEADER.size
+        for name, typecode in ARRAYS:
+            values = array(typecode)
+            end = offset + count * values.itemsize
+            values.frombytes(view[offset:end])
+            setattr(self, name, values)
+            offset = end
+        self.offsets = array('I')
+        end = offset + (3 * count + 1) * self.offsets.itemsize
+        self.offsets.frombytes(view[offset:end])
+        self.blob = bytes(view[end:end + blob_size])
+        if sys.byteorder != 'little':
+            for name, _ in ARRAYS:
+                getattr(self, name).byteswap()
+            self.offsets.byteswap()
+
+    def __len__(self):
+        return len(self.parents)
+
+    def _string(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].decode()
+
+    def parent(self, node_id):
+        return self.parents[node_id]
+
+    def ply(self, node_id):
+        return self.plies[node_id]
+
+    def children(self, node_id):
+        children, child = [], self.first_children[node_id]
+        while child >= 0:
+            children.append(child)
+            child = self.next_siblings[child]
+        return tuple(children)
+
+    def child_sans(self, node_id):
+        return self._replies_of(node_id)[1]
+
+    def hints(self, node_id):
+        """From/to squares and SAN of every reply stored under `node_id`."""
+        return self._replies_of(node_id)[0]
+
+    def _replies_of(self, node_id):
+        replies = self._replies.get(node_id)
+        if replies is None:
+            hints = []
+            for child in self.children(node_id):
+                move = self.move(child)
+                hints.append({
+                    'from': move.from_square,
+                    'to': move.to_square,
+                    'san': self.san(child)
+                })
+            hints = tuple(hints)
+            replies = (hints, tuple(hint['san'] for hint in hints))
+            size = memo_size(replies)
+            # -- Emptied when full: the memo only spares decoding the SANs again -- #
+            if self._memo_bytes + size > self.memo_max_bytes:
+                self._replies.clear()
+                self._memo_bytes = 0
+            if size <= self.memo_max_bytes:
+                self._replies[node_id] = replies
+                self._memo_bytes += size
+        return replies
+
+    def move(self, node_id):
+        return unpack_move(self.moves[node_id])
+
+    def nag(self, node_id):
+        return self.nags[node_id]
+
+    def is_checkmate(self, node_id):
+        return bool(self.flags[node_id] & FLAG_CHECKMATE)
+
+    def board(self, node_id):
+        """Fresh board of `node_id`, built from its stored FEN instead of replaying moves."""
+        with METRICS.timer('board_build'):
+            return chess.Board(self.fen(node_id))
+
+    def subtree(self, node_id, plies, max_nodes):
+        """
+        Nodes up to `plies` moves below `node_id`, breadth first, as parallel lists.
+
+        `parents` holds the index of each node's parent within the lists (-1 for
+        `node_id`). The walk stops early, flagging `truncated`, once `max_nodes`
+        nodes are collected.
+        """
+        ids, parents, truncated = [node_id], [-1], False
+        last_ply = self.ply(node_id) + plies
+        index = 0
+        while index < len(ids) and not truncated:
+            if self.ply(ids[index]) < last_ply:
+                for child in self.children(ids[index]):
+                    if len(ids) == max_nodes:
+                        truncated = True
+                        break
+                    ids.append(child)
+                    parents.append(index)
+            index += 1
+        return {
+            'ids': ids,
+            'parents': parents,
+            'san': [self.san(node) for node in ids],
+            'uci': [self.move(node).uci() if self.moves[node] else '' for node in ids],
+            'fen': [self.fen(node) for node in ids],
+            'nags': [self.nag(node) for node in ids],
+            'checkmate': [self.is_checkmate(node) for node in ids],
+            'truncated': truncated
+        }
+
+    def metadata(self):
+        """Size and shape of the tree: moves, lines (leaves), depth, branching and final FENs."""
+        leaves = [node_id for node_id in range(len(self)) if self.first_children[node_id] < 0]
+        inner_nodes = len(self) - len(leaves)
+        return {
+            'ply_count': len(self) - 1,
+            'line_count': len(leaves) if inner_nodes else 0,
+            'max_depth': max(self.ply(node_id) for node_id in leaves),
+            'branching_factor': round((len(self) - 1) / inner_nodes, 2) if inner_nodes else 0,
+            'final_positions': [self.fen(node_id) for node_id in leaves] if inner_nodes else []
+        }
+
+    def positions(self):
+        """
+        Yields the node ID, SAN path, Zobrist key and side to move of every node.
+
+        Boards are replayed from the root rather than parsed from each FEN: the
+        last child of a node takes over its board, earlier ones push on a copy.
+        """
+        paths, boards = [], {}
+        for node_id in range(len(self)):
+            # -- Parents precede their children, so their path and board are already known -- #
+            parent_id = self.parent(node_id)
+            if parent_id < 0:
+                paths.append('')
+                board = chess.Board(self.fen(node_id))
+            else:
+                paths.append(f'{paths[parent_id]} {self.san(node_id)}'.strip())
+                if self.next_siblings[node_id] < 0:
+                    board = boards.pop(parent_id)
+                else:
+                    board = boards[parent_id].copy(stack=False)
+                board.push(self.move(node_id))
+            if self.first_children[node_id] >= 0:
+                boards[node_id] = board
+            yield node_id, paths[node_id], zobrist_key(board), board.turn
+
+    def lines(self):
+        """Yields the leaf node ID and SAN path of every line (root to leaf) of the tree."""
+        for node_id in range(1, len(self)):
+            if self.first_children[node_id] < 0:
+                yield node_id, self.path(node_id)
+
+    def path(self, node_id):
+        sans = []
+        while node_id > 0:
+            sans.append(self.san(node_id))
+            node_id = self.parent(node_id)
+        return ' '.join(reversed(sans))
+
+    def san(self, node_id):
+        return self._string(node_id)
+
+    def fen(self, node_id):
+        return self._string(len(self) + node_id)
+
+    def comment(self, node_id):
+        return self._string(2 * len(self) + node_id)
+
+# -- Compilation -- #
+def memo_size(replies):
+    """Approximate bytes held by the memoized replies of a node."""
+    hints, sans = replies
+    size = sys.getsizeof(replies) + sys.getsizeof(hints) + sys.getsizeof(sans)
+    for hint in hints:
+        size += sys.getsizeof(hint) + sys.getsizeof(hint['san'])
+    return size
+
+def sidecar_path(pgn_file):
+    return f'{pgn_file}{COMPILED_TREE_SUFFIX}'
+
+def compile_game(game, source_mtime=0, source_size=0):
+    """Serializes a python-chess game into the compiled tree format."""
+    parents, plies, moves = array('i'), array('H'), array('H')
+    nags, flags = array('B'), array('B')
+    sans, fens, comments = [], [], []
+
+    # -- Pre-order walk keeping the board before each node's move -- #
+    pending = [(game, -1, game.board())]
+    while pending:
+        node, parent_id, board = pending.pop()
+        if node.move is not None:
+            sans.append(board.san(node.move))
+            board.push(node.move)
+        else:
+            sans.append('')
+        node_id = len(parents)
+        parents.append(parent_id)
+        plies.append(plies[parent_id] + 1 if parent_id >= 0 else 0)
+        moves.append(pack_move(node.move))
+        # -- A single NAG is kept per node: the lowest move assessment (NAGs are a set), positional ones are ignored -- #
+        nags.append(min((nag for nag in node.nags if nag in NAG_TO_EXPRESSION), default=0))
+        flags.append(FLAG_CHECKMATE if board.is_checkmate() else 0)
+        fens.append(board.fen())
+        comments.append(node.comment)
+        for child in reversed(node.variations):
+            pending.append((child, node_id, board.copy(stack=False)))
+
+    count = len(parents)
+    first_children = array('i', [-1] * count)
+    next_siblings = array('i', [-1] * count)
+    for node_id in range(count - 1, 0, -1):
+        parent_id = parents[node_id]
+        next_siblings[node_id] = first_children[parent_id]
+        first_children[parent_id] = node_id
+
+    offsets, chunks, position = array('I', [0]), [], 0
+    for text in sans + fens + comments:
+        chunk = text.encode()
+        chunks.append(chunk)
+        position += len(chunk)
+        offsets.append(position)
+    blob = b''.join(chunks)
+
+    columns = [parents, first_children, next_siblings, plies, moves, nags, flags, offsets]
+    if sys.byteorder != 'little':
+        for column in columns:
+            column.byteswap()
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, source_mtime, source_size, count, len(blob))
+    return b''.join([header] + [column.tobytes() for column in columns] + [blob])
+
+def merge_games(games):
+    """
+    Merges a stream of games into the tree of the first one.
+
+    Moves already in the tree are shared and new ones are grafted with their
+    whole line. Games that do not start from the first game's position cannot
+    be part of the same tree and are skipped.
+    """
+    merged = None
+    for game in games:
+        if merged is None:
+            merged, start = game, game.board().fen()
+            continue
+        if game.board().fen() != start:
+            continue
+        pending = [(game, merged)]
+        while pending:
+            source, target = pending.pop()
+            target.comment = target.comment or source.comment
+            target.nags.update(source.nags)
+            for child in list(source.variations):
+                if target.has_variation(child.move):
+                    pending.append((child, target.variation(child.move)))
+                else:
+                    child.parent = target
+                    target.variations.append(child)
+    return merged or pgn.Game()
+
+def compile_pgn(pgn_file):
+    """Compiles every game of `pgn_file` into one tree and writes it to its sidecar file."""
+    stat = os.stat(pgn_file)
+    with METRICS.timer('pgn_parse'):
+        game = merge_games(iter_games(pgn_file))
+    with METRICS.timer('tree_compile'):
+        data = compile_game(game, stat.st_mtime_ns, stat.st_size)
+
+    write_tree(pgn_file, data)
+    return data
+
+def stamp_tree(data, stat):
+    """Compiled tree `data` marked as built from a source file with the given `os.stat` result."""
+    _, _, _, _, count, blob_size = HEADER.unpack_from(data)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, stat.st_mtime_ns, stat.st_size, count, blob_size)
+    return header + data[HEADER.size:]
+
+def write_tree(pgn_file, data):
+    # -- Atomic replace so readers never see a partial sidecar -- #
+    target = sidecar_path(pgn_file)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, target)
+
+def is_compiled(pgn_file):
+    """Whether the sidecar of `pgn_file` was compiled from its current contents, reading its header only."""
+    try:
+        stat = os.stat(pgn_file)
+        with open(sidecar_path(pgn_file), 'rb') as file:
+            header = HEADER.unpack(file.read(HEADER.size))
+    except (OSError, struct.error):
+        return False
+    return header[:2] == (MAGIC, FORMAT_VERSION) and header[2:4] == (stat.st_mtime_ns, stat.st_size)
+
+def load_tree(pgn_file, version=None):
+    """Loads the compiled tree of `pgn_file`, compiling it if missing or outdated."""
+    stat = os.stat(pgn_file)
+    try:
+        with METRICS.timer('tree_load'):
+            with open(sidecar_path(pgn_file), 'rb') as file:
+                data = file.read()
+            tree = CompiledTree(data, version)
+        if (tree.source_mtime, tree.source_size) == (stat.st_mtime_ns, stat.st_size):
+            return tree
+    except (OSError, ValueError, struct.error):
+        pass
+    return CompiledTree(compile_pgn(pgn_file), version)
+
+def discard_tree(pgn_file):
+    try:
+        os.remove(sidecar_path(pgn_file))
+    except OSError:
+        pass
@@ -1,5 +1,6 @@
 from chess_repertoire.apps.repertoire.constants import REPERTOIRE_ROOT
 import chess.pgn as pgn
+import chess.polyglot as polyglot
 
 # -- Constants -- #
 NAG_TO_EXPRESSION = {
@@ -13,11 +14,16 @@ NAG_TO_EXPRESSION = {
 }
 
 # -- Util Functions -- #
-def get_current_turn(list_of_moves):
-    return False if len(list_of_moves) % 2 == 0 else True
+def get_current_turn(ply):
+    return False if ply % 2 == 0 else True
 
-def get_current_color(list_of_moves):
-    return 1 if get_current_turn(list_of_moves) else 0
+def get_current_color(ply):
+    return 1 if get_current_turn(ply) else 0
+
+def zobrist_key(board):
+    # -- Zobrist hash as a signed 64-bit integer, the range of a BigIntegerField -- #
+    zobrist = polyglot.zobrist_hash(board)
+    return zobrist - (1 << 64) if zobrist >= 1 << 63 else zobrist
 
 def read_pgn_file(pgn_path):
     with open(REPERTOIRE_ROOT + pgn_path, 'r') as file:
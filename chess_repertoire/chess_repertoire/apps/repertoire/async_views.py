@@ -0,0 +1,71 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, connections
+
+from chess_repertoire.apps.game.metrics import METRICS
+from .constants import ASYNC_VIEW_WORKERS
+from .middleware import time_query
+
+# -- Bounded pool running the blocking work (file reads, PGN parsing, ORM) of the async views -- #
+VIEW_EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_VIEW_WORKERS, thread_name_prefix='repertoire-view')
+
+
+def release_connections():
+    """
+    Closes the DB connections of a worker thread left unusable by a view.
+
+    Usable ones stay open for the next view run by the thread: the pool bounds
+    the connections and reconnecting on every request would cost more than
+    the view itself.
+    """
+    for conn in connections.all():
+        if conn.connection is None:
+            continue
+        if conn.get_autocommit() != conn.settings_dict['AUTOCOMMIT'] or (
+            conn.errors_occurred and not conn.is_usable()
+        ):
+            conn.close()
+        conn.errors_occurred = False
+
+
+def run_view(view, request, *args, **kwargs):
+    """Runs a sync view in a worker thread, timing its queries when metrics are enabled."""
+    try:
+        if METRICS.enabled:
+            with connection.execute_wrapper(time_query):
+                return view(request, *args, **kwargs)
+        return view(request, *args, **kwargs)
+    finally:
+        release_connections()
+
+
+def async_view(view_class, **initkwargs):
+    """
+    Async view serving `view_class` from `VIEW_EXECUTOR`.
+
+    Under ASGI, Django runs every sync view in a single thread, so one slow
+    request holds up the others. The async view hands the request to the pool
+    instead and keeps the event loop free, with the context of the request
+    (e.g. its metrics) copied to the worker thread.
+    """
+    view = view_class.as_view(**initkwargs)
+
+    async def handler(request, *args, **kwargs):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            VIEW_EXECUTOR, functools.partial(context.run, run_view, view, request, *args, **kwargs)
+        )
+
+    handler.view_class = view_class
+    handler.view_initkwargs = initkwargs
+    functools.update_wrapper(handler, view_class, updated=())
+    return handler
+
+
+def ajax_view(view_class):
+    """Async variant of an AJAX view with `ASYNC_VIEWS` (set under ASGI), the sync view otherwise."""
+    return async_view(view_class) if settings.ASYNC_VIEWS else view_class.as_view()
@@ -0,0 +1,171 @@
+import json
+import zipfile
+from pathlib import PurePosixPath
+
+from django.core.files import File
+from django.db.models.fields.files import ImageFieldFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from chess_repertoire.apps.game.tree import discard_tree
+from pgn_analyzer.pgn_stream import iter_games
+from .constants import BACKUP_CHUNK_SIZE, BACKUP_FORMAT_VERSION
+from .models import Opening, Variation
+from .thumbnails import discard_thumbnails, make_thumbnails
+
+MANIFEST_NAME = 'manifest.json'
+MERGED_PGN_NAME = 'repertoire.pgn'
+MEDIA_FOLDER = 'media'
+
+OPENING_FIELDS = ('name', 'description', 'color', 'difficulty', 'category')
+VARIATION_FIELDS = ('name', 'description', 'on_turn', 'nature')
+
+
+class StreamBuffer():
+    """Write-only file object holding what ZipFile writes until the stream drains it."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+# -- Helper functions -- #
+def archive_name(name):
+    return f'{MEDIA_FOLDER}/{name}'
+
+def opening_record(opening):
+    record = {field: getattr(opening, field) for field in OPENING_FIELDS}
+    record['image'] = opening.image.name
+    return record
+
+def variation_record(variation):
+    record = {field: getattr(variation, field) for field in VARIATION_FIELDS}
+    record.update({
+        'opening': variation.opening.name,
+        'pgn_file': variation.pgn_file.name,
+        'image_file': variation.image_file.name
+    })
+    return record
+
+def stream_file(archive, buffer, name):
+    """Copies a stored file into the archive chunk by chunk, yielding the compressed bytes."""
+    try:
+        source = default_storage.open(name, 'rb')
+    except FileNotFoundError:
+        return
+    with source, archive.open(archive_name(name), 'w') as entry:
+        for chunk in iter(lambda: source.read(BACKUP_CHUNK_SIZE), b''):
+            entry.write(chunk)
+            yield buffer.drain()
+
+# -- Export -- #
+def iter_backup(merged_pgn=False):
+    """
+    Streams a zip archive of the whole repertoire.
+
+    The archive holds a manifest of every Opening and Variation, their files
+    under `media/` and, with `merged_pgn`, every game in a single PGN tagged
+    with its Opening and Variation. Rows are read with `iterator()` and files
+    in chunks, so no file is ever held in memory: only the directory entry of
+    each file (a few hundred bytes) is kept until the archive is closed.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        with archive.open(MANIFEST_NAME, 'w') as entry:
+            entry.write(f'{{"version": {BACKUP_FORMAT_VERSION}, "openings": ['.encode())
+            for index, opening in enumerate(Opening.objects.iterator()):
+                entry.write(f'{", " if index else ""}{json.dumps(opening_record(opening))}'.encode())
+                yield buffer.drain()
+            entry.write(b'], "variations": [')
+            for index, variation in enumerate(Variation.objects.select_related('opening').iterator()):
+                entry.write(f'{", " if index else ""}{json.dumps(variation_record(variation))}'.encode())
+                yield buffer.drain()
+            entry.write(b']}')
+        yield buffer.drain()
+
+        for opening in Opening.objects.iterator():
+            yield from stream_file(archive, buffer, opening.image.name)
+        for variation in Variation.objects.iterator():
+            yield from stream_file(archive, buffer, variation.pgn_file.name)
+            yield from stream_file(archive, buffer, variation.image_file.name)
+
+        if merged_pgn:
+            with archive.open(MERGED_PGN_NAME, 'w') as entry:
+                for variation in Variation.objects.select_related('opening').iterator():
+                    for game in iter_games(variation.pgn_file.path):
+                        game.headers['Opening'] = variation.opening.name
+                        game.headers['Variation'] = variation.name
+                        entry.write(f'{game}\n\n'.encode())
+                        yield buffer.drain()
+    yield buffer.drain()
+
+# -- Restore -- #
+def restore_backup(archive_file):
+    """
+    Restores the Openings and Variations of a backup archive.
+
+    Rows whose name already exists are skipped, the others are saved as if
+    they were uploaded, so their trees are compiled and indexed again and
+    their thumbnails made. Returns
+    the number of restored Openings and Variations and the skipped names.
+    """
+    stored, skipped = [], []
+    with zipfile.ZipFile(archive_file) as archive:
+        manifest = json.loads(archive.read(MANIFEST_NAME))
+        if manifest.get('version') != BACKUP_FORMAT_VERSION:
+            raise ValueError(f'Unsupported backup version: {manifest.get("version")}')
+        members = set(archive.namelist())
+
+        def restore_file(field, name):
+            if archive_name(name) not in members:
+                raise ValueError(f'{name} is missing from the archive')
+            with archive.open(archive_name(name)) as source:
+                field.save(PurePosixPath(name).name, File(source), save=False)
+            stored.append(field.name)
+            if isinstance(field, ImageFieldFile):
+                make_thumbnails(field.name)
+
+        openings = {opening.name: opening for opening in Opening.objects.all()}
+        variations = set(Variation.objects.values_list('name', flat=True))
+        restored_openings = restored_variations = 0
+        try:
+            with transaction.atomic():
+                for record in manifest['openings']:
+                    if record['name'] in openings:
+                        skipped.append(record['name'])
+                        continue
+                    opening = Opening(**{field: record[field] for field in OPENING_FIELDS})
+                    restore_file(opening.image, record['image'])
+                    opening.save()
+                    openings[opening.name] = opening
+                    restored_openings += 1
+
+                for record in manifest['variations']:
+                    if record['name'] in variations:
+                        skipped.append(record['name'])
+                        continue
+                    variation = Variation(
+                        opening=openings[record['opening']],
+                        **{field: record[field] for field in VARIATION_FIELDS}
+                    )
+                    restore_file(variation.pgn_file, record['pgn_file'])
+                    restore_file(variation.image_file, record['image_file'])
+                    variation.save()
+                    restored_variations += 1
+        except Exception:
+            for name in stored:
+                default_storage.delete(name)
+                discard_tree(default_storage.path(name))
+                discard_thumbnails(name)
+            raise
+    return restored_openings, restored_variations, skipped
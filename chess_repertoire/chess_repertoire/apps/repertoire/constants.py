@@ -2,9 +2,58 @@
 CHESS_BOARD_SIZE = 500
 REPERTOIRE_ROOT = 'chess_repertoire'
 
+# -- Game cache constants -- #
+PGN_CACHE_MAX_BYTES = 64 * 1024 * 1024
+COMPILED_TREE_SUFFIX = '.tree'
+TREE_MEMO_MAX_BYTES = 4 * 1024 * 1024  # Replies memoized per tree (at most its own size), counted in its cache weight
+BOARD_CACHE_MAX_BYTES = 16 * 1024 * 1024
+BOARD_CACHE_DIR = None  # Directory to persist rendered boards, None keeps them in memory only
+BOARD_CACHE_DIR_MAX_BYTES = 256 * 1024 * 1024  # Least recently used renders are removed from the directory past it
+
+# -- Practice constants -- #
+PRACTICE_HISTORY_SIZE = 64
+
+# -- Drill constants -- #
+DRILL_INITIAL_EASE = 2.5
+DRILL_MIN_EASE = 1.3
+DRILL_FIRST_INTERVALS = (1, 3)  # Days before the first and second practice after a clean one
+DRILL_RELEARN_INTERVAL = 10 / (24 * 60)  # Days, a line practiced with mistakes is due again in 10 minutes
+DRILL_INDEX_MAX_AGE = 300  # Seconds before the due index is reloaded, to see the reviews of other processes
+
+# -- Practice history constants -- #
+PRACTICE_FLUSH_SIZE = 200  # Buffered attempts and moves that trigger a write
+PRACTICE_FLUSH_INTERVAL = 5  # Seconds between writes of the buffered attempts and moves
+PRACTICE_WEAKEST_NODES = 20
+
+# -- Position index constants -- #
+POSITION_BATCH_SIZE = 500
+
+# -- Import constants -- #
+IMPORT_BATCH_SIZE = 200
+
+# -- Backup constants -- #
+BACKUP_FORMAT_VERSION = 1
+BACKUP_CHUNK_SIZE = 64 * 1024
+
+# -- Subtree prefetch constants -- #
+SUBTREE_DEFAULT_PLIES = 8
+SUBTREE_MAX_PLIES = 32
+SUBTREE_MAX_NODES = 2000
+SYNC_MAX_ATTEMPTS = 256
+
+# -- Async view constants -- #
+ASYNC_VIEW_WORKERS = 8  # Threads running the async AJAX views, each may hold a DB connection
+
+# -- Thumbnail constants -- #
+THUMBNAIL_DIR = 'thumbs'
+THUMBNAIL_WIDTHS = (300, 600)  # Listing cards are about 280px wide, 600 covers high-density screens
+THUMBNAIL_QUALITY = 82
+THUMBNAIL_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # Seconds, thumbnail URLs change with their source
+
 # -- View constants -- #
 MAX_OPENING_PER_PAGE = 4
 MAX_VARIATION_PER_PAGE = 4
+LISTING_CACHE_TIMEOUT = 60 * 60
 
 # -- Lengths -- #
 MAX_LENGTH = 30
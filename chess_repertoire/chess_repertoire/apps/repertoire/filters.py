@@ -1,5 +1,5 @@
 import django_filters
-from django_filters import CharFilter
+from django_filters import CharFilter, NumberFilter, OrderingFilter
 from .models import Opening, Variation
 
 class OpeningFilter(django_filters.FilterSet):
@@ -13,7 +13,28 @@ class OpeningFilter(django_filters.FilterSet):
 
 class VariationFilter(django_filters.FilterSet):
     name = CharFilter(field_name='name', lookup_expr='icontains')
+    # -- PGN tree metadata -- #
+    min_lines = NumberFilter(field_name='line_count', lookup_expr='gte')
+    max_lines = NumberFilter(field_name='line_count', lookup_expr='lte')
+    min_depth = NumberFilter(field_name='max_depth', lookup_expr='gte')
+    max_depth = NumberFilter(field_name='max_depth', lookup_expr='lte')
+    ordering = OrderingFilter(
+        fields=(
+            ('on_turn', 'on_turn'),
+            ('ply_count', 'plies'),
+            ('line_count', 'lines'),
+            ('max_depth', 'depth'),
+            ('branching_factor', 'branching'),
+        ),
+        field_labels={
+            'on_turn': 'On Turn',
+            'ply_count': 'Moves',
+            'line_count': 'Lines',
+            'max_depth': 'Depth',
+            'branching_factor': 'Branching',
+        }
+    )
 
     class Meta:
         model = Variation
-        fields = ['name', 'on_turn', 'nature']
\ No newline at end of file
+        fields = ['name', 'on_turn', 'nature']
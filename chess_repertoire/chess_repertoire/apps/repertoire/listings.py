@@ -0,0 +1,21 @@
+import hashlib
+
+from django.core.cache import cache
+
+LISTING_VERSION_KEY = 'repertoire:listing_version'
+
+
+def listing_version():
+    return cache.get_or_set(LISTING_VERSION_KEY, 0, None)
+
+def listing_cache_key(path):
+    """Cache key of a rendered listing page, `path` including its filters and page."""
+    digest = hashlib.sha1(path.encode()).hexdigest()
+    return f'repertoire:listing:{listing_version()}:{digest}'
+
+def invalidate_listings():
+    """Bumps the listing version, so every cached listing page is rendered again."""
+    try:
+        cache.incr(LISTING_VERSION_KEY)
+    except ValueError:
+        cache.set(LISTING_VERSION_KEY, 1, None)
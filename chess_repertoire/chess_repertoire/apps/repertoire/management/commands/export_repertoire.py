@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chess_repertoire.apps.repertoire.backup import iter_backup
+
+
+class Command(BaseCommand):
+    help = 'Writes a zip backup of the whole repertoire (manifest, PGN and image files)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the zip archive to write')
+        parser.add_argument('--merged-pgn', action='store_true', help='Also store every game in a single PGN')
+
+    def handle(self, *args, **options):
+        size = 0
+        with open(options['output'], 'wb') as file:
+            for chunk in iter_backup(merged_pgn=options['merged_pgn']):
+                file.write(chunk)
+                size += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Repertoire exported to {options["output"]} ({size} bytes)'))
@@ -0,0 +1,278 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import chess
+import chess.svg as svg
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from chess_repertoire.apps.game.scheduling import DUE_INDEX
+from chess_repertoire.apps.game.tree import CompiledTree, compile_game, sidecar_path, stamp_tree, write_tree
+from chess_repertoire.apps.repertoire.constants import (
+    CHESS_BOARD_SIZE, IMPORT_BATCH_SIZE, MAX_LENGTH, POSITION_BATCH_SIZE
+)
+from chess_repertoire.apps.repertoire.listings import invalidate_listings
+from chess_repertoire.apps.repertoire.models import (
+    DrillLine, Opening, Position, Variation, opening_file_name, variation_file_name
+)
+from pgn_analyzer.pgn_stream import GameIndex
+
+
+# -- Worker (runs in the process pool) -- #
+def prepare_games(index, flipped):
+    """
+    Parses the games of `index` (a GameIndex of the source file) and prepares
+    everything their Variation needs: PGN text, board image, compiled tree
+    (stamped once its file is written), metadata, the nodes to index and the
+    lines to drill.
+    """
+    entries = []
+    for number, game in enumerate(index):
+        data = compile_game(game)
+        tree = CompiledTree(data)
+        mainline = [0]
+        while tree.children(mainline[-1]):
+            mainline.append(tree.children(mainline[-1])[0])
+        entries.append({
+            'headers': dict(game.headers),
+            # -- The game is stored as written in the source, not exported again -- #
+            'pgn': index.read_text(number),
+            'sans': [tree.san(node_id) for node_id in mainline[1:]],
+            'image': svg.board(tree.board(mainline[-1]), flipped=flipped, size=CHESS_BOARD_SIZE),
+            'tree': data,
+            'metadata': tree.metadata(),
+            'positions': list(tree.positions()),
+            'lines': list(tree.lines())
+        })
+    return entries
+
+
+# -- Helper functions -- #
+def header(headers, name):
+    value = headers.get(name, '').strip()
+    return '' if value in ('', '?') else value
+
+def unique_name(name, taken):
+    """`name` cut to MAX_LENGTH, numbered when already taken."""
+    candidate, number = name[:MAX_LENGTH].strip(), 1
+    while candidate.lower() in taken:
+        number += 1
+        suffix = f' {number}'
+        candidate = f'{name[:MAX_LENGTH - len(suffix)].strip()}{suffix}'
+    taken.add(candidate.lower())
+    return candidate
+
+def deviation_ply(trie, sans):
+    """Adds the line `sans` to `trie` and returns the ply where it leaves the lines already there."""
+    node, ply = trie, len(sans)
+    for index, san in enumerate(sans):
+        if san not in node:
+            ply = min(ply, index)
+            node[san] = {}
+        node = node[san]
+    return ply
+
+
+class Command(BaseCommand):
+    help = 'Imports every game of a PGN file (or of the PGN files of a directory) as a Variation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='PGN file or directory of PGN files')
+        parser.add_argument(
+            '--opening', help='Opening of every Variation (by default its Opening header or the file name)'
+        )
+        parser.add_argument('--color', choices=['white', 'black'], default='white', help='Color of new Openings')
+        parser.add_argument(
+            '--difficulty', choices=Opening.Difficulty.values, default=Opening.Difficulty.EASY,
+            help='Difficulty of new Openings'
+        )
+        parser.add_argument(
+            '--category', choices=Opening.Category.values, default=Opening.Category.CLASSIC,
+            help='Category of new Openings'
+        )
+        parser.add_argument(
+            '--nature', choices=Variation.Nature.values, default=Variation.Nature.THEORIC,
+            help='Nature of the Variations'
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes parsing the games')
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Games per parsing task and per file batch'
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Parse and report without writing anything')
+
+    def handle(self, *args, **options):
+        self.start = time.perf_counter()
+        path = Path(options['path'])
+        if path.is_dir():
+            pgn_paths = sorted(path.rglob('*.pgn'))
+        elif path.is_file():
+            pgn_paths = [path]
+        else:
+            raise CommandError(f'{path} does not exist')
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            entries = self.parse(pool, pgn_paths, options)
+        openings, variations = self.plan(entries, options)
+        if options['dry_run']:
+            self.report_plan(openings, variations)
+            return
+        self.write(openings, variations, options)
+
+    def progress(self, step, done, total):
+        self.stdout.write(f'[{time.perf_counter() - self.start:7.2f}s] {step}: {done}/{total}')
+
+    # -- Parsing -- #
+    def parse(self, pool, pgn_paths, options):
+        """Prepares the games of every file in the pool, `batch_size` games per task."""
+        tasks = [
+            (pgn_path, index)
+            for pgn_path in pgn_paths
+            for index in GameIndex(str(pgn_path)).split(options['batch_size'])
+        ]
+        total = sum(len(index) for _, index in tasks)
+
+        flipped = options['color'] == 'black'
+        futures = [pool.submit(prepare_games, index, flipped) for _, index in tasks]
+        entries = []
+        for (pgn_path, _), future in zip(tasks, futures):
+            for entry in future.result():
+                entry['source'] = pgn_path
+                entries.append(entry)
+            self.progress('Parsed games', len(entries), total)
+        return entries
+
+    def plan(self, entries, options):
+        """Names the new Openings and Variations and sets the move where each Variation starts."""
+        openings = {opening.name: opening for opening in Opening.objects.all()}
+        new_openings, self.opening_images = {}, {}
+        taken = {name.lower() for name in Variation.objects.values_list('name', flat=True)}
+        lines, variations = {}, []
+        for entry in entries:
+            headers = entry['headers']
+            opening_name = (
+                options['opening'] or header(headers, 'Opening') or entry['source'].stem.replace('_', ' ').title()
+            )[:MAX_LENGTH].strip()
+            if opening_name not in openings:
+                openings[opening_name] = new_openings[opening_name] = Opening(
+                    name=opening_name,
+                    color=Opening.Color.BLACK if options['color'] == 'black' else Opening.Color.WHITE,
+                    difficulty=options['difficulty'],
+                    category=options['category'],
+                    description=f'Imported from {entry["source"].name}'
+                )
+            name = header(headers, 'Variation') or header(headers, 'Event') or opening_name
+            ply = deviation_ply(lines.setdefault(opening_name, {}), entry['sans'])
+            variations.append((opening_name, Variation(
+                name=unique_name(name, taken),
+                description=header(headers, 'Annotator'),
+                on_turn=ply // 2 + 1,
+                nature=options['nature']
+            ), entry))
+
+        # -- New Openings show the moves shared by all of their lines -- #
+        for opening_name, opening in new_openings.items():
+            board, node = chess.Board(), lines[opening_name]
+            while len(node) == 1:
+                san, node = next(iter(node.items()))
+                board.push_san(san)
+            self.opening_images[opening_name] = svg.board(
+                board, flipped=opening.color == Opening.Color.BLACK, size=CHESS_BOARD_SIZE
+            )
+        return new_openings, variations
+
+    def report_plan(self, openings, variations):
+        for opening_name in openings:
+            self.stdout.write(f'New opening: {opening_name}')
+        for opening_name, variation, _ in variations:
+            self.stdout.write(f'{opening_name}: {variation.name} (on turn {variation.on_turn})')
+        self.stdout.write(self.style.SUCCESS(
+            f'Dry run: {len(openings)} openings and {len(variations)} variations would be imported'
+        ))
+
+    # -- Writing -- #
+    def write(self, openings, variations, options):
+        """Writes every file in batches, then creates every row in one transaction."""
+        written = []
+        try:
+            self.write_files(openings, variations, written, options['batch_size'])
+            with transaction.atomic():
+                self.create_rows(openings, variations)
+        except Exception as e:
+            for name in written:
+                default_storage.delete(name)
+            raise CommandError(f'Import failed, nothing was imported: {e}') from e
+
+        invalidate_listings()
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {len(openings)} openings and {len(variations)} variations '
+            f'in {time.perf_counter() - self.start:.2f}s'
+        ))
+
+    def store(self, name, content, written):
+        name = default_storage.get_available_name(name)
+        with open(default_storage.path(name), 'w') as file:
+            file.write(content)
+        written.append(name)
+        return name
+
+    def write_files(self, openings, variations, written, batch_size):
+        # -- Folders are created once, not per file -- #
+        folders = {Path(opening_file_name(name, '')).parent for name in openings}
+        folders.update(
+            Path(variation_file_name(opening_name, variation.name, '')).parent
+            for opening_name, variation, _ in variations
+        )
+        for folder in folders:
+            Path(default_storage.path(str(folder))).mkdir(parents=True, exist_ok=True)
+
+        for opening_name in openings:
+            openings[opening_name].image = self.store(
+                opening_file_name(opening_name, 'board.svg'), self.opening_images[opening_name], written
+            )
+        for index in range(0, len(variations), batch_size):
+            for opening_name, variation, entry in variations[index:index + batch_size]:
+                variation.pgn_file = self.store(
+                    variation_file_name(opening_name, variation.name, 'line.pgn'), entry['pgn'] + '\n', written
+                )
+                # -- The tree compiled by the worker becomes the sidecar of the stored file -- #
+                pgn_path = default_storage.path(variation.pgn_file.name)
+                write_tree(pgn_path, stamp_tree(entry['tree'], os.stat(pgn_path)))
+                written.append(sidecar_path(variation.pgn_file.name))
+                variation.image_file = self.store(
+                    variation_file_name(opening_name, variation.name, 'board.svg'), entry['image'], written
+                )
+                for field, value in entry['metadata'].items():
+                    setattr(variation, field, value)
+            self.progress('Wrote variation files', min(index + batch_size, len(variations)), len(variations))
+
+    def create_rows(self, openings, variations):
+        Opening.objects.bulk_create(openings.values())
+        opening_ids = dict(Opening.objects.values_list('name', 'id'))
+        for opening_name, variation, _ in variations:
+            variation.opening_id = opening_ids[opening_name]
+        Variation.objects.bulk_create([variation for _, variation, _ in variations])
+
+        # -- Primary keys are read back, bulk_create does not return them on every database -- #
+        variation_ids = dict(Variation.objects.values_list('name', 'id'))
+        positions = [
+            Position.from_node(variation_ids[variation.name], *node)
+            for _, variation, entry in variations
+            for node in entry['positions']
+        ]
+        Position.objects.bulk_create(positions, batch_size=POSITION_BATCH_SIZE)
+        self.progress('Indexed positions', len(positions), len(positions))
+
+        # -- Every imported line is due right away -- #
+        now = timezone.now()
+        lines = [
+            DrillLine(variation_id=variation_ids[variation.name], leaf=leaf, path=path, due=now)
+            for _, variation, entry in variations
+            for leaf, path in entry['lines']
+        ]
+        DrillLine.objects.bulk_create(lines, batch_size=POSITION_BATCH_SIZE)
+        DUE_INDEX.clear()
+        self.progress('Scheduled lines', len(lines), len(lines))
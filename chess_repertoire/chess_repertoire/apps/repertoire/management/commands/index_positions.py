@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from chess_repertoire.apps.game.tree import load_tree
+from chess_repertoire.apps.repertoire.models import Variation
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the position index, PGN metadata and drilled lines of every Variation (or of the given slugs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slugs', nargs='*', help='Slugs of the Variations to index')
+
+    def handle(self, *args, **options):
+        variations = Variation.objects.all()
+        if options['slugs']:
+            variations = variations.filter(slug__in=options['slugs'])
+        for variation in variations:
+            tree = load_tree(variation.pgn_file.path)
+            variation.index_positions(tree)
+            variation.set_metadata(tree)
+            variation.save(update_fields=Variation.METADATA_FIELDS)
+            variation.sync_drill_lines(tree)
+            self.stdout.write(f'{variation.name}: {len(tree)} positions, {variation.line_count} lines')
+        self.stdout.write(self.style.SUCCESS('Position index, metadata and drilled lines rebuilt'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chess_repertoire.apps.repertoire.models import Opening, Variation
+from chess_repertoire.apps.repertoire.thumbnails import make_thumbnails
+
+
+class Command(BaseCommand):
+    help = 'Makes the thumbnails of every Opening and Variation image (e.g. uploaded before thumbnails existed)'
+
+    def handle(self, *args, **options):
+        made = 0
+        for images in (
+            Opening.objects.values_list('image', flat=True),
+            Variation.objects.values_list('image_file', flat=True),
+        ):
+            for name in images:
+                if name and make_thumbnails(name):
+                    made += 1
+        self.stdout.write(self.style.SUCCESS(f'Thumbnails made for {made} images'))
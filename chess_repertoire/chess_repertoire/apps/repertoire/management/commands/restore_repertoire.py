@@ -0,0 +1,21 @@
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chess_repertoire.apps.repertoire.backup import restore_backup
+
+
+class Command(BaseCommand):
+    help = 'Restores the Openings and Variations of a backup written by export_repertoire'
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='Path of the zip archive to restore')
+
+    def handle(self, *args, **options):
+        try:
+            openings, variations, skipped = restore_backup(options['archive'])
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            raise CommandError(f'Restore failed, nothing was restored: {e}') from e
+        for name in skipped:
+            self.stdout.write(f'Skipped {name}: already exists')
+        self.stdout.write(self.style.SUCCESS(f'Restored {openings} openings and {variations} variations'))
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.contrib.sessions import middleware
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from chess_repertoire.apps.game.metrics import METRICS
+
+
+def time_query(execute, sql, params, many, context):
+    with METRICS.timer('db'):
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """
+    Collects the metrics of every request.
+
+    Times the request per URL name together with the DB queries it runs and,
+    with `METRICS_SERVER_TIMING`, adds the time of each phase of the request
+    as a Server-Timing header. When `METRICS_ENABLED` is off the middleware
+    removes itself and every hook of the game layer is a no-op. Under ASGI
+    it runs asynchronously and the async views time the queries run in their
+    worker threads.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        METRICS.enabled = True
+        self.server_timing = settings.METRICS_SERVER_TIMING
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        METRICS.begin_request()
+        start = time.perf_counter()
+        with connection.execute_wrapper(time_query):
+            response = self.get_response(request)
+        return self.end_request(request, response, start)
+
+    async def __acall__(self, request):
+        METRICS.begin_request()
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        return self.end_request(request, response, start)
+
+    def end_request(self, request, response, start):
+        total = time.perf_counter() - start
+        match = request.resolver_match
+        phases = METRICS.end_request(match.url_name if match else 'unresolved', total)
+        if self.server_timing:
+            response['Server-Timing'] = METRICS.server_timing(phases, total)
+        return response
+
+
+class SessionMiddleware(middleware.SessionMiddleware):
+    """Session middleware timing the save of the session (every request with `SESSION_SAVE_EVERY_REQUEST`)."""
+
+    def process_response(self, request, response):
+        with METRICS.timer('session_save'):
+            return super().process_response(request, response)
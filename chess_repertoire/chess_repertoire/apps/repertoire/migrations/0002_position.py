@@ -0,0 +1,28 @@
+# Generated by Django 3.2.6 on 2026-10-18 09:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repertoire', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Position',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('zobrist', models.BigIntegerField(db_index=True)),
+                ('node', models.PositiveIntegerField()),
+                ('path', models.TextField(default='')),
+                ('turn', models.IntegerField(choices=[(0, 'WHITE'), (1, 'BLACK')])),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='positions', to='repertoire.variation')),
+            ],
+            options={
+                'ordering': ['variation', 'node'],
+            },
+        ),
+    ]
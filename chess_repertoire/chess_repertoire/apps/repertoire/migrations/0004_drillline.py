@@ -0,0 +1,40 @@
+# Generated by Django 3.2.6 on 2026-10-18 09:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repertoire', '0003_variation_metadata'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrillLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('leaf', models.PositiveIntegerField()),
+                ('path', models.TextField()),
+                ('due', models.DateTimeField(db_index=True)),
+                ('interval', models.FloatField(default=0)),
+                ('ease', models.FloatField(default=2.5)),
+                ('repetitions', models.PositiveIntegerField(default=0)),
+                ('lapses', models.PositiveIntegerField(default=0)),
+                ('last_practiced', models.DateTimeField(blank=True, null=True)),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='drill_lines', to='repertoire.variation')),
+            ],
+            options={
+                'ordering': ['due', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='drillline',
+            index=models.Index(fields=['variation', 'leaf'], name='repertoire__variati_43ddc9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='drillline',
+            unique_together={('variation', 'path')},
+        ),
+    ]
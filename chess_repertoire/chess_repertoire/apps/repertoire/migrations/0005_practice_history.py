@@ -0,0 +1,51 @@
+# Generated by Django 3.2.6 on 2026-10-18 10:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('repertoire', '0004_drillline'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PracticeMove',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempt', models.CharField(db_index=True, max_length=32)),
+                ('path', models.TextField(default='')),
+                ('ply', models.PositiveIntegerField()),
+                ('move', models.CharField(max_length=30)),
+                ('correct', models.BooleanField()),
+                ('played', models.DateTimeField()),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='practice_moves', to='repertoire.variation')),
+            ],
+            options={
+                'ordering': ['played', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PracticeAttempt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=32, unique=True)),
+                ('started', models.DateTimeField()),
+                ('ended', models.DateTimeField(db_index=True)),
+                ('correct_moves', models.PositiveIntegerField(default=0)),
+                ('incorrect_moves', models.PositiveIntegerField(default=0)),
+                ('hints_used', models.PositiveIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('variation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='practice_attempts', to='repertoire.variation')),
+            ],
+            options={
+                'ordering': ['-ended'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='practicemove',
+            index=models.Index(fields=['variation', 'path'], name='repertoire__variati_2ca175_idx'),
+        ),
+    ]
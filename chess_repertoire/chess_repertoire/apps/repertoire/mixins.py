@@ -1,7 +1,88 @@
-from django.http import JsonResponse
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db.models import Subquery
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 
 from chess_repertoire.apps.game import ChessPractice, get_current_color
-from .models import Opening, Variation
+from chess_repertoire.apps.game.game_controller import GameTreeCache
+from chess_repertoire.apps.game.statistics import PracticeStatistics
+from .constants import LISTING_CACHE_TIMEOUT
+from .listings import listing_cache_key
+from .models import PRACTICE_HISTORY, DrillLine, Opening, PracticeAttempt, PracticeMove, Variation
+
+
+class CachedListingMixin:
+    """
+    Mixin caching the rendered page of a listing per URL, filters and page included.
+
+    Keys carry a listing version bumped by the save/delete signals of Opening
+    and Variation, so changes show on the next request. Pages are cached with
+    their headers (content type, Vary, caching headers) and served with them.
+    """
+
+    def get(self, request, *args, **kwargs):
+        key = listing_cache_key(request.get_full_path())
+        cached = cache.get(key)
+        if cached is None:
+            response = super().get(request, *args, **kwargs)
+            response.render()
+            # -- Only complete pages are cached, never one embedding the CSRF token of a user -- #
+            if response.status_code == 200 and not request.META.get('CSRF_COOKIE_USED'):
+                cache.set(key, (response.content, list(response.items())), LISTING_CACHE_TIMEOUT)
+            return response
+        content, headers = cached
+        response = HttpResponse(content)
+        for header, value in headers:
+            response[header] = value
+        return response
+
+
+class ConditionalPositionMixin:
+    """
+    Mixin answering repeated position requests with 304 Not Modified.
+
+    The strong ETag of a position covers everything its response is built
+    from: the version of the Variation's PGN file (from its metadata only),
+    the node stored in session, the color of the Opening and any extra
+    `parts` (e.g. the practice attempt). The color and PGN path are read from
+    the database with a single query on every request, since a cache would go
+    stale in the other worker processes, so a repeated request is answered
+    without loading the game tree: a query, a `stat` and a hash.
+    """
+
+    def position_source(self):
+        """Color of the Opening and PGN path of the Variation of the URL."""
+        color, pgn_file = Variation.objects.filter(slug=self.kwargs['slug']).annotate(
+            color=Subquery(Opening.objects.filter(name=self.kwargs['opn']).values('color')[:1])
+        ).values_list('color', 'pgn_file').get()
+        return color, Variation._meta.get_field('pgn_file').storage.path(pgn_file)
+
+    def position_etag(self, *parts):
+        color, pgn_file = self.position_source()
+        token = json.dumps([
+            GameTreeCache.file_version(pgn_file),
+            self.request.session.get('node'),
+            color,
+            *parts
+        ])
+        return quote_etag(hashlib.blake2b(token.encode(), digest_size=16).hexdigest())
+
+    def not_modified(self, etag):
+        """304 response if the client already has the position of `etag`, None otherwise."""
+        response = get_conditional_response(self.request, etag=etag)
+        return response and self.conditional(response, etag)
+
+    @staticmethod
+    def conditional(response, etag):
+        # -- The position depends on the session: only the browser may keep it, and must revalidate -- #
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
 
 
 class PracticeContextMixin:
@@ -33,16 +114,72 @@ class PracticeContextMixin:
         return Variation.objects.get(slug=self.kwargs['slug'])
 
     def initialize_practice(self, opening, variation):
-        """Creates ChessPractice instance."""
-        return ChessPractice(
+        """Creates ChessPractice instance, following the drilled line of the session."""
+        practice = ChessPractice(
             variation.pgn_file.path,
             opening.color,
         )
+        drill = self.request.session.get('drill')
+        if drill and drill[0] == variation.pk:
+            practice.follow(drill[1:])
+        return practice
+
+    def start_drill_line(self, practice, variation, line_id=None):
+        """Follows the given DrillLine of the Variation, or its most overdue one, from now on."""
+        line = DrillLine.objects.filter(pk=line_id, variation=variation).first() if line_id else None
+        line = line or DrillLine.next_due(variation.pk)
+        if line is None:
+            self.request.session.pop('drill', None)
+            return
+        self.request.session['drill'] = [variation.pk, practice.tree.version, line.leaf]
+        practice.follow(self.request.session['drill'][1:])
+
+    def record_move(self, practice, variation, move, correct, node_id=None):
+        """Records a move played at `node_id` (the current node by default) in session and in the practice history."""
+        PracticeStatistics.record_move(self.request.session, move, correct=correct)
+        attempt = PracticeStatistics.get_attempt(self.request.session)
+        if attempt is None:
+            return
+        node_id = practice.node_id if node_id is None else node_id
+        PRACTICE_HISTORY.add(PracticeMove(
+            attempt=attempt,
+            variation_id=variation.pk,
+            path=practice.tree.path(node_id),
+            ply=practice.tree.ply(node_id),
+            move=move,
+            correct=correct,
+            played=timezone.now()
+        ))
+
+    def save_attempt(self):
+        """Adds the open attempt of the session statistics to the practice history, as played so far."""
+        stats = PracticeStatistics.get_attempt_stats(self.request.session)
+        if stats and stats['variation_id'] is not None and (
+            stats['correct_moves'] or stats['incorrect_moves'] or stats['hints_used']
+        ):
+            PRACTICE_HISTORY.add(PracticeAttempt.from_stats(stats))
+
+    def end_attempt(self):
+        """Adds the attempt of the session statistics to the practice history, once."""
+        stats = PracticeStatistics.end_attempt(self.request.session)
+        if stats and stats['variation_id'] is not None:
+            PRACTICE_HISTORY.add(PracticeAttempt.from_stats(stats))
+
+    def complete_drill_line(self, practice, variation):
+        """Schedules the next practice of the line just completed from the statistics of this practice."""
+        PracticeStatistics.mark_completed(self.request.session)
+        self.end_attempt()
+        stats = PracticeStatistics.get_stats(self.request.session)
+        if self.request.session.pop('drill', None) is None or not stats:
+            return
+        line = DrillLine.objects.filter(variation=variation, leaf=practice.node_id).first()
+        if line is not None:
+            line.review(stats['incorrect_moves'], stats['hints_used'])
 
     def restore_session_state(self, practice):
-        """Restores practice state from session by running visited moves."""
-        self.request.session['moves'] = practice.run_visited_moves(
-            self.request.session.get('moves', [])
+        """Restores practice state from the node stored in session."""
+        self.request.session['node'] = practice.resume(
+            self.request.session.get('node')
         )
 
 
@@ -59,20 +196,23 @@ class PracticeAjaxMixin(PracticeContextMixin):
         Override dispatch to provide automatic error handling for AJAX views.
 
         Wraps view logic in try-except and returns JSON error responses
-        for any exceptions that occur.
+        for any exceptions that occur. The open attempt is saved whenever a
+        request changes it, so an abandoned practice is kept too.
         """
+        progress = PracticeStatistics.get_progress(request.session)
         try:
-            return super().dispatch(request, *args, **kwargs)
+            response = super().dispatch(request, *args, **kwargs)
         except Exception as e:
             return self.json_error_response(e)
+        if PracticeStatistics.get_progress(request.session) != progress:
+            self.save_attempt()
+        return response
 
     def json_error_response(self, error, status=500):
         """Returns standardized JSON error response."""
         return JsonResponse({'error': str(error)}, status=status)
 
-    def get_player_turn_status(self, opening):
-        """Calculates if it's player's turn based on session moves."""
-        current_color = get_current_color(
-            self.request.session.get('moves', [])
-        )
+    def get_player_turn_status(self, opening, practice):
+        """Calculates if it's player's turn based on the current node."""
+        current_color = get_current_color(practice.ply)
         return opening.color == current_color
@@ -1,30 +1,49 @@
 import shutil
+from datetime import datetime, timedelta, timezone as dt_timezone
 from pathlib import Path
 
+import chess
 from django.conf import settings
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Max, Q, Sum, Value
+from django.db.models.functions import NullIf
 from django.urls import reverse
+from django.utils import timezone
 
 from autoslug import AutoSlugField
 
+from chess_repertoire.apps.game.buffer import WriteBehindBuffer
+from chess_repertoire.apps.game.scheduling import DUE_INDEX
+from chess_repertoire.apps.game.tree import CompiledTree, compile_pgn, is_compiled
+from chess_repertoire.apps.game.utils import zobrist_key
+
 from . import constants
+from .thumbnails import make_thumbnails
 
 
 # -- Helper functions -- #
 def opening_upload_attribute(opening_instance, filename):
-    opening_folder = opening_instance.name.replace(' ', '_').lower()
-    filename = f"{opening_folder}{Path(filename).suffix}"
-    full_path = Path(settings.MEDIA_ROOT / f'{opening_folder}')
+    upload_path = opening_file_name(opening_instance.name, filename)
+    full_path = Path(settings.MEDIA_ROOT / upload_path).parent
     full_path.mkdir(exist_ok=True, parents=True)
-    return f"{opening_folder}/{filename}"
+    return upload_path
+
+def opening_file_name(opening_name, filename):
+    """Path of an Opening file under MEDIA_ROOT, without creating its folder."""
+    opening_folder = opening_name.replace(' ', '_').lower()
+    return f"{opening_folder}/{opening_folder}{Path(filename).suffix}"
 
 def variation_upload_attribute(variation_instance, filename):
-    opening_folder = variation_instance.opening.name.replace(' ', '_').lower()
-    variation_folder = variation_instance.name.replace(' ', '_').lower()
-    filename = f"{variation_folder}{Path(filename).suffix}"
-    full_path = Path(settings.MEDIA_ROOT / f'{opening_folder}/{variation_folder}')
+    upload_path = variation_file_name(variation_instance.opening.name, variation_instance.name, filename)
+    full_path = Path(settings.MEDIA_ROOT / upload_path).parent
     full_path.mkdir(exist_ok=True, parents=True)
-    return f"{opening_folder}/{variation_folder}/{filename}"
+    return upload_path
+
+def variation_file_name(opening_name, variation_name, filename):
+    """Path of a Variation file under MEDIA_ROOT, without creating its folder."""
+    opening_folder = opening_name.replace(' ', '_').lower()
+    variation_folder = variation_name.replace(' ', '_').lower()
+    return f"{opening_folder}/{variation_folder}/{variation_folder}{Path(filename).suffix}"
 
 # -- Models -- #
 class Opening(models.Model):
@@ -86,6 +105,13 @@ class Opening(models.Model):
     class Meta:
         ordering = ['name']
 
+    def save(self, *args, **kwargs):
+        """Override save to make the thumbnails of a newly uploaded image."""
+        new_image = bool(self.image) and not self.image._committed
+        super().save(*args, **kwargs)
+        if new_image:
+            make_thumbnails(self.image.name)
+
     def delete(self, *args, **kwargs):
         """Override delete to remove empty opening directory after files are deleted."""
         # Get directory path before deletion
@@ -128,6 +154,11 @@ class Variation(models.Model):
             - opening: the opening where the Variation belongs (Opening)
             - pgn_file: the PGN file of the Variation (file)
             - image_file: the image indicating the position on the Board
+            - ply_count: number of moves stored in the PGN tree (int)
+            - line_count: number of lines, the leaves of the PGN tree (int)
+            - max_depth: ply of the deepest position of the PGN tree (int)
+            - branching_factor: mean replies of the positions that have any (float)
+            - final_positions: FEN of the last position of every line (list)
     """
 
     class Nature(models.TextChoices):
@@ -154,11 +185,91 @@ class Variation(models.Model):
         width_field=None,
         max_length=constants.FILE_MAX_LENGTH
     )
+    # -- Metadata of the PGN tree, computed when the Variation is saved -- #
+    ply_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    line_count = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    max_depth = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    branching_factor = models.FloatField(default=0, editable=False, db_index=True)
+    final_positions = models.JSONField(default=list, editable=False)
+
+    METADATA_FIELDS = ['ply_count', 'line_count', 'max_depth', 'branching_factor', 'final_positions']
+
+    # -- Name of the PGN file of the row as loaded, None for new Variations -- #
+    _stored_pgn_file = None
 
     class Meta:
         ordering = ['on_turn', 'name']
         unique_together = ['name', 'on_turn']
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'pgn_file' in field_names:
+            instance._stored_pgn_file = values[field_names.index('pgn_file')]
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        Override save to compile the PGN file, store its metadata, index its
+        positions and make thumbnails. The PGN is only compiled and indexed
+        again when it changed: another file, or new contents of the same one.
+        """
+        new_image = bool(self.image_file) and not self.image_file._committed
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'pgn_file' not in update_fields:
+            super().save(*args, **kwargs)
+        else:
+            # -- The PGN file is stored first so it is compiled before the row is written -- #
+            if self.pgn_file and not self.pgn_file._committed:
+                self.pgn_file.save(self.pgn_file.name, self.pgn_file.file, save=False)
+            pgn_changed = (
+                self._state.adding or self.pgn_file.name != self._stored_pgn_file
+                or not is_compiled(self.pgn_file.path)
+            )
+            if pgn_changed:
+                tree = CompiledTree(compile_pgn(self.pgn_file.path))
+                self.set_metadata(tree)
+            super().save(*args, **kwargs)
+            if pgn_changed:
+                self.index_positions(tree)
+                self.sync_drill_lines(tree)
+            self._stored_pgn_file = self.pgn_file.name
+        if new_image:
+            make_thumbnails(self.image_file.name)
+
+    def set_metadata(self, tree):
+        """Sets the size and shape of the compiled `tree` of the Variation."""
+        for field, value in tree.metadata().items():
+            setattr(self, field, value)
+
+    def index_positions(self, tree):
+        """Replaces the Positions of the Variation with the nodes of its compiled `tree`."""
+        positions = [Position.from_node(self.pk, *node) for node in tree.positions()]
+        with transaction.atomic():
+            self.positions.all().delete()
+            Position.objects.bulk_create(positions, batch_size=constants.POSITION_BATCH_SIZE)
+
+    def sync_drill_lines(self, tree):
+        """Matches the DrillLines of the Variation with the lines of `tree`, keeping the schedule of unchanged ones."""
+        leaves = {path: leaf for leaf, path in tree.lines()}
+        stale, moved = [], []
+        with transaction.atomic():
+            for line in self.drill_lines.all():
+                leaf = leaves.pop(line.path, None)
+                if leaf is None:
+                    stale.append(line.pk)
+                elif leaf != line.leaf:
+                    line.leaf = leaf
+                    moved.append(line)
+            DrillLine.objects.filter(pk__in=stale).delete()
+            DrillLine.objects.bulk_update(moved, ['leaf'], batch_size=constants.POSITION_BATCH_SIZE)
+            now = timezone.now()
+            DrillLine.objects.bulk_create(
+                [DrillLine(variation=self, leaf=leaf, path=path, due=now) for path, leaf in leaves.items()],
+                batch_size=constants.POSITION_BATCH_SIZE
+            )
+        DUE_INDEX.clear()
+
     def delete(self, *args, **kwargs):
         """Override delete to remove empty variation directory after files are deleted."""
         # Get directory paths before deletion
@@ -167,7 +278,7 @@ class Variation(models.Model):
         variation_dir = Path(settings.MEDIA_ROOT) / opening_folder / variation_folder
         opening_dir = Path(settings.MEDIA_ROOT) / opening_folder
 
-        # Call parent delete (django-cleanup will remove files)
+        # Call parent delete (django-cleanup will remove files and compiled trees)
         super().delete(*args, **kwargs)
 
         # Remove variation directory if it exists and is empty
@@ -194,3 +305,288 @@ class Variation(models.Model):
 
     def __repr__(self) -> str:
         return f'{super().__repr__()}:{self.__class__.__name__}:{self.name}'
+
+class Position(models.Model):
+    """ MODEL::Position
+        ---
+        Description: Occurrence of a chess position in a Variation, indexed by
+        its Zobrist hash so that transpositions between Variations are found
+
+        Arguments:
+            - zobrist: Zobrist hash of the position as a signed 64-bit integer (int)
+            - variation: the Variation where the position occurs (Variation)
+            - node: ID of the node in the compiled tree of the Variation (int)
+            - path: SAN moves leading to the position, separated by spaces (str)
+            - turn: color on move in the position (int)
+    """
+    zobrist = models.BigIntegerField(db_index=True)
+    variation = models.ForeignKey(Variation, on_delete=models.CASCADE, related_name='positions')
+    node = models.PositiveIntegerField()
+    path = models.TextField(default='')
+    turn = models.IntegerField(choices=Opening.Color.choices)
+
+    class Meta:
+        ordering = ['variation', 'node']
+
+    @classmethod
+    def from_node(cls, variation_id, node, path, zobrist, turn):
+        """Position of a node yielded by `CompiledTree.positions`."""
+        return cls(
+            zobrist=zobrist,
+            variation_id=variation_id,
+            node=node,
+            path=path,
+            turn=Opening.Color.WHITE if turn == chess.WHITE else Opening.Color.BLACK
+        )
+
+    @classmethod
+    def lookup(cls, fen):
+        """Every occurrence of the position of `fen` in the repertoire."""
+        return cls.objects.filter(
+            zobrist=zobrist_key(chess.Board(fen))
+        ).select_related('variation__opening')
+
+    def __str__(self) -> str:
+        return f'{self.path or "Start"} in {self.variation.name}'
+
+    def __repr__(self) -> str:
+        return f'{super().__repr__()}:{self.__class__.__name__}:{self.variation_id}:{self.node}'
+
+class DrillLine(models.Model):
+    """ MODEL::DrillLine
+        ---
+        Description: Line of a Variation, from its first move to a leaf, scheduled
+        for spaced-repetition practice (SM-2)
+
+        Arguments:
+            - variation: the Variation of the line (Variation)
+            - leaf: ID of the last node of the line in the compiled tree (int)
+            - path: SAN moves of the line, separated by spaces (str)
+            - due: when the line should be practiced next (datetime)
+            - interval: days between the last practice and the due date (float)
+            - ease: growth of the interval after a clean practice (float)
+            - repetitions: clean practices in a row (int)
+            - lapses: practices with mistakes (int)
+            - last_practiced: when the line was last completed (datetime)
+    """
+    variation = models.ForeignKey(Variation, on_delete=models.CASCADE, related_name='drill_lines')
+    leaf = models.PositiveIntegerField()
+    path = models.TextField()
+    due = models.DateTimeField(db_index=True)
+    interval = models.FloatField(default=0)
+    ease = models.FloatField(default=constants.DRILL_INITIAL_EASE)
+    repetitions = models.PositiveIntegerField(default=0)
+    lapses = models.PositiveIntegerField(default=0)
+    last_practiced = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['due', 'id']
+        unique_together = ['variation', 'path']
+        indexes = [models.Index(fields=['variation', 'leaf'])]
+
+    @classmethod
+    def next_due(cls, variation_id=None):
+        """Most overdue line of a Variation (or of the whole repertoire), checked against its row."""
+        if DUE_INDEX.expired:
+            DUE_INDEX.load(
+                (line, variation, due.timestamp())
+                for line, variation, due in cls.objects.values_list('id', 'variation_id', 'due').iterator()
+            )
+        while True:
+            head = DUE_INDEX.peek(variation_id)
+            if head is None:
+                return None
+            line = cls.objects.select_related('variation__opening').filter(pk=head[0]).first()
+            # -- Rows deleted or rescheduled by another process are fixed in the index -- #
+            if line is None:
+                DUE_INDEX.discard(head[0])
+            elif line.due.timestamp() != head[1]:
+                DUE_INDEX.update(line.pk, line.variation_id, line.due.timestamp())
+            else:
+                return line
+
+    def review(self, mistakes, hints, now=None):
+        """Schedules the next practice of the line from the mistakes and hints of the last one."""
+        now = now or timezone.now()
+        if mistakes:
+            self.repetitions = 0
+            self.lapses += 1
+            self.ease = max(constants.DRILL_MIN_EASE, self.ease - 0.2)
+            self.interval = constants.DRILL_RELEARN_INTERVAL
+        else:
+            # -- SM-2 quality: 5 for a clean practice, 1 point less per hint (down to 3) -- #
+            penalty = min(hints, 2)
+            self.ease = max(constants.DRILL_MIN_EASE, self.ease + 0.1 - penalty * (0.08 + penalty * 0.02))
+            self.repetitions += 1
+            if self.repetitions <= len(constants.DRILL_FIRST_INTERVALS):
+                self.interval = constants.DRILL_FIRST_INTERVALS[self.repetitions - 1]
+            else:
+                self.interval *= self.ease
+        self.due = now + timedelta(days=self.interval)
+        self.last_practiced = now
+        self.save()
+        DUE_INDEX.update(self.pk, self.variation_id, self.due.timestamp())
+
+    def __str__(self) -> str:
+        return f'{self.path} in {self.variation.name}'
+
+    def __repr__(self) -> str:
+        return f'{super().__repr__()}:{self.__class__.__name__}:{self.variation_id}:{self.leaf}'
+
+
+class PracticeAttempt(models.Model):
+    """ MODEL::PracticeAttempt
+        ---
+        Description: One practice of a Variation, from its start to its completion,
+        restart or the start of another practice
+
+        Arguments:
+            - key: key of the attempt, shared with its PracticeMoves (str)
+            - variation: the practiced Variation (Variation)
+            - started: when the practice started (datetime)
+            - ended: last activity of the practice (datetime)
+            - correct_moves: moves played as in the Variation (int)
+            - incorrect_moves: moves not in the Variation (int)
+            - hints_used: hints asked for (int)
+            - completed: whether the end of a line was reached (bool)
+    """
+    key = models.CharField(max_length=32, unique=True)
+    variation = models.ForeignKey(Variation, on_delete=models.CASCADE, related_name='practice_attempts')
+    started = models.DateTimeField()
+    ended = models.DateTimeField(db_index=True)
+    correct_moves = models.PositiveIntegerField(default=0)
+    incorrect_moves = models.PositiveIntegerField(default=0)
+    hints_used = models.PositiveIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-ended']
+
+    @classmethod
+    def from_stats(cls, stats):
+        """Attempt of the statistics returned by `PracticeStatistics.get_attempt_stats`."""
+        return cls(
+            key=stats['attempt'],
+            variation_id=stats['variation_id'],
+            started=datetime.fromtimestamp(stats['started_at'], dt_timezone.utc),
+            ended=datetime.fromtimestamp(stats['ended_at'], dt_timezone.utc),
+            correct_moves=stats['correct_moves'],
+            incorrect_moves=stats['incorrect_moves'],
+            hints_used=stats['hints_used'],
+            completed=stats['completed']
+        )
+
+    @classmethod
+    def accuracy_by_variation(cls, variation_id=None):
+        """Attempts, completions, moves, hints and accuracy (%) of every practiced Variation, weakest first."""
+        attempts = cls.objects.all()
+        if variation_id is not None:
+            attempts = attempts.filter(variation_id=variation_id)
+        return attempts.values(
+            'variation', 'variation__name', 'variation__slug', 'variation__opening__name'
+        ).annotate(
+            attempts=Count('id'),
+            completed=Count('id', filter=Q(completed=True)),
+            correct=Sum('correct_moves'),
+            incorrect=Sum('incorrect_moves'),
+            hints=Sum('hints_used'),
+            last_practiced=Max('ended'),
+            accuracy=ExpressionWrapper(
+                Value(100.0) * F('correct') / NullIf(F('correct') + F('incorrect'), 0),
+                output_field=FloatField()
+            )
+        ).order_by('accuracy', 'variation')
+
+    def __str__(self) -> str:
+        return f'{self.variation.name} at {self.started}'
+
+    def __repr__(self) -> str:
+        return f'{super().__repr__()}:{self.__class__.__name__}:{self.variation_id}:{self.key}'
+
+
+class PracticeMove(models.Model):
+    """ MODEL::PracticeMove
+        ---
+        Description: Move played in a practice, at a node of the Variation
+
+        Arguments:
+            - attempt: key of the PracticeAttempt of the move (str)
+            - variation: the practiced Variation (Variation)
+            - path: SAN moves leading to the node where the move was played (str)
+            - ply: ply of that node (int)
+            - move: SAN of the move played (str)
+            - correct: whether the move is in the Variation (bool)
+            - played: when the move was played (datetime)
+    """
+    attempt = models.CharField(max_length=32, db_index=True)
+    variation = models.ForeignKey(Variation, on_delete=models.CASCADE, related_name='practice_moves')
+    path = models.TextField(default='')
+    ply = models.PositiveIntegerField()
+    move = models.CharField(max_length=constants.MAX_LENGTH)
+    correct = models.BooleanField()
+    played = models.DateTimeField()
+
+    class Meta:
+        ordering = ['played', 'id']
+        indexes = [models.Index(fields=['variation', 'path'])]
+
+    @classmethod
+    def accuracy_by_node(cls, variation_id):
+        """Moves played and accuracy (%) at every practiced node of a Variation, weakest first."""
+        return cls.objects.filter(variation_id=variation_id).values('path', 'ply').annotate(
+            attempts=Count('id'),
+            correct=Count('id', filter=Q(correct=True)),
+            accuracy=ExpressionWrapper(
+                Value(100.0) * F('correct') / F('attempts'), output_field=FloatField()
+            )
+        ).order_by('accuracy', '-attempts', 'ply')
+
+    def __str__(self) -> str:
+        return f'{self.move} after {self.path or "Start"} in {self.variation.name}'
+
+    def __repr__(self) -> str:
+        return f'{super().__repr__()}:{self.__class__.__name__}:{self.variation_id}:{self.move}'
+
+
+# -- Practice history -- #
+PRACTICE_ATTEMPT_PROGRESS = ['ended', 'correct_moves', 'incorrect_moves', 'hints_used', 'completed']
+
+def write_practice_history(records):
+    """
+    Bulk-writes the buffered PracticeAttempts and PracticeMoves, one batch per
+    model. Attempts are saved as they progress: only the latest state of each
+    one is kept, updating the attempt already stored under its key. Records
+    of Variations deleted since they were buffered are dropped, so they never
+    fail the batch (a batch failing anyway finds them gone when retried).
+    """
+    variations = set(Variation.objects.filter(
+        pk__in={record.variation_id for record in records}
+    ).values_list('pk', flat=True))
+    records = [record for record in records if record.variation_id in variations]
+    attempts = {record.key: record for record in records if type(record) is PracticeAttempt}
+    with transaction.atomic():
+        stored = PracticeAttempt.objects.filter(key__in=attempts).values_list('key', 'pk')
+        for key, pk in stored:
+            attempts[key].pk = pk
+        PracticeAttempt.objects.bulk_update(
+            [attempt for attempt in attempts.values() if attempt.pk is not None],
+            PRACTICE_ATTEMPT_PROGRESS,
+            batch_size=constants.POSITION_BATCH_SIZE
+        )
+        # -- An attempt saved at the same time by a concurrent flush is kept once -- #
+        PracticeAttempt.objects.bulk_create(
+            [attempt for attempt in attempts.values() if attempt.pk is None],
+            batch_size=constants.POSITION_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        PracticeMove.objects.bulk_create(
+            [record for record in records if type(record) is PracticeMove],
+            batch_size=constants.POSITION_BATCH_SIZE
+        )
+
+PRACTICE_HISTORY = WriteBehindBuffer(
+    write_practice_history,
+    constants.PRACTICE_FLUSH_SIZE,
+    constants.PRACTICE_FLUSH_INTERVAL,
+    close=connections.close_all
+)
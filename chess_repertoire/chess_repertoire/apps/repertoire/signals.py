@@ -0,0 +1,32 @@
+from django.db.models.fields.files import ImageFieldFile
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_cleanup.signals import cleanup_pre_delete
+
+from chess_repertoire.apps.game.tree import discard_tree
+
+from .listings import invalidate_listings
+from .models import Opening, Variation
+from .thumbnails import discard_thumbnails
+
+
+@receiver(cleanup_pre_delete)
+def discard_compiled_tree(sender, file, **kwargs):
+    """Removes the compiled tree sidecar of a PGN file deleted by django-cleanup."""
+    discard_tree(file.path)
+
+
+@receiver(cleanup_pre_delete)
+def discard_image_thumbnails(sender, file, **kwargs):
+    """Removes the thumbnails of an image deleted by django-cleanup."""
+    if isinstance(file, ImageFieldFile):
+        discard_thumbnails(file.name)
+
+
+@receiver(post_save, sender=Opening)
+@receiver(post_delete, sender=Opening)
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def invalidate_cached_listings(sender, **kwargs):
+    """Drops the cached opening and variation listings when any of them changes."""
+    invalidate_listings()
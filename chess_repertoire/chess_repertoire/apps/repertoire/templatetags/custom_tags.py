@@ -1,5 +1,7 @@
 from django import template
 
+from chess_repertoire.apps.repertoire.thumbnails import thumbnail_srcset as srcset
+
 register = template.Library()
 
 @register.simple_tag
@@ -12,4 +14,10 @@ def custom_url(value, field_name, urlencode=None):
         encoded_query_string = '&'.join(filtered_query_string)
         url = f'{url}&{encoded_query_string}'
 
-    return url
\ No newline at end of file
+    return url
+
+
+@register.simple_tag
+def thumbnail_srcset(image, extension='jpg'):
+    """`srcset` of the thumbnails of an image field in `extension`, empty if it has none."""
+    return srcset(image.name, extension) if image else ''
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from django.views import View
+
+from chess_repertoire.apps.game.metrics import METRICS
+from . import async_views
+from .async_views import ajax_view, release_connections
+
+
+class ThreadView(View):
+    """Counts the visits of the session and reports the thread and the request it was run with."""
+
+    def get(self, request, *args, **kwargs):
+        request.session['visits'] = request.session.get('visits', 0) + 1
+        return JsonResponse({
+            'thread': threading.current_thread().name,
+            'visits': request.session['visits'],
+            'players': User.objects.count(),
+            'move': request.GET.get('move'),
+            'slug': kwargs.get('slug')
+        })
+
+
+with override_settings(ASYNC_VIEWS=True):
+    urlpatterns = [path('async/<slug:slug>/', ajax_view(ThreadView), name='async_thread')]
+with override_settings(ASYNC_VIEWS=False):
+    urlpatterns += [path('sync/<slug:slug>/', ajax_view(ThreadView), name='sync_thread')]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AjaxViewTest(TestCase):
+    def test_views_are_async_only_with_async_views(self):
+        with override_settings(ASYNC_VIEWS=True):
+            view = ajax_view(ThreadView)
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        self.assertIs(view.view_class, ThreadView)
+        with override_settings(ASYNC_VIEWS=False):
+            self.assertFalse(asyncio.iscoroutinefunction(ajax_view(ThreadView)))
+
+    async def test_async_views_run_in_the_pool(self):
+        with mock.patch.object(async_views, 'release_connections', wraps=release_connections) as release:
+            for visits in (1, 2):
+                response = await self.async_client.get('/async/italian/?move=e4')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(release.call_count, visits)
+                data = response.json()
+                self.assertTrue(data['thread'].startswith('repertoire-view'))
+                # -- The session changed by the worker thread is saved with the response -- #
+                self.assertEqual(data['visits'], visits)
+                self.assertEqual((data['move'], data['slug']), ('e4', 'italian'))
+
+    async def test_sync_views_run_in_the_loop_thread(self):
+        with mock.patch.object(async_views, 'release_connections') as release:
+            response = await self.async_client.get('/sync/italian/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['thread'].startswith('repertoire-view'))
+        release.assert_not_called()
+
+    @override_settings(METRICS_ENABLED=True, METRICS_SERVER_TIMING=True)
+    async def test_request_context_reaches_the_pool(self):
+        enabled = METRICS.enabled
+        self.addCleanup(setattr, METRICS, 'enabled', enabled)
+        self.addCleanup(METRICS.reset)
+        response = await self.async_client.get('/async/italian/')
+        # -- Queries run by the worker thread are timed as phases of the request -- #
+        phases = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertIn('db', phases)
+
+
+class ReleaseConnectionsTest(SimpleTestCase):
+    def connection(self, autocommit=True, errors_occurred=False, usable=True, opened=True):
+        conn = mock.Mock(
+            connection=object() if opened else None, errors_occurred=errors_occurred,
+            settings_dict={'AUTOCOMMIT': True}
+        )
+        conn.get_autocommit.return_value = autocommit
+        conn.is_usable.return_value = usable
+        return conn
+
+    def test_only_unusable_connections_are_closed(self):
+        usable = self.connection(errors_occurred=True)
+        broken = self.connection(errors_occurred=True, usable=False)
+        in_transaction = self.connection(autocommit=False)
+        closed = self.connection(opened=False)
+        with mock.patch.object(async_views.connections, 'all', return_value=[usable, broken, in_transaction, closed]):
+            release_connections()
+        usable.close.assert_not_called()
+        self.assertFalse(usable.errors_occurred)
+        broken.close.assert_called_once_with()
+        in_transaction.close.assert_called_once_with()
+        closed.close.assert_not_called()
@@ -0,0 +1,104 @@
+import io
+import json
+import zipfile
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from pgn_analyzer.pgn_stream import iter_games
+from .backup import MANIFEST_NAME, MERGED_PGN_NAME, archive_name, restore_backup
+from .constants import BACKUP_FORMAT_VERSION
+from .models import Opening, Variation
+from .testing import TemporaryMediaMixin, create_opening, create_variation
+
+
+class BackupTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        italian = create_opening('Italian')
+        self.giuoco = create_variation(italian, 'Giuoco Piano', '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *')
+        self.two_knights = create_variation(italian, 'Two Knights', '1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. Ng5 *', 3)
+        create_variation(create_opening('Slav', Opening.Color.BLACK), 'Main Slav', '1. d4 d5 2. c4 c6 *')
+
+    def export(self):
+        response = self.client.get(reverse('repertoire:export'), {'merged_pgn': 1})
+        self.assertEqual(response.status_code, 200)
+        return io.BytesIO(b''.join(response.streaming_content))
+
+    def snapshot(self):
+        return {
+            variation.name: (
+                variation.opening.name, variation.opening.color, variation.on_turn, variation.nature,
+                variation.pgn_file.read(), variation.line_count, variation.positions.count(),
+                variation.drill_lines.count()
+            )
+            for variation in Variation.objects.select_related('opening')
+        }
+
+    def test_export_restore_round_trip(self):
+        expected = self.snapshot()
+        archive = self.export()
+        Opening.objects.all().delete()
+
+        self.assertEqual(restore_backup(archive), (2, 3, []))
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_archive_contents(self):
+        with zipfile.ZipFile(self.export()) as archive:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+            self.assertEqual(manifest['version'], BACKUP_FORMAT_VERSION)
+            self.assertEqual(len(manifest['openings']), 2)
+            self.assertEqual(len(manifest['variations']), 3)
+            names = set(archive.namelist())
+            for record in manifest['variations']:
+                self.assertIn(archive_name(record['pgn_file']), names)
+                self.assertIn(archive_name(record['image_file']), names)
+            merged = archive.read(MERGED_PGN_NAME).decode()
+
+        merged_file = self.media_root / 'merged.pgn'
+        merged_file.write_text(merged)
+        headers = [(game.headers['Opening'], game.headers['Variation']) for game in iter_games(merged_file)]
+        self.assertEqual(sorted(headers), [
+            ('Italian', 'Giuoco Piano'), ('Italian', 'Two Knights'), ('Slav', 'Main Slav')
+        ])
+
+    def test_existing_names_are_skipped(self):
+        archive = self.export()
+        self.two_knights.delete()
+        restored = restore_backup(archive)
+        self.assertEqual(restored, (0, 1, ['Italian', 'Slav', 'Giuoco Piano', 'Main Slav']))
+        self.assertEqual(Variation.objects.get(name='Two Knights').positions.count(), 8)
+
+    def test_broken_archives_restore_nothing(self):
+        # -- Every row is restored but the last one, whose PGN is missing -- #
+        broken = io.BytesIO()
+        with zipfile.ZipFile(self.export()) as source, zipfile.ZipFile(broken, 'w') as archive:
+            manifest = json.loads(source.read(MANIFEST_NAME))
+            missing = archive_name(manifest['variations'][-1]['pgn_file'])
+            for name in source.namelist():
+                if name != missing:
+                    archive.writestr(name, source.read(name))
+        Opening.objects.all().delete()
+        files = {path for path in self.media_root.rglob('*') if path.is_file()}
+
+        with self.assertRaisesMessage(ValueError, 'is missing from the archive'):
+            restore_backup(broken)
+        self.assertFalse(Opening.objects.exists())
+        self.assertEqual({path for path in self.media_root.rglob('*') if path.is_file()}, files)
+
+        manifest['version'] = BACKUP_FORMAT_VERSION + 1
+        outdated = io.BytesIO()
+        with zipfile.ZipFile(outdated, 'w') as archive:
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest))
+        with self.assertRaisesMessage(ValueError, 'Unsupported backup version'):
+            restore_backup(outdated)
+
+    def test_commands(self):
+        backup_file = self.media_root / 'backup.zip'
+        call_command('export_repertoire', str(backup_file), stdout=io.StringIO())
+        Opening.objects.all().delete()
+        call_command('restore_repertoire', str(backup_file), stdout=io.StringIO())
+        self.assertEqual(Variation.objects.count(), 3)
+        with self.assertRaises(CommandError):
+            call_command('restore_repertoire', str(self.media_root / 'missing.zip'), stdout=io.StringIO())
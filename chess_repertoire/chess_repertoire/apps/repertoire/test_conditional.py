@@ -0,0 +1,74 @@
+import json
+import os
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from chess_repertoire.apps.game.game_controller import GAME_TREE_CACHE
+from .models import Opening
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin, create_opening, create_variation
+
+ITALIAN = '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 (3... Nf6 4. Ng5) *'
+
+
+class ConditionalPositionTest(TemporaryMediaMixin, PracticeHistoryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.variation = create_variation(create_opening('Italian'), 'Giuoco Piano', ITALIAN)
+
+    def url(self, name):
+        return reverse(f'repertoire:{name}', kwargs={'opn': 'Italian', 'slug': self.variation.slug})
+
+    def get_position(self, mode, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(self.url(f'{mode}_get_position'), **headers)
+
+    def test_positions_are_revalidated(self):
+        self.client.get(self.url('practice'))
+        for mode in ('practice', 'review'):
+            with self.subTest(mode=mode):
+                response = self.get_position(mode)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Cache-Control'], 'private, no-cache')
+                self.assertEqual(self.get_position(mode)['ETag'], response['ETag'])
+
+                with mock.patch.object(GAME_TREE_CACHE, 'get', side_effect=AssertionError('tree loaded')):
+                    with CaptureQueriesContext(connection) as context:
+                        not_modified = self.get_position(mode, response['ETag'])
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified['ETag'], response['ETag'])
+                self.assertEqual(not_modified.content, b'')
+                self.assertEqual(len(context.captured_queries), 1)
+
+    def test_moves_change_the_etag(self):
+        etag = self.get_position('review')['ETag']
+        move = self.get_position('review').json()['possible_moves'][0]
+        self.client.post(self.url('review_execute_move'), json.dumps({'move': move}), content_type='application/json')
+        response = self.get_position('review', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_practice_attempts_change_the_etag(self):
+        self.client.get(self.url('practice'))
+        etag = self.get_position('practice')['ETag']
+        self.client.post(self.url('practice_restart'))
+        self.assertEqual(self.get_position('practice', etag).status_code, 200)
+
+    def test_pgn_changes_change_the_etag(self):
+        etag = self.get_position('review')['ETag']
+        stat = os.stat(self.variation.pgn_file.path)
+        os.utime(self.variation.pgn_file.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        response = self.get_position('review', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_color_changes_change_the_etag(self):
+        # -- As saved by another process: no signal reaches this one -- #
+        etag = self.get_position('review')['ETag']
+        Opening.objects.filter(name='Italian').update(color=Opening.Color.BLACK)
+        response = self.get_position('review', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
@@ -0,0 +1,173 @@
+import json
+from datetime import timedelta
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from chess_repertoire.apps.game.game_controller import GAME_TREE_CACHE
+from chess_repertoire.apps.game.scheduling import DUE_INDEX, DueIndex
+from .constants import DRILL_INITIAL_EASE, DRILL_MIN_EASE, DRILL_RELEARN_INTERVAL
+from .models import DrillLine
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin, create_opening, create_variation
+
+ITALIAN = '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 (3... Nf6 4. Ng5) *'
+
+
+class DueIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = DueIndex()
+        self.index.load([(1, 'a', 30), (2, 'a', 10), (3, 'b', 20), (4, 'b', 40)])
+
+    def test_ordering(self):
+        self.assertEqual(self.index.peek(), (2, 10))
+        self.assertEqual(self.index.peek('a'), (2, 10))
+        self.assertEqual(self.index.peek('b'), (3, 20))
+        self.assertIsNone(self.index.peek('c'))
+        self.assertEqual(len(self.index), 4)
+
+    def test_rescheduled_and_discarded_lines(self):
+        self.index.update(2, 'a', 50)
+        self.assertEqual(self.index.peek(), (3, 20))
+        self.assertEqual(self.index.peek('a'), (1, 30))
+        self.index.discard(3)
+        self.assertEqual(self.index.peek(), (1, 30))
+        self.assertEqual(self.index.peek('b'), (4, 40))
+        self.index.update(5, 'c', 5)
+        self.assertEqual(self.index.peek(), (5, 5))
+        self.assertEqual(self.index.peek('c'), (5, 5))
+
+    def test_line_moved_to_another_scope(self):
+        self.index.update(2, 'b', 15)
+        self.assertEqual(self.index.peek('a'), (1, 30))
+        self.assertEqual(self.index.peek('b'), (2, 15))
+
+    def test_heaps_are_rebuilt(self):
+        for timestamp in range(100, 1100):
+            self.index.update(1, 'a', timestamp)
+        self.assertLessEqual(len(self.index._heaps[None]), 2 * len(self.index) + 16)
+        self.assertEqual(self.index.peek(), (2, 10))
+        self.assertEqual(self.index.peek('a'), (2, 10))
+        self.index.discard(2)
+        self.assertEqual(self.index.peek('a'), (1, 1099))
+
+    def test_expiry(self):
+        self.assertFalse(self.index.expired)
+        self.assertTrue(DueIndex(max_age=-1).expired)
+        self.index.clear()
+        self.assertTrue(self.index.expired)
+        self.assertIsNone(self.index.peek())
+
+
+class DrillTestMixin(TemporaryMediaMixin):
+    def setUp(self):
+        super().setUp()
+        DUE_INDEX.clear()
+        self.addCleanup(DUE_INDEX.clear)
+        self.variation = create_variation(create_opening('Italian'), 'Giuoco Piano', ITALIAN)
+
+
+class ReviewTest(DrillTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.line = self.variation.drill_lines.get(path='e4 e5 Nf3 Nc6 Bc4 Bc5')
+        self.now = timezone.now()
+
+    def review(self, mistakes=0, hints=0):
+        self.line.review(mistakes, hints, now=self.now)
+        self.line.refresh_from_db()
+        return self.line
+
+    def test_clean_reviews(self):
+        intervals = [self.review().interval for _ in range(4)]
+        self.assertEqual(intervals[:2], [1, 3])
+        self.assertAlmostEqual(intervals[2], 3 * (DRILL_INITIAL_EASE + 0.3))
+        self.assertAlmostEqual(intervals[3], intervals[2] * (DRILL_INITIAL_EASE + 0.4))
+        self.assertEqual((self.line.repetitions, self.line.lapses), (4, 0))
+        self.assertEqual(self.line.due, self.now + timedelta(days=intervals[3]))
+        self.assertEqual(self.line.last_practiced, self.now)
+
+    def test_hints_lower_the_ease(self):
+        self.assertAlmostEqual(self.review(hints=1).ease, DRILL_INITIAL_EASE)
+        self.assertAlmostEqual(self.review(hints=2).ease, DRILL_INITIAL_EASE - 0.14)
+        self.assertAlmostEqual(self.review(hints=5).ease, DRILL_INITIAL_EASE - 0.28)
+        self.assertEqual(self.line.repetitions, 3)
+
+    def test_mistakes_start_the_line_over(self):
+        self.review()
+        self.review()
+        line = self.review(mistakes=2)
+        self.assertEqual((line.repetitions, line.lapses), (0, 1))
+        self.assertAlmostEqual(line.interval, DRILL_RELEARN_INTERVAL)
+        self.assertAlmostEqual(line.ease, DRILL_INITIAL_EASE)
+        self.assertEqual(line.due, self.now + timedelta(minutes=10))
+        self.assertEqual(self.review().interval, 1)
+
+    def test_ease_is_floored(self):
+        for _ in range(10):
+            self.review(mistakes=1)
+        self.assertEqual(self.line.ease, DRILL_MIN_EASE)
+        self.assertEqual(self.line.lapses, 10)
+
+
+class NextDueTest(DrillTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.two_knights = self.variation.drill_lines.get(path='e4 e5 Nf3 Nc6 Bc4 Nf6 Ng5')
+        self.giuoco = self.variation.drill_lines.get(path='e4 e5 Nf3 Nc6 Bc4 Bc5')
+        self.other = create_variation(create_opening('Slav'), 'Main Slav', '1. d4 d5 2. c4 c6 *').drill_lines.get()
+        now = timezone.now()
+        for line, days in ((self.two_knights, -3), (self.giuoco, -2), (self.other, -1)):
+            DrillLine.objects.filter(pk=line.pk).update(due=now + timedelta(days=days))
+
+    def test_most_overdue_line(self):
+        self.assertEqual(DrillLine.next_due(), self.two_knights)
+        self.assertEqual(DrillLine.next_due(self.other.variation_id), self.other)
+        self.two_knights.review(0, 0)
+        self.assertEqual(DrillLine.next_due(), self.giuoco)
+        self.assertEqual(DrillLine.next_due(self.variation.pk), self.giuoco)
+
+    def test_rows_changed_elsewhere_are_fixed(self):
+        DrillLine.next_due()
+        DrillLine.objects.filter(pk=self.two_knights.pk).update(due=timezone.now() + timedelta(days=1))
+        self.giuoco.delete()
+        self.assertEqual(DrillLine.next_due(), self.other)
+        self.assertEqual(DrillLine.next_due(self.variation.pk), self.two_knights)
+        self.assertEqual(len(DUE_INDEX), 2)
+
+    def test_endpoint(self):
+        response = self.client.get(reverse('repertoire:drill_next'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['opening'], data['line'], data['overdue']), ('Italian', self.two_knights.path, True))
+        self.assertTrue(data['practice_url'].endswith(f'?line={self.two_knights.pk}'))
+
+        DrillLine.objects.all().delete()
+        DUE_INDEX.clear()
+        self.assertEqual(self.client.get(reverse('repertoire:drill_next')).status_code, 404)
+
+
+class DrillPracticeTest(DrillTestMixin, PracticeHistoryTestMixin, TestCase):
+    def practice(self, first=False):
+        """Plays the line followed by the practice to its end, and returns its last node."""
+        base = f'/{self.variation.opening.name}/{self.variation.slug}/practice'
+        if first:
+            self.client.get(f'{base}/')
+        else:
+            self.client.post(f'{base}/restart/')
+        tree = GAME_TREE_CACHE.get(self.variation.pgn_file.path)
+        while tree.children(self.client.session['node'][1]):
+            move = tree.san(tree.children(self.client.session['node'][1])[0])
+            response = self.client.post(
+                f'{base}/validate_move/', json.dumps({'move': move}), content_type='application/json'
+            )
+            self.assertTrue(response.json()['correct'])
+        return tree.path(self.client.session['node'][1])
+
+    def test_practice_follows_the_most_overdue_line(self):
+        first, second = self.variation.drill_lines.order_by('due', 'id')
+        self.assertEqual(self.practice(first=True), first.path)
+        first.refresh_from_db()
+        self.assertEqual((first.repetitions, first.interval), (1, 1))
+        self.assertEqual(self.practice(), second.path)
+        self.assertEqual(self.variation.drill_lines.filter(repetitions=1).count(), 2)
@@ -0,0 +1,165 @@
+import json
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+
+from chess_repertoire.apps.game.buffer import WriteBehindBuffer
+from chess_repertoire.apps.game.game_controller import GAME_TREE_CACHE
+from .models import PRACTICE_HISTORY, PracticeAttempt, PracticeMove, write_practice_history
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin, create_opening, create_variation
+
+ITALIAN = '1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *'
+
+
+class WriteBehindBufferTest(SimpleTestCase):
+    def create_buffer(self, max_size=3, max_age=3600, max_pending=None, fail=False):
+        self.batches = []
+        self.closed = 0
+        self.written = threading.Event()
+
+        def write(batch):
+            if fail:
+                raise RuntimeError('database is locked')
+            self.batches.append(batch)
+            self.written.set()
+
+        def close():
+            self.closed += 1
+
+        buffer = WriteBehindBuffer(write, max_size, max_age, max_pending, close=close)
+        buffer.flush_at_exit = False
+        return buffer
+
+    def test_flushed_when_full(self):
+        buffer = self.create_buffer()
+        buffer.add(1)
+        buffer.add(2)
+        self.assertFalse(self.written.wait(0.05))
+        buffer.add(3)
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [[1, 2, 3]])
+        self.assertEqual(len(buffer), 0)
+
+    def test_flushed_when_old(self):
+        buffer = self.create_buffer(max_size=100, max_age=0.05)
+        buffer.add(1)
+        self.assertTrue(self.written.wait(5))
+        self.assertEqual(self.batches, [[1]])
+
+    def test_closed_only_after_a_flush(self):
+        buffer = self.create_buffer(max_size=100, max_age=0.01)
+        buffer.add(1)
+        self.assertTrue(self.written.wait(5))
+        time.sleep(0.2)
+        self.assertEqual(self.closed, 1)
+
+    def test_explicit_flush(self):
+        buffer = self.create_buffer(max_size=100)
+        self.assertEqual(buffer.flush(), 0)
+        buffer.add(1)
+        buffer.add(2)
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(self.batches, [[1, 2]])
+
+    def test_failed_batches_are_put_back(self):
+        buffer = self.create_buffer(max_size=100, max_pending=3, fail=True)
+        buffer.add(1)
+        buffer.add(2)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(len(buffer), 2)
+        buffer.add(3)
+        buffer.add(4)
+        with self.assertRaises(RuntimeError):
+            buffer.flush()
+        self.assertEqual(len(buffer), 0)
+
+    def test_discard_and_exit(self):
+        buffer = self.create_buffer(max_size=100)
+        buffer.add(1)
+        self.assertEqual(buffer.discard(), 1)
+        buffer.add(2)
+        buffer._exit()
+        self.assertEqual(len(buffer), 1)
+        buffer.flush_at_exit = True
+        buffer._exit()
+        self.assertEqual(self.batches, [[2]])
+
+
+class PracticeHistoryTest(TemporaryMediaMixin, PracticeHistoryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.variation = create_variation(create_opening('Italian'), 'Giuoco Piano', ITALIAN)
+        self.tree = GAME_TREE_CACHE.get(self.variation.pgn_file.path)
+
+    def url(self, name):
+        return reverse(f'repertoire:{name}', kwargs={'opn': 'Italian', 'slug': self.variation.slug})
+
+    def post(self, name, data=None):
+        return self.client.post(self.url(name), json.dumps(data or {}), content_type='application/json')
+
+    def next_move(self):
+        return self.tree.san(self.tree.children(self.client.session['node'][1])[0])
+
+    def test_attempts_are_updated_by_key(self):
+        started = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        attempt = dict(key='a' * 32, variation=self.variation, started=started, ended=started)
+        write_practice_history([PracticeAttempt(**attempt, correct_moves=1)])
+        write_practice_history([
+            PracticeAttempt(**attempt, correct_moves=2),
+            PracticeAttempt(**attempt, correct_moves=3, hints_used=1),
+            PracticeMove(attempt='a' * 32, variation=self.variation, ply=0, move='e4', correct=True, played=started)
+        ])
+        self.assertEqual(
+            list(PracticeAttempt.objects.values_list('key', 'correct_moves', 'hints_used')), [('a' * 32, 3, 1)]
+        )
+        self.assertEqual(PracticeMove.objects.count(), 1)
+
+    def test_records_of_deleted_variations_are_dropped(self):
+        played = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        deleted = create_variation(self.variation.opening, 'Two Knights', '1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 *')
+        records = [
+            PracticeMove(attempt='a' * 32, variation=variation, ply=0, move='e4', correct=True, played=played)
+            for variation in (self.variation, deleted, self.variation)
+        ]
+        deleted.delete()
+        write_practice_history(records)
+        self.assertEqual(list(PracticeMove.objects.values_list('variation', flat=True)), [self.variation.pk] * 2)
+
+    def test_abandoned_attempts_are_saved(self):
+        self.client.get(self.url('practice'))
+        self.post('practice_validate_move', {'move': self.next_move()})
+        self.post('practice_get_hints')
+        PRACTICE_HISTORY.flush()
+        self.assertEqual(
+            list(PracticeAttempt.objects.values_list('correct_moves', 'hints_used', 'completed')), [(1, 1, False)]
+        )
+        self.assertEqual(list(PracticeMove.objects.values_list('path', 'move')), [('', 'e4')])
+
+        self.post('practice_validate_move', {'move': 'Kh1'})
+        PRACTICE_HISTORY.flush()
+        self.assertEqual(
+            list(PracticeAttempt.objects.values_list('correct_moves', 'incorrect_moves', 'hints_used')), [(1, 1, 1)]
+        )
+
+    def test_synced_attempts_need_their_node(self):
+        self.client.get(self.url('practice'))
+        cursor = self.client.session['node']
+        response = self.post('practice_sync', {'cursor': cursor, 'attempts': [{'move': 'e4', 'correct': True}]})
+        self.assertEqual(response.status_code, 400)
+        response = self.post('practice_sync', {
+            'cursor': [None, cursor[1]], 'attempts': [{'move': 'e4', 'correct': True, 'node': cursor[1]}]
+        })
+        self.assertEqual(response.status_code, 400)
+        PRACTICE_HISTORY.flush()
+        self.assertFalse(PracticeMove.objects.exists())
+
+        response = self.post('practice_sync', {
+            'cursor': cursor, 'attempts': [{'move': self.next_move(), 'correct': True, 'node': cursor[1]}]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['correct_moves'], 1)
+        PRACTICE_HISTORY.flush()
+        self.assertEqual(list(PracticeMove.objects.values_list('ply', 'move', 'correct')), [(0, 'e4', True)])
@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from chess_repertoire.apps.game.tree import is_compiled
+from .models import DrillLine, Opening, Position, Variation
+from .testing import TemporaryMediaMixin, create_opening
+
+REPERTOIRE = '''
+[Event "?"]
+[Opening "Italian"]
+[Variation "Giuoco Piano"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *
+
+[Event "Two Knights"]
+[Opening "Italian"]
+
+1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 4. Ng5 *
+
+[Event "Main"]
+[Opening "Queens Gambit"]
+[Variation "Giuoco Piano"]
+
+1. d4 d5 2. c4 *
+'''
+
+
+class ImportRepertoireTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.pgn_file = os.path.join(self.folder, 'repertoire.pgn')
+        with open(self.pgn_file, 'w') as file:
+            file.write(REPERTOIRE)
+
+    def media_files(self):
+        return sorted(
+            os.path.join(folder, name) for folder, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def run_import(self, *args):
+        output = io.StringIO()
+        call_command('import_repertoire', self.pgn_file, '--workers', '1', *args, stdout=output)
+        return output.getvalue()
+
+    def test_import(self):
+        create_opening('Queens Gambit')
+        self.run_import('--color', 'black')
+
+        self.assertEqual(list(Opening.objects.order_by('name').values_list('name', 'color')), [
+            ('Italian', Opening.Color.BLACK), ('Queens Gambit', Opening.Color.WHITE)
+        ])
+        variations = {variation.name: variation for variation in Variation.objects.select_related('opening')}
+        self.assertEqual(sorted(variations), ['Giuoco Piano', 'Giuoco Piano 2', 'Two Knights'])
+        two_knights = variations['Two Knights']
+        # -- The second line of an opening starts where it leaves the first one -- #
+        self.assertEqual((variations['Giuoco Piano'].on_turn, two_knights.on_turn), (1, 3))
+        self.assertEqual(variations['Giuoco Piano 2'].opening.name, 'Queens Gambit')
+        self.assertEqual((two_knights.ply_count, two_knights.line_count), (7, 1))
+        self.assertTrue(is_compiled(two_knights.pgn_file.path))
+        self.assertEqual(two_knights.positions.count(), 8)
+        self.assertEqual(Position.objects.count(), 7 + 8 + 4)
+        self.assertEqual(DrillLine.objects.count(), 3)
+
+    def test_dry_run_writes_nothing(self):
+        files = self.media_files()
+        output = self.run_import('--dry-run')
+        self.assertIn('2 openings and 3 variations would be imported', output)
+        self.assertFalse(Opening.objects.exists())
+        self.assertFalse(Variation.objects.exists())
+        self.assertEqual(self.media_files(), files)
+
+    def test_failed_import_is_rolled_back(self):
+        files = self.media_files()
+        with mock.patch.object(DrillLine.objects, 'bulk_create', side_effect=RuntimeError('disk full')):
+            with self.assertRaisesMessage(CommandError, 'nothing was imported: disk full'):
+                self.run_import()
+        self.assertFalse(Opening.objects.exists())
+        self.assertFalse(Variation.objects.exists())
+        self.assertFalse(Position.objects.exists())
+        self.assertEqual(self.media_files(), files)
+
+    def test_missing_path(self):
+        with self.assertRaises(CommandError):
+            call_command('import_repertoire', os.path.join(self.folder, 'missing.pgn'), stdout=io.StringIO())
@@ -0,0 +1,39 @@
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from chess_repertoire.apps.game.statistics import PracticeStatistics
+from .listings import listing_cache_key
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin, create_opening, create_variation
+from .views import OpeningIndex
+
+
+class CachedListingTest(TemporaryMediaMixin, PracticeHistoryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.variation = create_variation(create_opening('Italian'), 'Giuoco Piano', '1. e4 e5 2. Nf3 Nc6 *')
+
+    def test_cached_pages_keep_their_headers(self):
+        response = self.client.get(reverse('repertoire:openings'))
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(0):
+            cached = self.client.get(reverse('repertoire:openings'))
+        self.assertEqual(cached.content, response.content)
+        self.assertEqual(cached['Content-Type'], response['Content-Type'])
+
+    def test_pages_with_a_csrf_token_are_not_cached(self):
+        request = RequestFactory().get(reverse('repertoire:openings'))
+        request.META['CSRF_COOKIE_USED'] = True
+        self.assertEqual(OpeningIndex.as_view()(request).status_code, 200)
+        self.assertIsNone(cache.get(listing_cache_key(request.get_full_path())))
+
+    def test_variations_listing_resets_the_practice(self):
+        self.client.get(reverse('repertoire:practice', kwargs={'opn': 'Italian', 'slug': self.variation.slug}))
+        for key in ('node', PracticeStatistics.SESSION_KEY, 'drill'):
+            self.assertIn(key, self.client.session)
+
+        self.client.get(reverse('repertoire:opening_variations', kwargs={'slug': self.variation.opening.slug}))
+        for key in ('node', PracticeStatistics.SESSION_KEY, 'drill'):
+            self.assertNotIn(key, self.client.session)
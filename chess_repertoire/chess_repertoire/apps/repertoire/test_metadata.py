@@ -0,0 +1,68 @@
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .models import Variation
+from .testing import TemporaryMediaMixin, create_opening, create_variation
+
+ITALIAN = '1. e4 e5 2. Nf3 Nc6 (2... d6 3. d4) 3. Bc4 Bc5 (3... Nf6 4. Ng5) *'
+
+
+class VariationMetadataTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.variation = create_variation(create_opening('Italian'), 'Giuoco Piano', ITALIAN)
+
+    def reload(self):
+        return Variation.objects.get(pk=self.variation.pk)
+
+    def test_metadata_of_the_tree(self):
+        variation = self.reload()
+        self.assertEqual(
+            (variation.ply_count, variation.line_count, variation.max_depth, variation.branching_factor),
+            (10, 3, 7, 1.25)
+        )
+        self.assertEqual(len(variation.final_positions), 3)
+
+    def test_editing_other_fields_keeps_the_index(self):
+        variation = self.reload()
+        positions = list(variation.positions.values_list('pk', flat=True))
+        variation.name = 'Giuoco Pianissimo'
+        with mock.patch('chess_repertoire.apps.repertoire.models.compile_pgn') as compile_mock:
+            with CaptureQueriesContext(connection) as context:
+                variation.save()
+        compile_mock.assert_not_called()
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(list(variation.positions.values_list('pk', flat=True)), positions)
+
+    def test_pgn_rewritten_in_place_is_indexed_again(self):
+        variation = self.reload()
+        drilled = variation.drill_lines.get(path='e4 e5 Nf3 d6 d4')
+        with open(variation.pgn_file.path, 'w') as file:
+            file.write('1. e4 e5 2. Nf3 d6 3. d4 exd4 *\n')
+        variation.save()
+
+        variation = self.reload()
+        self.assertEqual((variation.ply_count, variation.line_count), (6, 1))
+        self.assertEqual(variation.positions.count(), 7)
+        self.assertEqual(list(variation.drill_lines.values_list('path', flat=True)), ['e4 e5 Nf3 d6 d4 exd4'])
+        self.assertNotEqual(variation.drill_lines.get().pk, drilled.pk)
+
+    def test_new_upload_is_indexed(self):
+        variation = self.reload()
+        variation.pgn_file = ContentFile(b'1. d4 d5 *\n', name='queens-gambit.pgn')
+        variation.save()
+        self.assertEqual(list(variation.positions.values_list('path', flat=True)), ['', 'd4', 'd4 d5'])
+        self.assertEqual(self.reload().line_count, 1)
+
+    def test_listing_filters(self):
+        create_variation(self.variation.opening, 'Two Knights', '1. e4 e5 2. Nf3 Nc6 3. Bc4 Nf6 *')
+        response = self.client.get(
+            f'/{self.variation.opening.slug}/variations/', {'min_lines': 2, 'ordering': '-lines'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Giuoco Piano')
+        self.assertNotContains(response, 'Two Knights')
@@ -0,0 +1,113 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chess_repertoire.apps.game.metrics import METRICS, NULL_TIMER, Metrics
+
+
+class MetricsExportTest(SimpleTestCase):
+    def test_prometheus_format(self):
+        metrics = Metrics(enabled=True)
+        with metrics.timer('tree_load'):
+            pass
+        metrics.observe('tree_load', 0.25)
+        metrics.increment('practice_hint')
+        metrics.increment('practice_hint', 2)
+        metrics.begin_request()
+        metrics.end_request('openings', 0.5)
+
+        lines = metrics.export(caches={'game_tree': {'hits': 3, 'misses': 1, 'entries': 1, 'size': 2048}}).splitlines()
+        self.assertIn('# TYPE chess_repertoire_phase_seconds summary', lines)
+        self.assertIn('chess_repertoire_phase_seconds_count{phase="tree_load"} 2', lines)
+        self.assertIn('chess_repertoire_request_seconds_count{view="openings"} 1', lines)
+        self.assertIn('chess_repertoire_request_seconds_sum{view="openings"} 0.500000', lines)
+        self.assertIn('# TYPE chess_repertoire_events_total counter', lines)
+        self.assertIn('chess_repertoire_events_total{event="practice_hint"} 3', lines)
+        self.assertIn('chess_repertoire_cache_hits_total{cache="game_tree"} 3', lines)
+        self.assertIn('# TYPE chess_repertoire_cache_bytes gauge', lines)
+        self.assertIn('chess_repertoire_cache_bytes{cache="game_tree"} 2048', lines)
+        # -- Every sample is `name{labels} value` under its HELP and TYPE -- #
+        for line in lines:
+            if not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                self.assertRegex(name, r'^chess_repertoire_\w+\{\w+="\w+"\}$')
+                float(value)
+
+    def test_server_timing(self):
+        self.assertEqual(
+            Metrics.server_timing({'svg_render': 0.0125, 'db': 0.002}, 0.02),
+            'db;dur=2.00, svg_render;dur=12.50, total;dur=20.00'
+        )
+
+    def test_request_phases(self):
+        metrics = Metrics(enabled=True)
+        metrics.observe('db', 1.0)
+        metrics.begin_request()
+        metrics.observe('db', 0.5)
+        self.assertEqual(metrics.end_request('openings', 1.0), {'db': 0.5})
+        metrics.observe('db', 0.5)
+        self.assertIn('chess_repertoire_phase_seconds_count{phase="db"} 3', metrics.export())
+
+
+class MetricsDisabledTest(TestCase):
+    def test_hooks_are_no_ops(self):
+        metrics = Metrics()
+        self.assertIs(metrics.timer('tree_load'), NULL_TIMER)
+        with metrics.timer('tree_load'):
+            pass
+        metrics.increment('practice_hint')
+        self.assertNotIn('tree_load', metrics.export())
+        self.assertNotIn('practice_hint', metrics.export())
+
+    def test_endpoint_is_hidden(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('repertoire:metrics'))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='secret')
+class MetricsEnabledTest(TestCase):
+    def setUp(self):
+        # -- The middleware of the test client is loaded by its first request, with these settings -- #
+        enabled = METRICS.enabled
+        self.addCleanup(setattr, METRICS, 'enabled', enabled)
+        self.addCleanup(METRICS.reset)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def get_metrics(self, **headers):
+        return self.client.get(reverse('repertoire:metrics'), **headers)
+
+    def test_token_authorization(self):
+        self.assertEqual(self.get_metrics().status_code, 404)
+        self.assertEqual(self.get_metrics(HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+        self.assertEqual(self.get_metrics(HTTP_AUTHORIZATION='secret').status_code, 404)
+        response = self.get_metrics(HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4')
+        self.assertIn('chess_repertoire_request_seconds_count{view="metrics"}', response.content.decode())
+        self.assertIn('chess_repertoire_cache_entries{cache="board_render"}', response.content.decode())
+
+    @override_settings(METRICS_TOKEN='')
+    def test_staff_authorization(self):
+        self.assertEqual(self.get_metrics(HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+        self.client.force_login(User.objects.create_user('player'))
+        self.assertEqual(self.get_metrics().status_code, 404)
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        self.assertEqual(self.get_metrics().status_code, 200)
+
+    def test_requests_are_timed(self):
+        response = self.client.get(reverse('repertoire:openings'))
+        self.assertFalse(response.has_header('Server-Timing'))
+        content = self.get_metrics(HTTP_AUTHORIZATION='Bearer secret').content.decode()
+        self.assertIn('chess_repertoire_request_seconds_count{view="openings"} 1', content)
+        self.assertIn('chess_repertoire_phase_seconds_count{phase="db"}', content)
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        entries = self.client.get(reverse('repertoire:openings'))['Server-Timing'].split(', ')
+        self.assertRegex(entries[-1], r'^total;dur=\d+\.\d{2}$')
+        self.assertIn('db', [entry.split(';')[0] for entry in entries])
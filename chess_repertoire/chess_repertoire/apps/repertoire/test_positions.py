@@ -0,0 +1,58 @@
+import chess
+from django.test import TestCase
+from django.urls import reverse
+
+from chess_repertoire.apps.game.utils import zobrist_key
+from .models import Opening, Position
+from .testing import TemporaryMediaMixin, create_opening, create_variation
+
+
+def board_after(moves):
+    board = chess.Board()
+    for move in moves.split():
+        board.push_san(move)
+    return board
+
+
+class PositionLookupTest(TemporaryMediaMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reti = create_variation(create_opening('Reti'), 'Kings Indian Attack', '1. Nf3 Nf6 2. g3 g6 *')
+        cls.kings_fianchetto = create_variation(
+            create_opening('Kings Fianchetto', Opening.Color.BLACK), 'Double Fianchetto', '1. g3 g6 2. Nf3 Nf6 3. Bg2 *'
+        )
+
+    def lookup(self, fen):
+        return self.client.get(reverse('repertoire:position_lookup'), {'fen': fen})
+
+    def test_every_node_is_indexed(self):
+        self.assertEqual(self.reti.positions.count(), 5)
+        position = self.reti.positions.get(path='Nf3 Nf6')
+        self.assertEqual(position.zobrist, zobrist_key(board_after('Nf3 Nf6')))
+        self.assertEqual(position.turn, Opening.Color.WHITE)
+
+    def test_transpositions_are_found(self):
+        response = self.lookup(board_after('Nf3 Nf6 g3 g6').fen())
+        self.assertEqual(response.status_code, 200)
+        occurrences = sorted(response.json()['occurrences'], key=lambda occurrence: occurrence['opening'])
+        self.assertEqual(
+            [(occurrence['opening'], occurrence['path']) for occurrence in occurrences],
+            [('Kings Fianchetto', 'g3 g6 Nf3 Nf6'), ('Reti', 'Nf3 Nf6 g3 g6')]
+        )
+        self.assertEqual(occurrences[0]['review_url'], reverse('repertoire:review', kwargs={
+            'opn': 'Kings Fianchetto', 'slug': self.kings_fianchetto.slug
+        }))
+
+    def test_side_to_move_tells_positions_apart(self):
+        board = board_after('Nf3')
+        board.turn = chess.WHITE
+        self.assertEqual(self.lookup(board.fen()).json()['occurrences'], [])
+
+    def test_unknown_and_invalid_positions(self):
+        self.assertEqual(self.lookup(board_after('e4').fen()).json()['occurrences'], [])
+        self.assertEqual(self.lookup('not a fen').status_code, 400)
+
+    def test_positions_go_with_their_variation(self):
+        self.reti.delete()
+        self.assertFalse(Position.objects.filter(variation_id=self.reti.pk).exists())
+        self.assertEqual(len(Position.lookup(board_after('Nf3 Nf6 g3 g6').fen())), 1)
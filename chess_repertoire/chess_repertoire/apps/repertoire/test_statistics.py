@@ -0,0 +1,89 @@
+from unittest import mock
+
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.test import SimpleTestCase
+
+from chess_repertoire.apps.game.statistics import MAX_MOVES, MOVES, PracticeStatistics
+from .constants import PRACTICE_HISTORY_SIZE
+
+START = 1_700_000_000
+
+
+class PracticeStatisticsTest(SimpleTestCase):
+    def setUp(self):
+        self.session = SessionStore()
+        clock = mock.patch('chess_repertoire.apps.game.statistics.time.time', return_value=START)
+        self.clock = clock.start()
+        self.addCleanup(clock.stop)
+        PracticeStatistics.initialize_stats(self.session, 'Italian', 'main-line', 7)
+
+    def play(self, moves, correct=True):
+        for move in moves:
+            self.clock.return_value += 1
+            PracticeStatistics.record_move(self.session, move, correct=correct)
+
+    def history(self):
+        return [entry['move'] for entry in PracticeStatistics.get_stats(self.session)['move_history']]
+
+    def test_counters(self):
+        self.play(['e4', 'Nf3'])
+        self.play(['Qh5'], correct=False)
+        PracticeStatistics.record_hint(self.session)
+        PracticeStatistics.mark_completed(self.session)
+
+        stats = PracticeStatistics.get_stats(self.session)
+        self.assertEqual(
+            (stats['correct_moves'], stats['incorrect_moves'], stats['hints_used'], stats['completed']),
+            (2, 1, 1, True)
+        )
+        self.assertEqual((stats['opening_name'], stats['variation_slug'], stats['variation_id']), ('Italian', 'main-line', 7))
+        self.assertEqual([entry['correct'] for entry in stats['move_history']], [True, True, False])
+        self.assertEqual(PracticeStatistics.get_duration_seconds(stats), 3)
+        self.assertAlmostEqual(PracticeStatistics.calculate_accuracy(stats), 200 / 3)
+
+    def test_history_wraps_around(self):
+        moves = [f'm{index}' for index in range(PRACTICE_HISTORY_SIZE + 5)]
+        self.play(moves)
+        self.assertEqual(self.history(), moves[5:])
+        stats = PracticeStatistics.get_stats(self.session)
+        self.assertEqual(stats['correct_moves'], len(moves))
+        timestamps = [entry['timestamp'] for entry in stats['move_history']]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def test_move_table_is_truncated(self):
+        moves = [f'm{index}' for index in range(3 * MAX_MOVES)]
+        self.play(moves)
+        record = self.session[PracticeStatistics.SESSION_KEY]
+        self.assertLessEqual(len(record[MOVES]), MAX_MOVES)
+        self.assertEqual(self.history(), moves[-PRACTICE_HISTORY_SIZE:])
+
+    def test_repeated_moves_share_an_entry(self):
+        self.play(['e4', 'e4', 'Nf3', 'e4'])
+        self.assertEqual(self.session[PracticeStatistics.SESSION_KEY][MOVES], ['e4', 'Nf3'])
+        self.assertEqual(self.history(), ['e4', 'e4', 'Nf3', 'e4'])
+
+    def test_attempt_is_ended_once(self):
+        attempt = PracticeStatistics.get_attempt(self.session)
+        self.play(['e4'])
+        progress = PracticeStatistics.get_progress(self.session)
+        self.play(['Nf3'])
+        self.assertNotEqual(PracticeStatistics.get_progress(self.session), progress)
+
+        stats = PracticeStatistics.end_attempt(self.session)
+        self.assertEqual(stats['attempt'], attempt)
+        self.assertEqual((stats['started_at'], stats['ended_at']), (START, START + 2))
+        self.assertIsNone(PracticeStatistics.get_attempt(self.session))
+        self.assertIsNone(PracticeStatistics.end_attempt(self.session))
+        self.assertIsNone(PracticeStatistics.get_attempt_stats(self.session))
+
+    def test_former_records_are_discarded(self):
+        self.session[PracticeStatistics.SESSION_KEY] = {'correct_moves': 3}
+        self.assertIsNone(PracticeStatistics.get_stats(self.session))
+        PracticeStatistics.record_move(self.session, 'e4', correct=True)
+        self.assertIsNone(PracticeStatistics.get_progress(self.session))
+
+    def test_record_survives_the_signed_cookie(self):
+        self.play(['e4', 'Nf3'])
+        self.session.save()
+        restored = SessionStore(session_key=self.session.session_key)
+        self.assertEqual(PracticeStatistics.get_stats(restored), PracticeStatistics.get_stats(self.session))
@@ -0,0 +1,53 @@
+import json
+
+from django.test import TestCase
+from django.urls import reverse
+
+from .models import PRACTICE_HISTORY, PracticeMove
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin, create_opening, create_variation
+
+
+class PracticeSyncPayloadTest(TemporaryMediaMixin, PracticeHistoryTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        variation = create_variation(create_opening('Italian'), 'Giuoco Piano', '1. e4 e5 2. Nf3 Nc6 *')
+        self.url = reverse('repertoire:practice_sync', kwargs={'opn': 'Italian', 'slug': variation.slug})
+        self.client.get(reverse('repertoire:practice', kwargs={'opn': 'Italian', 'slug': variation.slug}))
+        self.cursor = self.client.session['node']
+
+    def sync(self, data):
+        body = data if isinstance(data, str) else json.dumps(data)
+        return self.client.post(self.url, body, content_type='application/json')
+
+    def test_malformed_payloads_are_rejected(self):
+        attempt = {'move': 'e4', 'correct': True, 'node': self.cursor[1]}
+        payloads = [
+            'not json',
+            [attempt],
+            {'cursor': 'e4'},
+            {'cursor': [self.cursor[0]]},
+            {'cursor': [self.cursor[0], 'root']},
+            {'cursor': self.cursor, 'attempts': attempt},
+            {'cursor': self.cursor, 'attempts': ['e4']},
+            {'cursor': self.cursor, 'attempts': [{'correct': True, 'node': self.cursor[1]}]},
+            {'cursor': self.cursor, 'attempts': [{'move': 'e4', 'node': self.cursor[1]}]},
+            {'cursor': self.cursor, 'attempts': [{**attempt, 'correct': 'yes'}]},
+            {'cursor': self.cursor, 'attempts': [{**attempt, 'node': True}]},
+            {'cursor': self.cursor, 'hints': '2'},
+            {'cursor': self.cursor, 'hints': -1},
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                response = self.sync(payload)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+        PRACTICE_HISTORY.flush()
+        self.assertFalse(PracticeMove.objects.exists())
+
+    def test_valid_payload(self):
+        response = self.sync({
+            'cursor': self.cursor, 'hints': 1,
+            'attempts': [{'move': 'e4', 'correct': True, 'node': self.cursor[1]}]
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['correct_moves'], response.json()['hints_used']), (1, 1))
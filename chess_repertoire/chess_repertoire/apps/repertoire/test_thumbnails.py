@@ -0,0 +1,109 @@
+import io
+import os
+from pathlib import PurePosixPath
+
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase
+from django.urls import reverse
+from PIL import Image
+
+from .constants import THUMBNAIL_CACHE_MAX_AGE, THUMBNAIL_DIR, THUMBNAIL_WIDTHS
+from .models import Opening
+from .testing import TemporaryMediaMixin, create_opening, create_variation
+from .thumbnails import THUMBNAIL_FORMATS, make_thumbnails, thumbnail_folder
+
+
+def png(width, height, mode='RGB'):
+    content = io.BytesIO()
+    Image.new(mode, (width, height), 'green').save(content, 'PNG')
+    return ContentFile(content.getvalue(), name='board.png')
+
+
+class ThumbnailTest(TemporaryMediaMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.opening = create_opening('Italian')
+        self.opening.image = png(800, 400, 'RGBA')
+        self.opening.save()
+
+    def thumbnails(self, name):
+        # -- The media folder is shared by the tests of the class -- #
+        stem = PurePosixPath(name).stem
+        try:
+            return sorted(entry for entry in os.listdir(thumbnail_folder(name)) if entry.startswith(f'{stem}.'))
+        except FileNotFoundError:
+            return []
+
+    def test_every_width_and_format_is_made(self):
+        names = self.thumbnails(self.opening.image.name)
+        self.assertEqual(len(names), len(THUMBNAIL_WIDTHS) * len(THUMBNAIL_FORMATS))
+        folder = thumbnail_folder(self.opening.image.name)
+        for name in names:
+            _, _, width, extension = name.split('.')
+            self.assertIn(extension, [extension for extension, _ in THUMBNAIL_FORMATS])
+            with Image.open(os.path.join(folder, name)) as thumbnail:
+                self.assertEqual(thumbnail.size, (int(width), int(width) // 2))
+                self.assertEqual(thumbnail.mode, 'RGB')
+        self.assertEqual({name.split('.')[2] for name in names}, {str(width) for width in THUMBNAIL_WIDTHS})
+
+    def test_small_and_unreadable_images_are_skipped(self):
+        self.opening.image = png(250, 100)
+        self.opening.save()
+        self.assertEqual(self.thumbnails(self.opening.image.name), [])
+        # -- Boards of imported variations are SVG -- #
+        variation = create_variation(self.opening, 'Giuoco Piano', '1. e4 e5 *')
+        self.assertEqual(make_thumbnails(variation.image_file.name), [])
+
+    def test_replaced_images_get_new_thumbnails(self):
+        before = self.thumbnails(self.opening.image.name)
+        os.utime(self.opening.image.path, ns=(0, 0))
+        self.assertEqual(make_thumbnails(self.opening.image.name), [300, 600])
+        after = self.thumbnails(self.opening.image.name)
+        self.assertEqual(len(after), len(before))
+        self.assertFalse(set(after) & set(before))
+
+        # -- A new upload: django-cleanup removes the previous image and its thumbnails -- #
+        previous = self.opening.image.name
+        self.opening.image = png(400, 400)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.opening.save()
+        names = self.thumbnails(self.opening.image.name)
+        self.assertEqual({name.split('.')[2] for name in names}, {'300'})
+        self.assertEqual(self.thumbnails(previous), [])
+
+    def test_thumbnails_go_with_their_image(self):
+        folder = thumbnail_folder(self.opening.image.name)
+        with self.captureOnCommitCallbacks(execute=True):
+            Opening.objects.get(pk=self.opening.pk).delete()
+        self.assertFalse(os.path.exists(folder))
+
+    def test_srcset_and_serving(self):
+        rendered = Template(
+            "{% load custom_tags %}{% thumbnail_srcset opening.image 'jpg' %}"
+        ).render(Context({'opening': self.opening}))
+        candidates = [candidate.split() for candidate in rendered.split(', ')]
+        self.assertEqual([width for _, width in candidates], ['300w', '600w'])
+        self.assertIn(f'/{THUMBNAIL_DIR}/', candidates[0][0])
+
+        response = self.client.get(candidates[0][0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={THUMBNAIL_CACHE_MAX_AGE}, immutable')
+        self.assertEqual(b''.join(response.streaming_content)[:2], b'\xff\xd8')
+
+        self.assertEqual(Template(
+            "{% load custom_tags %}{% thumbnail_srcset opening.image %}"
+        ).render(Context({'opening': Opening(name='Empty')})), '')
+
+    def test_command(self):
+        for name in self.thumbnails(self.opening.image.name):
+            os.remove(os.path.join(thumbnail_folder(self.opening.image.name), name))
+        output = io.StringIO()
+        call_command('make_thumbnails', stdout=output)
+        self.assertIn('Thumbnails made for 1 images', output.getvalue())
+        self.assertEqual(
+            len(self.thumbnails(self.opening.image.name)), len(THUMBNAIL_WIDTHS) * len(THUMBNAIL_FORMATS)
+        )
+        response = self.client.get(reverse('repertoire:openings'))
+        self.assertContains(response, 'srcset')
@@ -0,0 +1,260 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import chess
+import chess.pgn as pgn
+from django.test import SimpleTestCase
+
+from chess_repertoire.apps.game.game_controller import BoardRenderCache, GameTreeCache, LRUCache
+from chess_repertoire.apps.game.tree import (
+    CompiledTree, compile_game, compile_pgn, is_compiled, load_tree, sidecar_path
+)
+
+REPERTOIRE = '''
+[Event "Italian"]
+
+1. e4 { King pawn } e5 2. Nf3 $1 Nc6 (2... d6 3. d4) 3. Bc4 Nf6?? (3... Bc5 4. c3) 4. Ng5 *
+'''
+MATE = '1. e4 e5 2. Bc4 Nc6 3. Qh5 Nf6 4. Qxf7# *'
+
+
+# -- Helper functions -- #
+def read_game(text):
+    return pgn.read_game(io.StringIO(text))
+
+def walk(game):
+    """Nodes of a python-chess game in pre-order, children in PGN order."""
+    pending = [game]
+    while pending:
+        node = pending.pop()
+        yield node
+        pending.extend(reversed(node.variations))
+
+
+# -- Compiled trees -- #
+class CompiledTreeTest(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.pgn_file = os.path.join(self.folder, 'italian.pgn')
+        self.write(REPERTOIRE)
+
+    def write(self, text):
+        with open(self.pgn_file, 'w') as file:
+            file.write(text)
+
+    def test_round_trip(self):
+        game = read_game(REPERTOIRE)
+        tree = CompiledTree(compile_game(game))
+        nodes = list(walk(game))
+        ids = {id(node): node_id for node_id, node in enumerate(nodes)}
+
+        self.assertEqual(len(tree), len(nodes))
+        for node_id, node in enumerate(nodes):
+            with self.subTest(node=node_id):
+                self.assertEqual(tree.parent(node_id), ids[id(node.parent)] if node.parent else -1)
+                self.assertEqual(tree.children(node_id), tuple(ids[id(child)] for child in node.variations))
+                self.assertEqual(tree.ply(node_id), node.ply())
+                self.assertEqual(tree.move(node_id), node.move)
+                self.assertEqual(tree.san(node_id), node.san() if node.move else '')
+                self.assertEqual(tree.fen(node_id), node.board().fen())
+                self.assertEqual(tree.comment(node_id), node.comment)
+        self.assertEqual(tree.nag(ids[id(game.next().next().next())]), pgn.NAG_GOOD_MOVE)
+        self.assertEqual(tree.path(tree.children(0)[0]), 'e4')
+        self.assertEqual(
+            sorted(path for _, path in tree.lines()),
+            ['e4 e5 Nf3 Nc6 Bc4 Bc5 c3', 'e4 e5 Nf3 Nc6 Bc4 Nf6 Ng5', 'e4 e5 Nf3 d6 d4']
+        )
+
+    def test_checkmate_flags(self):
+        tree = CompiledTree(compile_game(read_game(MATE)))
+        self.assertEqual([tree.is_checkmate(node_id) for node_id in range(len(tree))], [False] * 7 + [True])
+
+    def test_positional_nags_are_ignored(self):
+        # -- NAGs are a set: of several assessments, the lowest one is kept -- #
+        tree = CompiledTree(compile_game(read_game('1. e4 $14 e5 $2 $18 2. Nf3 $4 $1 *')))
+        self.assertEqual(
+            [tree.nag(node_id) for node_id in range(len(tree))], [0, 0, pgn.NAG_MISTAKE, pgn.NAG_GOOD_MOVE]
+        )
+
+    def test_memoized_replies_are_bounded_and_weighed(self):
+        data = compile_game(read_game(REPERTOIRE))
+        tree = CompiledTree(data)
+        self.assertEqual(tree.nbytes, 2 * len(data))
+        with mock.patch('chess_repertoire.apps.game.tree.TREE_MEMO_MAX_BYTES', 600):
+            tree = CompiledTree(data)
+        self.assertEqual(tree.nbytes, len(data) + 600)
+        for node_id in range(len(tree)):
+            self.assertEqual(tree.child_sans(node_id), tuple(tree.san(child) for child in tree.children(node_id)))
+            self.assertEqual([hint['san'] for hint in tree.hints(node_id)], list(tree.child_sans(node_id)))
+            self.assertLessEqual(tree._memo_bytes, tree.memo_max_bytes)
+        self.assertLess(len(tree._replies), len(tree))
+
+    def test_games_of_a_file_are_merged(self):
+        self.write(REPERTOIRE + '\n\n1. e4 e5 2. Nf3 Nc6 3. Bb5 *\n\n[FEN "8/8/8/8/8/8/8/K6k w - - 0 1"]\n\n1. Ka2 *\n')
+        tree = CompiledTree(compile_pgn(self.pgn_file))
+        self.assertIn('e4 e5 Nf3 Nc6 Bb5', [path for _, path in tree.lines()])
+        self.assertEqual(tree.fen(0), chess.STARTING_FEN)
+
+    def test_sidecar_is_reused_while_the_pgn_is_unchanged(self):
+        compile_pgn(self.pgn_file)
+        self.assertTrue(is_compiled(self.pgn_file))
+        with mock.patch('chess_repertoire.apps.game.tree.compile_pgn') as compile_mock:
+            tree = load_tree(self.pgn_file)
+        compile_mock.assert_not_called()
+        self.assertEqual(len(tree), len(list(walk(read_game(REPERTOIRE)))))
+
+    def test_sidecar_is_recompiled_when_the_pgn_changes(self):
+        compile_pgn(self.pgn_file)
+        self.write('1. d4 d5 *\n')
+        self.assertFalse(is_compiled(self.pgn_file))
+        tree = load_tree(self.pgn_file)
+        self.assertEqual([path for _, path in tree.lines()], ['d4 d5'])
+        self.assertTrue(is_compiled(self.pgn_file))
+
+    def test_broken_sidecar_is_recompiled(self):
+        with open(sidecar_path(self.pgn_file), 'wb') as file:
+            file.write(b'CRTREE broken')
+        self.assertFalse(is_compiled(self.pgn_file))
+        self.assertEqual(len(load_tree(self.pgn_file)), len(list(walk(read_game(REPERTOIRE)))))
+        self.assertTrue(is_compiled(self.pgn_file))
+
+
+# -- Caches -- #
+class LRUCacheTest(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted_by_weight(self):
+        cache = LRUCache(max_bytes=10)
+        cache.store('a', 'A', 4)
+        cache.store('b', 'B', 4)
+        self.assertEqual(cache.lookup('a'), 'A')
+        cache.store('c', 'C', 4)
+        self.assertIsNone(cache.lookup('b'))
+        self.assertEqual((cache.lookup('a'), cache.lookup('c')), ('A', 'C'))
+        self.assertEqual(cache.stats['size'], 8)
+
+    def test_oversized_values_are_not_stored(self):
+        cache = LRUCache(max_bytes=10)
+        cache.store('a', 'A', 4)
+        cache.store('big', 'BIG', 11)
+        self.assertIsNone(cache.lookup('big'))
+        self.assertEqual(cache.lookup('a'), 'A')
+
+    def test_other_versions_are_misses(self):
+        cache = LRUCache(max_bytes=10)
+        cache.store('a', 'A', 1, version=1)
+        self.assertIsNone(cache.lookup('a', version=2))
+        self.assertEqual(cache.lookup('a', version=1), 'A')
+        self.assertEqual((cache.stats['hits'], cache.stats['misses']), (1, 1))
+
+
+class GameTreeCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+        self.pgn_file = os.path.join(self.folder, 'italian.pgn')
+        with open(self.pgn_file, 'w') as file:
+            file.write(REPERTOIRE)
+
+    def test_trees_are_loaded_once_per_file_version(self):
+        cache = GameTreeCache()
+        tree = cache.get(self.pgn_file)
+        self.assertIs(cache.get(self.pgn_file), tree)
+        self.assertEqual(tree.version, GameTreeCache.file_version(self.pgn_file))
+
+        with open(self.pgn_file, 'w') as file:
+            file.write('1. d4 d5 *\n')
+        changed = cache.get(self.pgn_file)
+        self.assertIsNot(changed, tree)
+        self.assertNotEqual(changed.version, tree.version)
+        self.assertEqual(cache.stats['entries'], 1)
+
+    def test_trees_beyond_the_budget_are_evicted(self):
+        other = os.path.join(self.folder, 'other.pgn')
+        shutil.copy(self.pgn_file, other)
+        cache = GameTreeCache(max_bytes=load_tree(self.pgn_file).nbytes)
+        cache.get(self.pgn_file)
+        cache.get(other)
+        self.assertEqual(cache.stats['entries'], 1)
+        self.assertIsNone(cache.lookup(os.path.abspath(self.pgn_file), GameTreeCache.signature(self.pgn_file)))
+
+    def test_concurrent_misses_are_coalesced(self):
+        cache, calls = GameTreeCache(), []
+
+        def slow_load(pgn_file, version=None):
+            calls.append(pgn_file)
+            time.sleep(0.05)
+            return load_tree(pgn_file, version)
+
+        trees = []
+        with mock.patch('chess_repertoire.apps.game.game_controller.load_tree', slow_load):
+            threads = [threading.Thread(target=lambda: trees.append(cache.get(self.pgn_file))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(trees), 4)
+        self.assertTrue(all(tree is trees[0] for tree in trees))
+
+
+class BoardRenderCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def render(self, cache, board):
+        return cache.render(board, [], False, board.peek() if board.move_stack else None, 200)
+
+    def renders(self):
+        return sorted(name for name in os.listdir(self.folder) if name.endswith('.svg'))
+
+    def boards(self, count):
+        board, boards = chess.Board(), []
+        for move in ['e4', 'e5', 'Nf3', 'Nc6', 'Bc4', 'Bc5', 'c3', 'Nf6'][:count]:
+            board.push_san(move)
+            boards.append(board.copy())
+        return boards
+
+    def test_renders_survive_restarts(self):
+        board = self.boards(1)[0]
+        image = self.render(BoardRenderCache(directory=self.folder), board)
+        with mock.patch('chess_repertoire.apps.game.game_controller.svg.board') as draw:
+            self.assertEqual(self.render(BoardRenderCache(directory=self.folder), board), image)
+        draw.assert_not_called()
+
+    def path(self, board):
+        return os.path.join(self.folder, f'{BoardRenderCache.key(board.fen(), [], False, board.peek(), 200)}.svg')
+
+    def test_least_recently_used_renders_are_removed(self):
+        boards = self.boards(5)
+        cache = BoardRenderCache(max_bytes=0, directory=self.folder)
+        for age, board in enumerate(boards[:4]):
+            self.render(cache, board)
+            os.utime(self.path(board), ns=(age, age))
+        cache.directory_max_bytes = cache.directory_size
+        # -- A read marks the oldest render as recently used -- #
+        self.render(cache, boards[0])
+
+        self.render(cache, boards[4])
+        self.assertEqual(
+            [os.path.exists(self.path(board)) for board in boards], [True, False, False, False, True]
+        )
+        self.assertEqual(
+            cache.directory_size, os.path.getsize(self.path(boards[0])) + os.path.getsize(self.path(boards[4]))
+        )
+        self.assertLessEqual(cache.directory_size, cache.directory_max_bytes * 3 // 4)
+
+    def test_oversized_directories_are_pruned_at_start(self):
+        cache = BoardRenderCache(directory=self.folder)
+        for board in self.boards(6):
+            self.render(cache, board)
+        cache = BoardRenderCache(directory=self.folder, directory_max_bytes=cache.directory_size // 2)
+        self.assertLessEqual(cache.directory_size, cache.directory_max_bytes * 3 // 4)
+        self.assertEqual(cache.directory_size, sum(
+            os.path.getsize(os.path.join(self.folder, name)) for name in self.renders()
+        ))
@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+from django.utils.text import slugify
+
+from .models import PRACTICE_HISTORY, Opening, Variation
+
+# -- Factories -- #
+def create_opening(name, color=Opening.Color.WHITE):
+    return Opening.objects.create(
+        name=name, color=color, difficulty=Opening.Difficulty.EASY, category=Opening.Category.CLASSIC,
+        image=ContentFile(b'', name=f'{slugify(name)}.png')
+    )
+
+def create_variation(opening, name, moves, on_turn=1):
+    """Variation of `opening` uploaded with the PGN `moves`."""
+    variation = Variation(name=name, on_turn=on_turn, nature=Variation.Nature.THEORIC, opening=opening)
+    variation.pgn_file.save(f'{slugify(name)}.pgn', ContentFile(moves.encode()), save=False)
+    variation.image_file.save(f'{slugify(name)}.png', ContentFile(b''), save=False)
+    variation.save()
+    return variation
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Test runner dropping the buffered practice history with the test database.
+
+    Records still pending when the test database is destroyed are discarded,
+    and nothing is flushed at exit: it would be written to the real database.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        PRACTICE_HISTORY.flush_at_exit = False
+
+    def teardown_databases(self, old_config, **kwargs):
+        PRACTICE_HISTORY.discard()
+        super().teardown_databases(old_config, **kwargs)
+
+
+class PracticeHistoryTestMixin:
+    """Mixin for TestCases starting and ending with an empty practice history buffer."""
+
+    def setUp(self):
+        super().setUp()
+        PRACTICE_HISTORY.discard()
+        self.addCleanup(PRACTICE_HISTORY.discard)
+
+
+class TemporaryMediaMixin:
+    """Mixin for TestCases storing their uploads in a MEDIA_ROOT of their own, removed at the end."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = Path(tempfile.mkdtemp(prefix='repertoire_test_'))
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        try:
+            super().setUpClass()
+        except Exception:
+            cls.media_settings.disable()
+            shutil.rmtree(cls.media_root, ignore_errors=True)
+            raise
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            super().tearDownClass()
+        finally:
+            cls.media_settings.disable()
+            shutil.rmtree(cls.media_root, ignore_errors=True)
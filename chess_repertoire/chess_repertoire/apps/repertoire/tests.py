@@ -1,3 +1,215 @@
-from django.test import TestCase
+import json
+import os
+import random
+import statistics
+import time
+import unittest
+import tracemalloc
+from pathlib import Path
 
-# Create your tests here.
+import chess
+import chess.pgn as pgn
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, tag
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from chess_repertoire.apps.game.game_controller import GAME_TREE_CACHE
+from .models import Opening, Variation
+from .testing import PracticeHistoryTestMixin, TemporaryMediaMixin
+
+# -- Benchmark configuration, overridable from the environment -- #
+BENCHMARK_ENABLED = os.environ.get('BENCHMARK', '') == '1'
+BENCHMARK_LINE_DEPTH = int(os.environ.get('BENCHMARK_LINE_DEPTH', 40))
+BENCHMARK_BRANCHING = int(os.environ.get('BENCHMARK_BRANCHING', 3))
+BENCHMARK_BRANCH_PLIES = int(os.environ.get('BENCHMARK_BRANCH_PLIES', 8))
+BENCHMARK_DEPTHS = [int(depth) for depth in os.environ.get('BENCHMARK_DEPTHS', '2,8,16,32').split(',')]
+BENCHMARK_REPEAT = int(os.environ.get('BENCHMARK_REPEAT', 30))
+BENCHMARK_BASELINE = Path(os.environ.get(
+    'BENCHMARK_BASELINE', Path.home() / '.cache' / 'chess_repertoire' / 'benchmark_baseline.json'
+))
+BENCHMARK_UPDATE = os.environ.get('BENCHMARK_UPDATE', '') == '1'
+BENCHMARK_TOLERANCE = float(os.environ.get('BENCHMARK_TOLERANCE', 2.0))
+
+
+# -- Helper functions -- #
+def build_repertoire(line_depth, branching, branch_plies, seed=0):
+    """
+    Synthetic White repertoire: one move on every White turn and `branching`
+    Black replies on every Black turn of the first `branch_plies` plies, so
+    the tree holds `branching ** (branch_plies // 2)` lines of `line_depth`.
+    """
+    rnd = random.Random(seed)
+    game = pgn.Game()
+    pending = [(game, game.board())]
+    while pending:
+        node, board = pending.pop()
+        if node.ply() >= line_depth or board.is_game_over():
+            continue
+        width = branching if board.turn == chess.BLACK and node.ply() < branch_plies else 1
+        moves = list(board.legal_moves)
+        for move in rnd.sample(moves, min(width, len(moves))):
+            child_board = board.copy(stack=False)
+            child_board.push(move)
+            pending.append((node.add_variation(move), child_board))
+    return game
+
+def percentiles(timings):
+    cuts = statistics.quantiles(timings, n=100, method='inclusive')
+    return {
+        'p50': round(cuts[49] * 1000, 3),
+        'p95': round(cuts[94] * 1000, 3),
+        'p99': round(cuts[98] * 1000, 3),
+    }
+
+
+# -- Benchmarks -- #
+@tag('benchmark')
+@unittest.skipUnless(BENCHMARK_ENABLED, 'Benchmarks only run with BENCHMARK=1')
+class EndpointLatencyBenchmark(TemporaryMediaMixin, PracticeHistoryTestMixin, TestCase):
+    """
+    Latency of the practice and review AJAX endpoints at increasing line depths.
+
+    Every endpoint is requested `BENCHMARK_REPEAT` times with the session
+    cursor at each depth of `BENCHMARK_DEPTHS`, and reports p50/p95/p99
+    latency (ms), DB queries, session payload size and the peak of traced
+    allocations. It only runs with `BENCHMARK=1`. Results are saved to
+    `BENCHMARK_BASELINE` with `BENCHMARK_UPDATE=1`; otherwise, if a baseline
+    exists, the run fails if an endpoint needs more queries or its p95 grows
+    beyond `BENCHMARK_TOLERANCE` times the baseline.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.opening = Opening.objects.create(
+            name='Benchmark', color=Opening.Color.WHITE, difficulty='B', category='CL',
+            image=ContentFile(b'', name='benchmark.png')
+        )
+        game = build_repertoire(BENCHMARK_LINE_DEPTH, BENCHMARK_BRANCHING, BENCHMARK_BRANCH_PLIES)
+        cls.variation = Variation(name='Synthetic', on_turn=1, nature='THC', opening=cls.opening)
+        cls.variation.pgn_file.save('synthetic.pgn', ContentFile(str(game).encode()), save=False)
+        cls.variation.image_file.save('synthetic.png', ContentFile(b''), save=False)
+        cls.variation.save()
+
+    def url(self, name):
+        return reverse(
+            f'repertoire:{name}', kwargs={'opn': self.opening.name, 'slug': self.variation.slug}
+        )
+
+    def line(self):
+        """Cursors along the first line of the tree, indexed by ply."""
+        tree = GAME_TREE_CACHE.get(self.variation.pgn_file.path)
+        cursors, node_id = [], 0
+        while True:
+            cursors.append(([tree.version, node_id], tree.child_sans(node_id)))
+            if not tree.children(node_id):
+                return cursors
+            node_id = tree.children(node_id)[0]
+
+    def set_cursor(self, cursor):
+        session = self.client.session
+        session['node'] = cursor
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def session_size(self):
+        """Bytes stored for the session: the cookie itself with signed cookies, the encoded data otherwise."""
+        if settings.SESSION_ENGINE.endswith('signed_cookies'):
+            return len(self.client.cookies[settings.SESSION_COOKIE_NAME].value)
+        session = self.client.session
+        return len(session.encode(dict(session.items())))
+
+    def request(self, method, url, data):
+        if method == 'get':
+            return self.client.get(url)
+        return self.client.post(url, json.dumps(data or {}), content_type='application/json')
+
+    def measure(self, method, name, cursor, data=None):
+        url = self.url(name)
+        self.set_cursor(cursor)
+        self.request(method, url, data)
+
+        timings, queries = [], 0
+        for _ in range(BENCHMARK_REPEAT):
+            self.set_cursor(cursor)
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = self.request(method, url, data)
+                timings.append(time.perf_counter() - start)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertNotIn('error', response.json())
+            queries = max(queries, len(context.captured_queries))
+
+        # -- Allocations are traced in a separate request so tracing does not skew the timings -- #
+        self.set_cursor(cursor)
+        tracemalloc.start()
+        self.request(method, url, data)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return {
+            **percentiles(timings),
+            'queries': queries,
+            'session_bytes': self.session_size(),
+            'peak_bytes': peak,
+        }
+
+    def run_benchmarks(self):
+        line = self.line()
+        results = {}
+        # -- Opening the practice page starts the statistics kept in session -- #
+        self.client.get(self.url('practice'))
+        for depth in BENCHMARK_DEPTHS:
+            if depth >= len(line) - 1:
+                continue
+            cursor, moves = line[depth]
+            # -- Practice requires the player (White) to be on move -- #
+            practice_cursor, practice_moves = line[depth - depth % 2]
+            for name, method, position, data in (
+                ('review_get_position', 'get', cursor, None),
+                ('review_execute_move', 'post', cursor, {'move': moves[0]}),
+                ('review_undo_move', 'post', cursor, None),
+                ('practice_get_position', 'get', practice_cursor, None),
+                ('practice_get_hints', 'post', practice_cursor, None),
+                ('practice_validate_move', 'post', practice_cursor, {'move': practice_moves[0]}),
+            ):
+                results.setdefault(name, {})[str(depth)] = self.measure(method, name, position, data)
+        return results
+
+    def report(self, results):
+        print(f'\n{"endpoint":<24}{"depth":>6}{"p50":>9}{"p95":>9}{"p99":>9}{"queries":>9}{"session":>9}{"peak":>10}')
+        for name, depths in results.items():
+            for depth, metrics in depths.items():
+                print(
+                    f'{name:<24}{depth:>6}{metrics["p50"]:>9}{metrics["p95"]:>9}{metrics["p99"]:>9}'
+                    f'{metrics["queries"]:>9}{metrics["session_bytes"]:>9}{metrics["peak_bytes"]:>10}'
+                )
+
+    def test_endpoint_latency(self):
+        config = {
+            'line_depth': BENCHMARK_LINE_DEPTH,
+            'branching': BENCHMARK_BRANCHING,
+            'branch_plies': BENCHMARK_BRANCH_PLIES,
+            'repeat': BENCHMARK_REPEAT,
+        }
+        results = self.run_benchmarks()
+        self.report(results)
+
+        if BENCHMARK_UPDATE:
+            BENCHMARK_BASELINE.parent.mkdir(parents=True, exist_ok=True)
+            BENCHMARK_BASELINE.write_text(json.dumps({'config': config, 'results': results}, indent=2))
+            return
+        if not BENCHMARK_BASELINE.exists():
+            self.skipTest(f'No baseline at {BENCHMARK_BASELINE}, record one with BENCHMARK_UPDATE=1')
+        baseline = json.loads(BENCHMARK_BASELINE.read_text())
+        if baseline['config'] != config:
+            self.skipTest('Baseline was recorded with a different configuration')
+        for name, depths in results.items():
+            for depth, metrics in depths.items():
+                expected = baseline['results'].get(name, {}).get(depth)
+                if expected is None:
+                    continue
+                with self.subTest(endpoint=name, depth=depth):
+                    self.assertLessEqual(metrics['queries'], expected['queries'])
+                    self.assertLessEqual(metrics['p95'], expected['p95'] * BENCHMARK_TOLERANCE)
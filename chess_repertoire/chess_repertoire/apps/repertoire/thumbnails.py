@@ -0,0 +1,104 @@
+import hashlib
+import os
+from pathlib import PurePosixPath
+
+from django.core.files.storage import default_storage
+from PIL import Image, UnidentifiedImageError, features
+
+from .constants import THUMBNAIL_DIR, THUMBNAIL_QUALITY, THUMBNAIL_WIDTHS
+
+# -- Formats -- #
+# WebP is only produced when Pillow was built with it, JPEG always is.
+THUMBNAIL_FORMATS = [
+    (extension, image_format) for extension, image_format in (('webp', 'WEBP'), ('jpg', 'JPEG'))
+    if image_format != 'WEBP' or features.check('webp')
+]
+
+
+# -- Naming -- #
+# Thumbnails of `<folder>/<stem>.<ext>` are stored as
+# `<folder>/thumbs/<stem>.<token>.<width>.<format>`, where the token comes from
+# the size and modification time of the source: a new upload gets new URLs, so
+# thumbnails can be cached by browsers for good.
+def thumbnail_token(name):
+    stat = os.stat(default_storage.path(name))
+    return hashlib.blake2b(f'{stat.st_mtime_ns}:{stat.st_size}'.encode(), digest_size=4).hexdigest()
+
+def thumbnail_name(name, token, width, extension):
+    source = PurePosixPath(name)
+    return str(source.parent / THUMBNAIL_DIR / f'{source.stem}.{token}.{width}.{extension}')
+
+def thumbnail_folder(name):
+    return default_storage.path(str(PurePosixPath(name).parent / THUMBNAIL_DIR))
+
+
+# -- Generation -- #
+def make_thumbnails(name):
+    """
+    Writes the thumbnails of the image `name` (a storage name) at every width
+    of THUMBNAIL_WIDTHS smaller than the image, and removes those of its
+    previous versions. Images Pillow cannot read (e.g. SVG boards) are skipped.
+    Returns the widths written.
+    """
+    discard_thumbnails(name)
+    try:
+        with Image.open(default_storage.path(name)) as image:
+            image.load()
+    except (OSError, UnidentifiedImageError):
+        return []
+
+    # -- JPEG has no transparency: transparent images are laid over white -- #
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    widths = [width for width in THUMBNAIL_WIDTHS if width < image.width]
+    if widths:
+        os.makedirs(thumbnail_folder(name), exist_ok=True)
+    token = thumbnail_token(name)
+    for width in widths:
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for extension, image_format in THUMBNAIL_FORMATS:
+            resized.save(
+                default_storage.path(thumbnail_name(name, token, width, extension)),
+                image_format, quality=THUMBNAIL_QUALITY, optimize=True
+            )
+    return widths
+
+def discard_thumbnails(name):
+    """Removes every thumbnail of the image `name`, of any version."""
+    folder, stem = thumbnail_folder(name), PurePosixPath(name).stem
+    try:
+        entries = os.listdir(folder)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.startswith(f'{stem}.') and entry[len(stem) + 1:].count('.') == 2:
+            try:
+                os.remove(os.path.join(folder, entry))
+            except OSError:
+                pass
+    try:
+        os.rmdir(folder)
+    except OSError:
+        # -- Other images still have thumbnails in the folder -- #
+        pass
+
+
+# -- Serving -- #
+def thumbnail_srcset(name, extension):
+    """`srcset` of the current thumbnails of the image `name` in `extension`, empty if there are none."""
+    try:
+        token = thumbnail_token(name)
+    except OSError:
+        return ''
+    candidates = []
+    for width in THUMBNAIL_WIDTHS:
+        thumbnail = thumbnail_name(name, token, width, extension)
+        if default_storage.exists(thumbnail):
+            candidates.append(f'{default_storage.url(thumbnail)} {width}w')
+    return ', '.join(candidates)
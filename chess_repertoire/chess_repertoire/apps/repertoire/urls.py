@@ -1,12 +1,18 @@
 from django.urls import path
 
 from . import views
+from .async_views import ajax_view
 
 app_name = 'repertoire'
 
 urlpatterns = [
     path('', views.OpeningIndex.as_view(), name='openings'),
     path('about/', views.AboutPage.as_view(), name='about'),
+    path('metrics/', views.Metrics.as_view(), name='metrics'),
+    path('positions/', ajax_view(views.PositionLookup), name='position_lookup'),
+    path('export/', views.RepertoireExport.as_view(), name='export'),
+    path('drill/next/', ajax_view(views.DrillNext), name='drill_next'),
+    path('statistics/', ajax_view(views.PracticeOverview), name='practice_overview'),
     path('new_opening/', views.NewOpening.as_view(), name='new_opening'),
     path('<slug:slug>/', views.OpeningDetail.as_view(), name='opening_detail'),
     path('<slug:slug>/modify/', views.ModifyOpening.as_view(), name='modify_opening'),
@@ -16,14 +22,19 @@ urlpatterns = [
     path('<str:opn>/<slug:slug>/review/', views.ReviewVariation.as_view(), name='review'),
     path('<str:opn>/<slug:slug>/practice/', views.PracticeVariation.as_view(), name='practice'),
     # AJAX endpoints for drag-and-drop practice mode
-    path('<str:opn>/<slug:slug>/practice/validate_move/', views.PracticeValidateMove.as_view(), name='practice_validate_move'),
-    path('<str:opn>/<slug:slug>/practice/get_position/', views.PracticeGetPosition.as_view(), name='practice_get_position'),
-    path('<str:opn>/<slug:slug>/practice/get_hints/', views.PracticeGetHints.as_view(), name='practice_get_hints'),
-    path('<str:opn>/<slug:slug>/practice/restart/', views.PracticeRestart.as_view(), name='practice_restart'),
-    path('<str:opn>/<slug:slug>/practice/get_statistics/', views.PracticeGetStatistics.as_view(), name='practice_get_statistics'),
+    path('<str:opn>/<slug:slug>/practice/validate_move/', ajax_view(views.PracticeValidateMove), name='practice_validate_move'),
+    path('<str:opn>/<slug:slug>/practice/get_position/', ajax_view(views.PracticeGetPosition), name='practice_get_position'),
+    path('<str:opn>/<slug:slug>/practice/get_hints/', ajax_view(views.PracticeGetHints), name='practice_get_hints'),
+    path('<str:opn>/<slug:slug>/practice/get_subtree/', ajax_view(views.PracticeGetSubtree), name='practice_get_subtree'),
+    path('<str:opn>/<slug:slug>/practice/sync/', ajax_view(views.PracticeSync), name='practice_sync'),
+    path('<str:opn>/<slug:slug>/practice/restart/', ajax_view(views.PracticeRestart), name='practice_restart'),
+    path('<str:opn>/<slug:slug>/practice/get_statistics/', ajax_view(views.PracticeGetStatistics), name='practice_get_statistics'),
+    path('<str:opn>/<slug:slug>/practice/history/', ajax_view(views.PracticeHistory), name='practice_history'),
     # AJAX endpoints for review mode
-    path('<str:opn>/<slug:slug>/review/execute_move/', views.ReviewExecuteMove.as_view(), name='review_execute_move'),
-    path('<str:opn>/<slug:slug>/review/undo_move/', views.ReviewUndoMove.as_view(), name='review_undo_move'),
-    path('<str:opn>/<slug:slug>/review/restart/', views.ReviewRestart.as_view(), name='review_restart'),
-    path('<str:opn>/<slug:slug>/review/get_position/', views.ReviewGetPosition.as_view(), name='review_get_position'),
+    path('<str:opn>/<slug:slug>/review/execute_move/', ajax_view(views.ReviewExecuteMove), name='review_execute_move'),
+    path('<str:opn>/<slug:slug>/review/undo_move/', ajax_view(views.ReviewUndoMove), name='review_undo_move'),
+    path('<str:opn>/<slug:slug>/review/restart/', ajax_view(views.ReviewRestart), name='review_restart'),
+    path('<str:opn>/<slug:slug>/review/get_position/', ajax_view(views.ReviewGetPosition), name='review_get_position'),
+    path('<str:opn>/<slug:slug>/review/get_subtree/', ajax_view(views.ReviewGetSubtree), name='review_get_subtree'),
+    path('<str:opn>/<slug:slug>/review/sync/', ajax_view(views.ReviewSync), name='review_sync'),
 ]
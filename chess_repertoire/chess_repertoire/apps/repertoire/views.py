@@ -1,40 +1,165 @@
 from django.views.generic import (CreateView, DetailView, ListView, UpdateView, TemplateView)
 from django.views import View
-from django.core.paginator import Paginator
-from django.shortcuts import render
+from django.db.models import Count
+from django.shortcuts import get_object_or_404, render
 from django.utils.safestring import mark_safe
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.static import serve
+from django.urls import reverse
+from django.utils import timezone
+import hmac
 import json
 
 from chess_repertoire.apps.game import (
-    ChessReviewer, ChessPractice, get_current_turn, read_pgn_file, update_pgn_file
+    ChessReviewer, read_pgn_file, update_pgn_file
 )
+from chess_repertoire.apps.game.game_controller import BOARD_RENDER_CACHE, GAME_TREE_CACHE
+from chess_repertoire.apps.game.metrics import METRICS
 from chess_repertoire.apps.game.statistics import PracticeStatistics
-from .constants import MAX_OPENING_PER_PAGE, MAX_VARIATION_PER_PAGE
-from .models import Opening, Variation
+from .constants import (
+    MAX_OPENING_PER_PAGE, MAX_VARIATION_PER_PAGE, PRACTICE_WEAKEST_NODES,
+    SUBTREE_DEFAULT_PLIES, SUBTREE_MAX_PLIES, SYNC_MAX_ATTEMPTS, THUMBNAIL_CACHE_MAX_AGE
+)
+from .backup import iter_backup
+from .models import (
+    PRACTICE_HISTORY, DrillLine, Opening, Position, PracticeAttempt, PracticeMove, Variation
+)
 from .forms import OpeningForm, VariationForm
 from .filters import OpeningFilter, VariationFilter
-from .mixins import PracticeAjaxMixin
+from .mixins import CachedListingMixin, ConditionalPositionMixin, PracticeAjaxMixin, PracticeContextMixin
+
+# -- Helper functions -- #
+def get_subtree_plies(request):
+    """Plies requested for a subtree, bounded by SUBTREE_MAX_PLIES."""
+    return max(0, min(int(request.GET.get('plies', SUBTREE_DEFAULT_PLIES)), SUBTREE_MAX_PLIES))
+
+def flush_practice_history():
+    """Writes the buffered practice history so the statistics include the latest moves."""
+    try:
+        PRACTICE_HISTORY.flush()
+    except Exception:
+        # -- The history is still served, without the records that could not be written -- #
+        pass
+
 
 # -- General Views -- #
 class AboutPage(TemplateView):
     template_name = 'repertoire/about.html'
 
 
+class Metrics(View):
+    """Prometheus metrics of the game layer, only served to staff users and to holders of METRICS_TOKEN"""
+
+    def get(self, request, *args, **kwargs):
+        if not settings.METRICS_ENABLED or not self.is_authorized(request):
+            raise Http404
+        content = METRICS.export(caches={
+            'game_tree': GAME_TREE_CACHE.stats,
+            'board_render': BOARD_RENDER_CACHE.stats
+        })
+        return HttpResponse(content, content_type='text/plain; version=0.0.4')
+
+    @staticmethod
+    def is_authorized(request):
+        if request.user.is_staff:
+            return True
+        token = settings.METRICS_TOKEN
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        return bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+
+
+class PositionLookup(View):
+    """AJAX endpoint returning every occurrence of a position (FEN) in the repertoire"""
+
+    def get(self, request, *args, **kwargs):
+        fen = request.GET.get('fen', '')
+        try:
+            occurrences = Position.lookup(fen)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        return JsonResponse({
+            'fen': fen,
+            'occurrences': [
+                {
+                    'opening': position.variation.opening.name,
+                    'variation': position.variation.name,
+                    'variation_slug': position.variation.slug,
+                    'node': position.node,
+                    'path': position.path,
+                    'turn': position.get_turn_display(),
+                    'review_url': reverse('repertoire:review', kwargs={
+                        'opn': position.variation.opening.name,
+                        'slug': position.variation.slug
+                    })
+                }
+                for position in occurrences
+            ]
+        })
+
+
+class DrillNext(View):
+    """AJAX endpoint returning the most overdue line of the whole repertoire, with the URL to practice it"""
+
+    def get(self, request, *args, **kwargs):
+        line = DrillLine.next_due()
+        if line is None:
+            return JsonResponse({'error': 'No lines to practice'}, status=404)
+
+        variation = line.variation
+        return JsonResponse({
+            'opening': variation.opening.name,
+            'variation': variation.name,
+            'variation_slug': variation.slug,
+            'line': line.path,
+            'due': line.due.isoformat(),
+            'overdue': line.due <= timezone.now(),
+            'repetitions': line.repetitions,
+            'practice_url': reverse('repertoire:practice', kwargs={
+                'opn': variation.opening.name,
+                'slug': variation.slug
+            }) + f'?line={line.pk}'
+        })
+
+
+class ThumbnailFile(View):
+    """Serves a thumbnail from MEDIA_ROOT, cacheable for good as its URL changes with its source"""
+
+    def get(self, request, path, *args, **kwargs):
+        response = serve(request, path, document_root=settings.MEDIA_ROOT)
+        response['Cache-Control'] = f'public, max-age={THUMBNAIL_CACHE_MAX_AGE}, immutable'
+        return response
+
+
+class RepertoireExport(View):
+    """Streams a zip backup of the whole repertoire, with a merged PGN when `merged_pgn=1`"""
+
+    def get(self, request, *args, **kwargs):
+        response = StreamingHttpResponse(
+            iter_backup(merged_pgn=request.GET.get('merged_pgn') == '1'), content_type='application/zip'
+        )
+        filename = f'repertoire-{timezone.localdate():%Y%m%d}.zip'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 # -- Opening Views -- #
-class OpeningIndex(ListView):
+class OpeningIndex(CachedListingMixin, ListView):
     model = Opening
     paginate_by = MAX_OPENING_PER_PAGE
     template_name = 'repertoire/openings.html'
+    context_object_name = 'openings'
+
+    def get_queryset(self):
+        # -- Filtered once, the page is then paginated by ListView -- #
+        self.filter = OpeningFilter(self.request.GET, queryset=Opening.objects.all())
+        return self.filter.qs
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['filter'] = OpeningFilter(self.request.GET, queryset=self.get_queryset())
-        # -- Pagination with Filtering -- #
-        paginator = Paginator(context['filter'].qs, OpeningIndex.paginate_by)
-        page_number = self.request.GET.get('page')
-        openings = paginator.get_page(page_number)
-        context['openings'] = openings
+        context['filter'] = self.filter
+        context['openings'] = context['page_obj']
         return context
 
 
@@ -57,40 +182,44 @@ class ModifyOpening(UpdateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['opening'] = Opening.objects.get(slug=self.kwargs['slug'])
+        context['opening'] = self.object
         return context
 
 
 # -- Variation Views -- #
-class OpeningVariations(ListView):
-    model = Opening
+class OpeningVariations(CachedListingMixin, ListView):
+    model = Variation
     template_name = 'repertoire/opening_variations.html'
     paginate_by = MAX_VARIATION_PER_PAGE
     context_object_name = 'variations'
 
     def dispatch(self, request, *args, **kwargs):
-        # -- Reset current moves -- #
-        self.request.session.flush()
-        if not self.request.session.get('moves', None):
-            self.request.session['moves'] = []
-        if not self.request.session.get('turn', None):
-            self.request.session['turn'] = get_current_turn(self.request.session['moves'])
-        return super().dispatch(self.request, *args, **kwargs)
-
-    def get_queryset(self, **kwargs):
-        opening = Opening.objects.get(slug=self.kwargs['slug'])
-        variations = opening.variation_set.all()
-        return variations
-    
+        # -- Reset current position, practice statistics and drilled line -- #
+        for key in ('node', PracticeStatistics.SESSION_KEY, 'drill'):
+            request.session.pop(key, None)
+        self.opening = get_object_or_404(
+            Opening.objects.annotate(variation_count=Count('variation')), slug=self.kwargs['slug']
+        )
+        return super().dispatch(request, *args, **kwargs)
+
+    def get_queryset(self):
+        # -- Filtered once, the page is then paginated by ListView -- #
+        variations = self.opening.variation_set.select_related('opening').defer('final_positions')
+        self.filter = VariationFilter(self.request.GET, queryset=variations)
+        return self.filter.qs
+
+    def get_paginator(self, queryset, *args, **kwargs):
+        paginator = super().get_paginator(queryset, *args, **kwargs)
+        # -- Unfiltered listings already know their size from the opening fetch -- #
+        if not any(self.filter.data.get(name) for name in self.filter.filters):
+            paginator.count = self.opening.variation_count
+        return paginator
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['opening'] = Opening.objects.get(slug=self.kwargs['slug'])
-        context['filter'] = VariationFilter(self.request.GET, queryset=self.get_queryset())
-        # -- Pagination with Filtering -- #
-        paginator = Paginator(context['filter'].qs, OpeningVariations.paginate_by)
-        page_number = self.request.GET.get('page')
-        variations = paginator.get_page(page_number)
-        context['variations'] = variations
+        context['opening'] = self.opening
+        context['filter'] = self.filter
+        context['variations'] = context['page_obj']
         return context
 
 
@@ -99,13 +228,17 @@ class NewVariation(CreateView):
     form_class = VariationForm
     template_name = 'repertoire/variation_new_form.html'
 
+    def dispatch(self, request, *args, **kwargs):
+        self.opening = get_object_or_404(Opening, slug=self.kwargs['slug'])
+        return super().dispatch(request, *args, **kwargs)
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['opening'] = Opening.objects.get(slug=self.kwargs['slug'])
+        context['opening'] = self.opening
         return context
 
     def form_valid(self, form):
-        form.instance.opening = Opening.objects.get(slug=self.kwargs['slug'])
+        form.instance.opening = self.opening
         return super().form_valid(form)
 
 
@@ -114,21 +247,29 @@ class ModifyVariation(UpdateView):
     form_class = VariationForm
     template_name = 'repertoire/variation_modify_form.html'
 
+    def get_queryset(self):
+        return Variation.objects.select_related('opening')
+
+    def get_object(self, queryset=None):
+        variation = super().get_object(queryset)
+        # -- PGN file stored before the form binds an uploaded one -- #
+        self.pgn_url = variation.pgn_file.url
+        return variation
+
     def form_valid(self, form):
-        variation = Variation.objects.get(slug=self.kwargs['slug'])
-        head, moves = read_pgn_file(variation.pgn_file.url)
+        head, moves = read_pgn_file(self.pgn_url)
         pgn_content = self.request.POST.get('pgn_content', None).replace('\r', '')
         if pgn_content:
             if moves != pgn_content:
                 full_pgn_content = head + '\n\n' + pgn_content
-                update_pgn_file(variation.pgn_file.url, full_pgn_content)
+                update_pgn_file(self.pgn_url, full_pgn_content)
         return super().form_valid(form)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['opening'] = Opening.objects.get(name=self.kwargs['opn'])
-        context['variation'] = Variation.objects.get(slug=self.kwargs['slug'])
-        _, context['pgn_content'] = read_pgn_file(context['variation'].pgn_file.url)
+        context['opening'] = self.object.opening
+        context['variation'] = self.object
+        _, context['pgn_content'] = read_pgn_file(self.pgn_url)
         return context
 
 
@@ -149,7 +290,7 @@ class ReviewVariation(View):
         return render(self.request, self.template_name, context)
 
 
-class PracticeVariation(View):
+class PracticeVariation(PracticeContextMixin, View):
     template_name = 'repertoire/practice.html'
 
     def get_context_data(self, correct='other'):
@@ -161,7 +302,7 @@ class PracticeVariation(View):
             'correct': correct,
             'nag': self.practice.nag,
             'is_checkmate': self.practice.is_checkmate,
-            'start_flag': len(self.request.session['moves']) == 0,
+            'start_flag': self.practice.ply == 0,
         }
     
     def dispatch(self, request, *args, **kwargs):
@@ -169,22 +310,25 @@ class PracticeVariation(View):
         self.variation = Variation.objects.get(slug=self.kwargs['slug'])
 
         # -- Initialize Practice -- #
-        self.practice = ChessPractice(
-            self.variation.pgn_file.path,
-            self.variation.opening.color,
-        )
-        self.request.session['moves'] = self.practice.run_visited_moves(
-            self.request.session['moves']
-        )
+        self.practice = self.initialize_practice(self.opening, self.variation)
 
-        # Initialize statistics if needed
+        # -- A new practice (or the practice of a given line) drills the most overdue line -- #
+        line_id = self.request.GET.get('line', '')
         stats = PracticeStatistics.get_stats(self.request.session)
-        if not stats or stats.get('variation_slug') != self.kwargs['slug']:
+        if line_id.isdigit() or not stats or stats.get('variation_slug') != self.kwargs['slug']:
+            self.start_drill_line(self.practice, self.variation, int(line_id) if line_id.isdigit() else None)
+            if line_id.isdigit():
+                self.request.session.pop('node', None)
+            self.end_attempt()
             PracticeStatistics.initialize_stats(
                 self.request.session,
                 self.opening.name,
-                self.variation.slug
+                self.variation.slug,
+                self.variation.pk
             )
+        self.request.session['node'] = self.practice.resume(
+            self.request.session.get('node')
+        )
 
         return super().dispatch(request, *args, **kwargs)
 
@@ -200,10 +344,13 @@ class PracticeVariation(View):
             if self.practice.check_if_correct(move):
                 correct = 'correct'
                 try:
-                    opp_move = self.practice.player_move(move)
-                    self.request.session['moves'] += [move, opp_move]
+                    self.practice.player_move(move)
                 except Exception:
-                    self.request.session['moves'] += [move]
+                    # -- No opponent move left: the line is finished -- #
+                    pass
+                self.request.session['node'] = self.practice.cursor
+                if not self.practice.possible_moves:
+                    self.complete_drill_line(self.practice, self.variation)
             else:
                 correct = 'incorrect'
         # -- Show Hints of the Possible Moves -- #
@@ -212,7 +359,8 @@ class PracticeVariation(View):
             correct = 'hint'
         # -- Practice Again the Game -- #
         else:
-            self.request.session['moves'] = self.practice.restart()
+            self.start_drill_line(self.practice, self.variation)
+            self.request.session['node'] = self.practice.restart()
             correct = 'other'
         context = self.get_context_data(correct=correct)
         return render(self.request, self.template_name, context)
@@ -234,67 +382,78 @@ class PracticeValidateMove(PracticeAjaxMixin, View):
         # Validate the move
         if practice.check_if_correct(move):
             # Record correct move
-            PracticeStatistics.record_move(request.session, move, correct=True)
+            self.record_move(practice, context['variation'], move, correct=True)
+            METRICS.increment('practice_correct_move')
 
             try:
                 # Execute player move and get opponent's response
                 opp_move = practice.player_move(move)
-                request.session['moves'] += [move, opp_move]
+                request.session['node'] = practice.cursor
+                if not practice.possible_moves:
+                    # The opponent move ended the line
+                    self.complete_drill_line(practice, context['variation'])
 
                 return JsonResponse({
                     'correct': True,
                     'opponent_move': opp_move,
-                    'fen': practice.state.board().fen(),
+                    'fen': practice.fen,
                     'is_checkmate': practice.is_checkmate,
                     'nag': practice.nag
                 })
             except Exception:
                 # No opponent move available (practice finished)
-                PracticeStatistics.mark_completed(request.session)
-                request.session['moves'] += [move]
+                self.complete_drill_line(practice, context['variation'])
+                request.session['node'] = practice.cursor
                 return JsonResponse({
                     'correct': True,
                     'opponent_move': None,
-                    'fen': practice.state.board().fen(),
+                    'fen': practice.fen,
                     'is_checkmate': practice.is_checkmate,
                     'nag': practice.nag
                 })
         else:
             # Record incorrect move
-            PracticeStatistics.record_move(request.session, move, correct=False)
+            self.record_move(practice, context['variation'], move, correct=False)
+            METRICS.increment('practice_incorrect_move')
 
             # Move is incorrect
             return JsonResponse({
                 'correct': False,
                 'opponent_move': None,
-                'fen': practice.state.board().fen(),
+                'fen': practice.fen,
                 'is_checkmate': practice.is_checkmate,
                 'nag': practice.nag
             })
 
 
-class PracticeGetPosition(PracticeAjaxMixin, View):
+class PracticeGetPosition(ConditionalPositionMixin, PracticeAjaxMixin, View):
     """AJAX endpoint to get current board position"""
 
     def get(self, request, *args, **kwargs):
+        # Answer a repeated request before anything is queried or loaded
+        etag = self.position_etag(PracticeStatistics.get_attempt(request.session))
+        not_modified = self.not_modified(etag)
+        if not_modified:
+            return not_modified
+
         # Get practice context (opening, variation, practice instance)
         context = self.get_practice_context()
         practice = context['practice']
         opening = context['opening']
 
         # Determine if it's player's turn
-        is_player_turn = self.get_player_turn_status(opening)
+        is_player_turn = self.get_player_turn_status(opening, practice)
 
         # Check if practice is finished
         finished = not bool(practice.possible_moves)
 
-        return JsonResponse({
-            'fen': practice.state.board().fen(),
+        return self.conditional(JsonResponse({
+            'fen': practice.fen,
             'is_player_turn': is_player_turn,
             'finished': finished,
             'is_checkmate': practice.is_checkmate,
             'nag': practice.nag
-        })
+        }), etag)
 
 
 class PracticeGetHints(PracticeAjaxMixin, View):
@@ -306,17 +465,11 @@ class PracticeGetHints(PracticeAjaxMixin, View):
         practice = context['practice']
 
         # Get legal moves with UCI format (from/to squares)
-        legal_moves = []
-        for i in range(len(practice.state.variations)):
-            variation_move = practice.state.variations[i].move
-            legal_moves.append({
-                'from': variation_move.from_square,
-                'to': variation_move.to_square,
-                'san': practice.state.board().san(variation_move)
-            })
+        legal_moves = practice.legal_moves
 
         # Record hint usage
         PracticeStatistics.record_hint(request.session)
+        METRICS.increment('practice_hint')
 
         return JsonResponse({
             'legal_moves': legal_moves,
@@ -324,6 +477,100 @@ class PracticeGetHints(PracticeAjaxMixin, View):
         })
 
 
+class PracticeGetSubtree(PracticeAjaxMixin, View):
+    """AJAX endpoint to get the next plies from the current node, to practice them locally"""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            plies = get_subtree_plies(request)
+        except ValueError as e:
+            return self.json_error_response(e, status=400)
+
+        # Get practice context (opening, variation, practice instance)
+        context = self.get_practice_context()
+        practice = context['practice']
+
+        return JsonResponse(practice.subtree(plies))
+
+
+class PracticeSync(PracticeAjaxMixin, View):
+    """AJAX endpoint to record a batch of moves practiced locally and store the reached node"""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return self.json_error_response('The body must be JSON', status=400)
+        error = self.payload_error(data)
+        if error:
+            return self.json_error_response(error, status=400)
+
+        # Get practice context (opening, variation, practice instance)
+        context = self.get_practice_context()
+        practice = context['practice']
+        opening = context['opening']
+
+        # Every attempt needs the node (from get_subtree) where it was played
+        # -- Nodes of the attempts are only trusted if the cursor is from the same tree -- #
+        cursor = data.get('cursor') or [None]
+        nodes = len(practice.tree) if cursor[0] == practice.tree.version else 0
+        attempts = data.get('attempts', [])[:SYNC_MAX_ATTEMPTS]
+        for attempt in attempts:
+            if not 0 <= attempt['node'] < nodes:
+                return self.json_error_response(
+                    'Attempts need the node where they were played, in the tree of the cursor', status=400
+                )
+
+        # Record the attempts, hints and completion in order
+        for attempt in attempts:
+            correct = attempt['correct']
+            self.record_move(practice, context['variation'], attempt['move'], correct, attempt['node'])
+            METRICS.increment('practice_correct_move' if correct else 'practice_incorrect_move')
+        for _ in range(min(data.get('hints', 0), SYNC_MAX_ATTEMPTS)):
+            PracticeStatistics.record_hint(request.session)
+            METRICS.increment('practice_hint')
+
+        # Continue from the node reached locally
+        if data.get('cursor'):
+            request.session['node'] = practice.resume(data['cursor'])
+        if data.get('completed'):
+            self.complete_drill_line(practice, context['variation'])
+
+        stats = PracticeStatistics.get_stats(request.session) or {}
+        return JsonResponse({
+            'fen': practice.fen,
+            'is_player_turn': self.get_player_turn_status(opening, practice),
+            'correct_moves': stats.get('correct_moves', 0),
+            'incorrect_moves': stats.get('incorrect_moves', 0),
+            'hints_used': stats.get('hints_used', 0),
+            'completed': stats.get('completed', False)
+        })
+
+    @staticmethod
+    def payload_error(data):
+        """Describes what is wrong with the shape of a sync payload, None if nothing is."""
+        def is_int(value):
+            return isinstance(value, int) and not isinstance(value, bool)
+
+        if not isinstance(data, dict):
+            return 'The payload must be an object'
+        cursor = data.get('cursor')
+        if cursor is not None and not (isinstance(cursor, list) and len(cursor) == 2 and is_int(cursor[1])):
+            return 'The cursor must be a [tree version, node] pair'
+        attempts = data.get('attempts', [])
+        if not isinstance(attempts, list):
+            return 'The attempts must be a list'
+        for attempt in attempts:
+            if not (
+                isinstance(attempt, dict) and isinstance(attempt.get('move'), str)
+                and isinstance(attempt.get('correct'), bool) and is_int(attempt.get('node'))
+            ):
+                return 'Every attempt needs its move, whether it was correct and the node where it was played'
+        if not is_int(data.get('hints', 0)) or data.get('hints', 0) < 0:
+            return 'The hints must be a count'
+        return None
+
+
 class PracticeRestart(PracticeAjaxMixin, View):
     """AJAX endpoint to restart practice"""
 
@@ -334,21 +581,24 @@ class PracticeRestart(PracticeAjaxMixin, View):
         opening = context['opening']
         variation = context['variation']
 
-        # Restart and get initial moves
-        request.session['moves'] = practice.restart()
+        # Restart on the most overdue line and get initial moves
+        self.start_drill_line(practice, variation)
+        request.session['node'] = practice.restart()
 
         # Reset statistics for fresh practice session
+        self.end_attempt()
         PracticeStatistics.initialize_stats(
             request.session,
             opening.name,
-            variation.slug
+            variation.slug,
+            variation.pk
         )
 
         # Determine if it's player's turn
-        is_player_turn = self.get_player_turn_status(opening)
+        is_player_turn = self.get_player_turn_status(opening, practice)
 
         return JsonResponse({
-            'fen': practice.state.board().fen(),
+            'fen': practice.fen,
             'is_player_turn': is_player_turn,
             'nag': practice.nag
         })
@@ -382,6 +632,45 @@ class PracticeGetStatistics(View):
             return JsonResponse({'error': str(e)}, status=500)
 
 
+class PracticeHistory(View):
+    """AJAX endpoint to get the accuracy of every practice of the variation and of its weakest nodes"""
+
+    def get(self, request, *args, **kwargs):
+        variation = get_object_or_404(Variation, slug=kwargs['slug'])
+        flush_practice_history()
+
+        summary = PracticeAttempt.accuracy_by_variation(variation.pk).first() or {}
+        return JsonResponse({
+            'attempts': summary.get('attempts', 0),
+            'completed': summary.get('completed', 0),
+            'correct_moves': summary.get('correct', 0),
+            'incorrect_moves': summary.get('incorrect', 0),
+            'hints_used': summary.get('hints', 0),
+            'accuracy': summary.get('accuracy'),
+            'last_practiced': summary['last_practiced'].isoformat() if summary else None,
+            'weakest_nodes': list(PracticeMove.accuracy_by_node(variation.pk)[:PRACTICE_WEAKEST_NODES])
+        })
+
+
+class PracticeOverview(View):
+    """AJAX endpoint to get the accuracy of every practiced variation, weakest first"""
+
+    def get(self, request, *args, **kwargs):
+        flush_practice_history()
+        return JsonResponse({'variations': [
+            {
+                'opening': row['variation__opening__name'],
+                'variation': row['variation__name'],
+                'variation_slug': row['variation__slug'],
+                'attempts': row['attempts'],
+                'completed': row['completed'],
+                'accuracy': row['accuracy'],
+                'last_practiced': row['last_practiced'].isoformat()
+            }
+            for row in PracticeAttempt.accuracy_by_variation()
+        ]})
+
+
 # -- AJAX Views for Review Mode -- #
 class ReviewExecuteMove(View):
     """AJAX endpoint to execute a move in review mode"""
@@ -393,23 +682,17 @@ class ReviewExecuteMove(View):
         opening = Opening.objects.get(name=kwargs['opn'])
         variation = Variation.objects.get(slug=kwargs['slug'])
 
-        # Initialize moves list if not present
-        if 'moves' not in request.session or request.session['moves'] is None:
-            request.session['moves'] = []
-
         reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
-        # Note: run_visited_moves returns None, it just updates the reviewer state
-        reviewer.run_visited_moves(request.session['moves'])
+        reviewer.resume(request.session.get('node'))
 
         # Validate and execute move
         if move in reviewer.possible_moves:
             reviewer.next_move(move)
-            request.session['moves'].append(move)
 
-        request.session.modified = True
+        request.session['node'] = reviewer.cursor
 
         return JsonResponse({
-            'fen': reviewer.state.board().fen(),
+            'fen': reviewer.fen,
             'possible_moves': reviewer.possible_moves,
             'nag': reviewer.nag,
             'is_checkmate': reviewer.is_checkmate,
@@ -424,26 +707,20 @@ class ReviewUndoMove(View):
         opening = Opening.objects.get(name=kwargs['opn'])
         variation = Variation.objects.get(slug=kwargs['slug'])
 
-        # Initialize moves list if not present
-        if 'moves' not in request.session or request.session['moves'] is None:
-            request.session['moves'] = []
-
-        # Pop last move if exists
-        if request.session['moves']:
-            request.session['moves'].pop()
-
         reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
-        # Note: run_visited_moves returns None, it just updates the reviewer state
-        reviewer.run_visited_moves(request.session['moves'])
+        reviewer.resume(request.session.get('node'))
 
-        request.session.modified = True
+        # Step back to the parent node if not at the start
+        reviewer.undo_move()
+
+        request.session['node'] = reviewer.cursor
 
         return JsonResponse({
-            'fen': reviewer.state.board().fen(),
+            'fen': reviewer.fen,
             'possible_moves': reviewer.possible_moves,
             'nag': reviewer.nag,
             'is_checkmate': reviewer.is_checkmate,
-            'moves_count': len(request.session['moves'])
+            'moves_count': reviewer.ply
         })
 
 
@@ -455,14 +732,10 @@ class ReviewRestart(View):
         variation = Variation.objects.get(slug=kwargs['slug'])
 
         reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
-        restarted_moves = reviewer.restart()
-
-        # Ensure we have a valid list
-        request.session['moves'] = restarted_moves if restarted_moves is not None else []
-        request.session.modified = True
+        request.session['node'] = reviewer.restart()
 
         return JsonResponse({
-            'fen': reviewer.state.board().fen(),
+            'fen': reviewer.fen,
             'possible_moves': reviewer.possible_moves,
             'nag': reviewer.nag,
             'is_checkmate': reviewer.is_checkmate,
@@ -470,28 +743,66 @@ class ReviewRestart(View):
         })
 
 
-class ReviewGetPosition(View):
-    """AJAX endpoint to get current board state"""
+class ReviewGetSubtree(View):
+    """AJAX endpoint to get the next plies from the current node, to review them locally"""
 
     def get(self, request, *args, **kwargs):
+        try:
+            plies = get_subtree_plies(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
         opening = Opening.objects.get(name=kwargs['opn'])
         variation = Variation.objects.get(slug=kwargs['slug'])
 
-        # Initialize moves list if not present
-        if 'moves' not in request.session or request.session['moves'] is None:
-            request.session['moves'] = []
-
         reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
-        # Note: run_visited_moves returns None, it just updates the reviewer state
-        reviewer.run_visited_moves(request.session['moves'])
+        request.session['node'] = reviewer.resume(request.session.get('node'))
+
+        return JsonResponse(reviewer.subtree(plies))
+
 
-        request.session.modified = True
+class ReviewSync(View):
+    """AJAX endpoint to store the node reached while reviewing locally"""
+
+    def post(self, request, *args, **kwargs):
+        data = json.loads(request.body)
+
+        opening = Opening.objects.get(name=kwargs['opn'])
+        variation = Variation.objects.get(slug=kwargs['slug'])
+
+        reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
+        request.session['node'] = reviewer.resume(data.get('cursor'))
 
         return JsonResponse({
-            'fen': reviewer.state.board().fen(),
+            'fen': reviewer.fen,
+            'possible_moves': reviewer.possible_moves,
+            'nag': reviewer.nag,
+            'is_checkmate': reviewer.is_checkmate,
+            'moves_count': reviewer.ply
+        })
+
+
+class ReviewGetPosition(ConditionalPositionMixin, View):
+    """AJAX endpoint to get current board state"""
+
+    def get(self, request, *args, **kwargs):
+        # Answer a repeated request before anything is queried or loaded
+        etag = self.position_etag()
+        not_modified = self.not_modified(etag)
+        if not_modified:
+            return not_modified
+
+        opening = Opening.objects.get(name=kwargs['opn'])
+        variation = Variation.objects.get(slug=kwargs['slug'])
+
+        reviewer = ChessReviewer(variation.pgn_file.path, opening.color)
+        request.session['node'] = reviewer.resume(request.session.get('node'))
+
+        return self.conditional(JsonResponse({
+            'fen': reviewer.fen,
             'possible_moves': reviewer.possible_moves,
             'nag': reviewer.nag,
             'is_checkmate': reviewer.is_checkmate,
-            'start_flag': len(request.session['moves']) == 0,
+            'start_flag': reviewer.ply == 0,
             'orientation': 'white' if opening.color == 0 else 'black'
-        })
\ No newline at end of file
+        }), etag)
\ No newline at end of file
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chess_repertoire.settings')
+# AJAX views run as async views on their own thread pool (see ASYNC_VIEWS)
+os.environ.setdefault('CHESS_REPERTOIRE_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -10,11 +10,19 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent
 
+# The PGN streaming module (pgn_analyzer.pgn_stream) is shared with the analyzer,
+# at the root of the repository
+REPOSITORY_DIR = BASE_DIR.parent.parent
+if str(REPOSITORY_DIR) not in sys.path:
+    sys.path.append(str(REPOSITORY_DIR))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
 
@@ -44,8 +52,9 @@ INSTALLED_APPS += [
 ]
 
 MIDDLEWARE = [
+    'chess_repertoire.apps.repertoire.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'chess_repertoire.apps.repertoire.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -135,4 +144,28 @@ STATIC_ROOT = BASE_DIR / 'staticfiles/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Custom
-SESSION_SAVE_EVERY_REQUEST = True
+# Sessions live in a signed cookie, so practice moves do not write to the database.
+# 'django.contrib.sessions.backends.cache' is the alternative with a shared cache.
+SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+SESSION_SAVE_EVERY_REQUEST = False
+
+# Metrics exposed on /metrics to staff users, or to scrapers sending the token
+# as a Bearer Authorization header. Server-Timing headers are optional.
+METRICS_ENABLED = os.environ.get('CHESS_REPERTOIRE_METRICS', '') == '1'
+METRICS_TOKEN = os.environ.get('CHESS_REPERTOIRE_METRICS_TOKEN', '')
+METRICS_SERVER_TIMING = False
+
+# AJAX views are served as async views on a bounded thread pool, asgi.py turns them on
+ASYNC_VIEWS = os.environ.get('CHESS_REPERTOIRE_ASYNC_VIEWS', '') == '1'
+
+# Rendered listing pages are cached here, a shared cache (e.g. Memcached or
+# Redis) is needed for invalidations to reach every process of a deployment.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'chess-repertoire',
+    }
+}
+
+# Test runner keeping the buffered practice history away from the real database
+TEST_RUNNER = 'chess_repertoire.apps.repertoire.testing.TestRunner'
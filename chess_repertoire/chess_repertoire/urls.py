@@ -19,8 +19,16 @@ from django.conf.urls.static import static
 from django.urls import path, include, re_path
 from django.views.static import serve
 
+from chess_repertoire.apps.repertoire.constants import THUMBNAIL_DIR
+from chess_repertoire.apps.repertoire.views import ThumbnailFile
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    # Thumbnails are served with long-lived cache headers, before any other media file
+    re_path(
+        rf'^{settings.MEDIA_URL.strip("/")}/(?P<path>(?:.*/)?{THUMBNAIL_DIR}/[^/]+)$',
+        ThumbnailFile.as_view(), name='thumbnail'
+    ),
     path('', include('chess_repertoire.apps.repertoire.urls'))
 ]
 
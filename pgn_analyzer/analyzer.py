@@ -1,32 +1,209 @@
+import asyncio
+import hashlib
 import logging
+import os
+import time
 import chess.engine as eng
-import chess.pgn as pgn
 
 from tqdm import tqdm
+from eval_cache import EvalCache
+from pgn_stream import GameIndex, iter_games
+
+# -- Headers written to analysed PGNs -- #
+DEPTH_HEADER = 'AnalysisDepth'
+SOURCE_HEADER = 'AnalysisSource'
+
+# -- Files are hashed in chunks so their size does not matter -- #
+HASH_CHUNK_SIZE = 1 << 20
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def is_score(comment):
+    try:
+        float(comment)
+    except ValueError:
+        return False
+    return True
 
 class PGNAnalyzer():
-    def __init__(self, engine_cfg):
+    def __init__(self, engine_cfg, progress=True):
+        self.setup(engine_cfg, progress)
         logging.info('Building Engine...')
         self.engine = eng.SimpleEngine.popen_uci(engine_cfg.path)
         logging.info('Done')
+
+    def setup(self, engine_cfg, progress):
+        """Stores the settings and opens the evaluation cache, for every kind of analyzer."""
         self.cfg = engine_cfg
+        self.progress = progress
+        self.cache = EvalCache(engine_cfg.cache) if engine_cfg.get('cache') else None
     
+    def run_analysis(self, pgn_path, output_path, checkpoint_every=0, resume=False):
+        for game in self.stream_games(pgn_path, output_path, checkpoint_every, resume):
+            # -- Every game starts from an empty hash so results do not depend on the order -- #
+            self.clear_hash()
+            self.analyze(game.next())
+
+    def stream_games(self, pgn_path, output_path, checkpoint_every=0, resume=False):
+        """
+        Yields the games of `pgn_path` to analyse and writes each one once done.
+
+        A single game is held in memory at a time. Finished games are appended
+        to `<output_path>.partial`, the game in progress is rewritten after them
+        on every checkpoint, and the partial file replaces `output_path` when
+        the last game is done. With `resume`, the scores of a previous partial
+        file of the same source are copied into the games before they are
+        yielded, so those positions are not searched again. Its games are
+        reached through a GameIndex, and only parsed when their headers match.
+        """
+        source_hash = file_hash(pgn_path)
+        partial_path = f'{output_path}.partial'
+        previous_path = f'{partial_path}.resume'
+        if resume and os.path.exists(partial_path):
+            logging.info(f'Resuming {pgn_path.name} from its checkpoint')
+            os.replace(partial_path, previous_path)
+        previous_games = GameIndex(previous_path) if resume and os.path.exists(previous_path) else None
+
+        self.checkpoint_every = checkpoint_every
+        self.last_checkpoint = time.monotonic()
+        self.finished_offset = 0
+        with open(partial_path, 'w') as self.output:
+            for index, game in enumerate(iter_games(pgn_path)):
+                previous = self.previous_game(previous_games, index, source_hash)
+                self.prepare(game, previous, source_hash)
+                if game.next() is not None:
+                    self.pbar = tqdm(total=100, desc=f'{pgn_path.stem} #{index + 1}', disable=not self.progress)
+                    yield game
+                    self.pbar.close()
+                self.write_game(game, finished=True)
+        os.replace(partial_path, output_path)
+        self.finish(previous_path)
+
+    def previous_game(self, previous_games, index, source_hash):
+        """Game `index` of the previous partial file, if analysed from the same source at a sufficient depth."""
+        if previous_games is None or index >= len(previous_games):
+            return None
+        headers = previous_games.read_headers(index)
+        if headers.get(SOURCE_HEADER) != source_hash or int(headers.get(DEPTH_HEADER, 0)) < self.cfg.depth:
+            return None
+        return previous_games.read_game(index)
+
+    def prepare(self, game, previous, source_hash):
+        """
+        Sets the analysis headers of `game` and restores its previous scores.
+
+        Nodes with a numeric comment are skipped when the game's depth header
+        is at least the requested depth; otherwise those comments are dropped
+        so that a game never mixes depths. Scores of `previous` (checked by
+        `previous_game`) are copied into the game.
+        """
+        self.analyzed_depth = int(game.headers.get(DEPTH_HEADER, 0))
+        if self.analyzed_depth < self.cfg.depth:
+            for node in PGNAnalyzer.iter_nodes(game):
+                if is_score(node.comment):
+                    node.comment = ''
+            self.analyzed_depth = self.cfg.depth
+        if previous is not None:
+            PGNAnalyzer.copy_scores(previous, game)
+        game.headers[DEPTH_HEADER] = str(self.cfg.depth)
+        game.headers[SOURCE_HEADER] = source_hash
+        self.game = game
+
+    def finish(self, previous_path):
+        if self.cache:
+            self.cache.commit()
+        if os.path.exists(previous_path):
+            os.remove(previous_path)
+
+    @staticmethod
+    def copy_scores(source, target):
+        """Copies the scores of `source` into the nodes reached by the same moves in `target`."""
+        pending = [(source, target)]
+        while pending:
+            source_node, target_node = pending.pop()
+            if is_score(source_node.comment):
+                target_node.comment = source_node.comment
+            for child in target_node.variations:
+                if source_node.has_variation(child.move):
+                    pending.append((source_node.variation(child.move), child))
+
     @staticmethod
-    def read_pgn(pgn_path):
-        with open(pgn_path, 'r') as file:
-            state = pgn.read_game(file)
-        return state
-
-    def run_analysis(self, pgn_path):
-        state = PGNAnalyzer.read_pgn(pgn_path)
-        self.pbar = tqdm(total=100, desc=f'{pgn_path.stem}')
-        self.analyze(state.next())
-        self.pbar.close()
-        return state
+    def iter_nodes(state):
+        pending = [state]
+        while pending:
+            node = pending.pop()
+            yield node
+            pending.extend(node.variations)
+
+    def is_analyzed(self, state):
+        return self.analyzed_depth >= self.cfg.depth and is_score(state.comment)
+
+    def checkpoint(self):
+        """Rewrites the game in progress after the finished ones every `checkpoint_every` seconds."""
+        if not self.checkpoint_every:
+            return
+        if time.monotonic() - self.last_checkpoint < self.checkpoint_every:
+            return
+        if self.cache:
+            self.cache.commit()
+        self.write_game(self.game, finished=False)
+        self.last_checkpoint = time.monotonic()
+
+    def write_game(self, game, finished):
+        self.output.seek(self.finished_offset)
+        self.output.truncate()
+        print(game, file=self.output, end='\n\n')
+        self.output.flush()
+        if finished:
+            self.finished_offset = self.output.tell()
+
+    def clear_hash(self):
+        if 'Clear Hash' in self.engine.options:
+            self.engine.configure({'Clear Hash': None})
 
     def compute_score(self, state):
-        info = self.engine.analyse(state.board(), eng.Limit(depth=self.cfg.depth))
-        score = info['score'].white().score(
+        return self.to_value(self.compute_white_score(state))
+
+    def compute_white_score(self, state):
+        board = state.board()
+        white_score = self.cache.get(board, self.cfg.depth) if self.cache else None
+        if white_score is None:
+            info = self.engine.analyse(board, eng.Limit(depth=self.cfg.depth))
+            white_score = info['score'].white()
+            if self.cache:
+                self.cache.put(board, self.cfg.depth, white_score)
+        return white_score
+
+    def compute_lines(self, state):
+        """
+        Runs one MultiPV search with a line per variation of `state`.
+
+        Returns the white score of the position and the white score of every
+        variation move found among the engine's top lines. Both are taken from
+        the cache when a search as deep, with as many lines, was stored.
+        """
+        board = state.board()
+        width = len(state.variations)
+        if self.cache:
+            lines = self.cache.get_lines(board, self.cfg.depth, width)
+            best = self.cache.get(board, self.cfg.depth) if lines is not None else None
+            if best is not None:
+                return best, lines
+        infos = self.engine.analyse(board, eng.Limit(depth=self.cfg.depth), multipv=width)
+        best = infos[0]['score'].white()
+        lines = {info['pv'][0]: info['score'].white() for info in infos if info.get('pv')}
+        if self.cache:
+            self.cache.put(board, self.cfg.depth, best)
+            self.cache.put_lines(board, self.cfg.depth, width, lines)
+        return best, lines
+
+    def to_value(self, white_score):
+        score = white_score.score(
             mate_score=self.cfg.mate_score
         )/self.cfg.mate_score
         return score
@@ -34,15 +211,111 @@ class PGNAnalyzer():
     def get_variations(self, state):
         return [state.variations[x].move for x in range(len(state.variations))]
 
-    def analyze(self, state):
+    def analyze(self, state, white_score=None):
         self.pbar.update(1)
-        state.comment = str(self.compute_score(state))
+        lines = {}
+        if not self.is_analyzed(state):
+            if self.cfg.get('multipv') and len(state.variations) > 1:
+                # -- One search scores the position and the replies among its top lines -- #
+                best, lines = self.compute_lines(state)
+                white_score = best if white_score is None else white_score
+            if white_score is None:
+                white_score = self.compute_white_score(state)
+            state.comment = str(self.to_value(white_score))
+            self.checkpoint()
         if state.variations:
             all_variations = [state.variation(move) for move in self.get_variations(state)]
             for variation in all_variations:
-                self.analyze(variation)
+                self.analyze(variation, lines.get(variation.move))
+
+    @property
+    def cache_stats(self):
+        return (self.cache.hits, self.cache.misses) if self.cache else (0, 0)
+
+    def close(self):
+        self.engine.quit()
+        if self.cache:
+            self.cache.close()
+
+
+class AsyncPGNAnalyzer(PGNAnalyzer):
+    """
+    Analyzer driving a pool of engines through python-chess's asyncio protocol.
+
+    Positions are queued as the tree is walked, so sibling lines and whole
+    subtrees are analysed concurrently by `engine.concurrency` engines, with
+    at most `engine.max_in_flight` positions waiting in the queue. Every score
+    is written to its own node. Engine hashes are only cleared between games,
+    so a score may differ slightly from one run to another, depending on the
+    positions each engine searched before it.
+    """
+
+    def __init__(self, engine_cfg, progress=True):
+        # -- Engines are started by `analyze_games`, inside the event loop -- #
+        self.setup(engine_cfg, progress)
+
+    def run_analysis(self, pgn_path, output_path, checkpoint_every=0, resume=False):
+        games = self.stream_games(pgn_path, output_path, checkpoint_every, resume)
+        asyncio.run(self.analyze_games(games))
+
+    async def analyze_games(self, games):
+        engines = await asyncio.gather(
+            *(eng.popen_uci(self.cfg.path) for _ in range(self.cfg.concurrency))
+        )
+        engines = [engine for _, engine in engines]
+        try:
+            for game in games:
+                # -- Every game starts from an empty hash, so games do not depend on each other -- #
+                await asyncio.gather(*(
+                    engine.configure({'Clear Hash': None})
+                    for engine in engines if 'Clear Hash' in engine.options
+                ))
+                await self.analyze_tree(game.next(), engines)
+        finally:
+            for engine in engines:
+                await engine.quit()
+
+    def set_score(self, node, white_score):
+        node.comment = str(self.to_value(white_score))
+        self.pbar.update(1)
+        self.checkpoint()
+
+    async def analyze_tree(self, root, engines):
+        queue = asyncio.Queue(maxsize=self.cfg.max_in_flight)
+
+        async def produce():
+            pending = [(root, root.board())]
+            while pending:
+                node, board = pending.pop()
+                if self.is_analyzed(node):
+                    self.pbar.update(1)
+                else:
+                    cached = self.cache.get(board, self.cfg.depth) if self.cache else None
+                    if cached is None:
+                        await queue.put((node, board))
+                    else:
+                        self.set_score(node, cached)
+                for child in reversed(node.variations):
+                    child_board = board.copy(stack=False)
+                    child_board.push(child.move)
+                    pending.append((child, child_board))
+            for _ in range(self.cfg.concurrency):
+                await queue.put(None)
+
+        async def consume(engine):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                node, board = item
+                info = await engine.analyse(board, eng.Limit(depth=self.cfg.depth))
+                white_score = info['score'].white()
+                if self.cache:
+                    self.cache.put(board, self.cfg.depth, white_score)
+                self.set_score(node, white_score)
+
+        await asyncio.gather(produce(), *(consume(engine) for engine in engines))
 
-    def save(self, state, save_filename):
-        pgn_content = str(state)
-        with open(save_filename, 'w') as file:
-            file.write(pgn_content)
+    def close(self):
+        if self.cache:
+            self.cache.close()
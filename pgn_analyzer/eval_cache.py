@@ -0,0 +1,137 @@
+import json
+import sqlite3
+import chess
+import chess.engine as eng
+import chess.polyglot as polyglot
+
+UPSERT = (
+    'INSERT INTO evaluations (hash, depth, cp, mate) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT(hash) DO UPDATE SET depth = excluded.depth, cp = excluded.cp, '
+    'mate = excluded.mate WHERE excluded.depth > evaluations.depth'
+)
+UPSERT_LINES = (
+    'INSERT INTO lines (hash, depth, width, scores) VALUES (?, ?, ?, ?) '
+    'ON CONFLICT(hash) DO UPDATE SET depth = excluded.depth, width = excluded.width, '
+    'scores = excluded.scores WHERE excluded.depth > lines.depth '
+    'OR (excluded.depth = lines.depth AND excluded.width > lines.width)'
+)
+
+class EvalCache():
+    """
+    Persistent evaluation cache backed by SQLite.
+
+    Positions are keyed by their Zobrist hash, so transpositions and the shared
+    trunks of different repertoire files are only sent to the engine once. An
+    entry is reused whenever it was searched at least as deep as requested.
+    MultiPV searches also store the score of each of their top lines, by first
+    move, reused when the search was as deep and had at least as many lines.
+
+    New entries are kept in memory and written every `COMMIT_EVERY` entries in
+    a single short transaction, so the write lock is never held during engine
+    searches and several workers can share the same file.
+    """
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, path, timeout=60):
+        # -- Autocommit mode: transactions are only opened explicitly by `commit` -- #
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS evaluations ('
+            'hash INTEGER PRIMARY KEY, depth INTEGER NOT NULL, cp INTEGER, mate INTEGER)'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS lines ('
+            'hash INTEGER PRIMARY KEY, depth INTEGER NOT NULL, width INTEGER NOT NULL, scores TEXT NOT NULL)'
+        )
+        self.hits = 0
+        self.misses = 0
+        self.pending = {}
+        self.pending_lines = {}
+
+    @staticmethod
+    def key(board):
+        # -- SQLite integers are signed 64-bit -- #
+        zobrist = polyglot.zobrist_hash(board)
+        return zobrist - (1 << 64) if zobrist >= 1 << 63 else zobrist
+
+    def get(self, board, depth):
+        """Returns the cached white-relative score of `board` searched at `depth` or deeper."""
+        key = EvalCache.key(board)
+        entry = self.pending.get(key)
+        if entry is not None and entry[0] >= depth:
+            row = entry[1:]
+        else:
+            row = self.connection.execute(
+                'SELECT cp, mate FROM evaluations WHERE hash = ? AND depth >= ?', (key, depth)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        cp, mate = row
+        return eng.Mate(mate) if mate is not None else eng.Cp(cp)
+
+    def put(self, board, depth, score):
+        key = EvalCache.key(board)
+        entry = self.pending.get(key)
+        if entry is None or depth > entry[0]:
+            self.pending[key] = (depth, score.score(), score.mate())
+        if len(self.pending) + len(self.pending_lines) >= EvalCache.COMMIT_EVERY:
+            self.commit()
+
+    def get_lines(self, board, depth, width):
+        """Returns the white-relative score of each top line (by first move) of a MultiPV search of `board`."""
+        key = EvalCache.key(board)
+        entry = self.pending_lines.get(key)
+        if entry is not None and entry[0] >= depth and entry[1] >= width:
+            row = entry[2:]
+        else:
+            row = self.connection.execute(
+                'SELECT scores FROM lines WHERE hash = ? AND depth >= ? AND width >= ?', (key, depth, width)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {
+            chess.Move.from_uci(move): eng.Mate(mate) if mate is not None else eng.Cp(cp)
+            for move, cp, mate in json.loads(row[0])
+        }
+
+    def put_lines(self, board, depth, width, lines):
+        """Stores the `lines` of a MultiPV search of `board` with `width` lines."""
+        key = EvalCache.key(board)
+        entry = self.pending_lines.get(key)
+        if entry is None or (depth, width) > entry[:2]:
+            scores = [(move.uci(), score.score(), score.mate()) for move, score in lines.items()]
+            self.pending_lines[key] = (depth, width, json.dumps(scores))
+        if len(self.pending) + len(self.pending_lines) >= EvalCache.COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        if not self.pending and not self.pending_lines:
+            return
+        rows = [(key, *entry) for key, entry in self.pending.items()]
+        line_rows = [(key, *entry) for key, entry in self.pending_lines.items()]
+        # -- IMMEDIATE takes the write lock up front, so the batch never fails half way on a busy file -- #
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.connection.executemany(UPSERT, rows)
+            self.connection.executemany(UPSERT_LINES, line_rows)
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        self.pending = {}
+        self.pending_lines = {}
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.commit()
+        self.connection.close()
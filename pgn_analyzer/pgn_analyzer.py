@@ -1,10 +1,89 @@
+import os
 import sys
+import json
 import hydra
 import logging
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from tqdm import tqdm
-from analyzer import PGNAnalyzer
+from analyzer import AsyncPGNAnalyzer, PGNAnalyzer, file_hash
+
+MANIFEST_NAME = 'analysis_manifest.json'
+
+def build_analyzer(engine_cfg, progress=True):
+    if engine_cfg.concurrency > 1 and engine_cfg.multipv:
+        logging.warning('MultiPV mode is not supported with concurrency > 1, it will be ignored')
+    analyzer_class = AsyncPGNAnalyzer if engine_cfg.concurrency > 1 else PGNAnalyzer
+    return analyzer_class(engine_cfg, progress=progress)
+
+def process_file(pgn_analyzer, cfg, pgn_path, output_dir):
+    pgn_analyzer.run_analysis(
+        pgn_path,
+        output_path=output_dir / pgn_path.name,
+        checkpoint_every=cfg.checkpoint_every,
+        resume=cfg.resume
+    )
+
+# -- Manifest of analysed files -- #
+def load_manifest(output_dir):
+    try:
+        with open(output_dir / MANIFEST_NAME) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def update_manifest(manifest, output_dir, pgn_path, depth):
+    manifest[pgn_path.name] = {'source': file_hash(pgn_path), 'depth': depth}
+    temporary = output_dir / f'{MANIFEST_NAME}.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(temporary, output_dir / MANIFEST_NAME)
+
+def is_up_to_date(manifest, output_dir, pgn_path, depth):
+    entry = manifest.get(pgn_path.name)
+    return bool(
+        entry and entry['depth'] >= depth and (output_dir / pgn_path.name).exists()
+        and entry['source'] == file_hash(pgn_path)
+    )
+
+# -- Worker Pool -- #
+def analyze_file(cfg, pgn_path, output_dir):
+    # -- One analyzer per file: its engines are quit before the worker picks the next task -- #
+    pgn_analyzer = build_analyzer(cfg.engine, progress=False)
+    try:
+        process_file(pgn_analyzer, cfg, pgn_path, output_dir)
+        return pgn_analyzer.cache_stats
+    finally:
+        pgn_analyzer.close()
+
+def log_cache_stats(hits, misses):
+    if hits + misses:
+        logging.info(f'Evaluation cache: {hits} hits, {misses} misses ({hits / (hits + misses):.1%} hit rate)')
+
+def run_sequential(cfg, pgn_paths, output_dir, manifest):
+    pgn_analyzer = build_analyzer(cfg.engine)
+    pbar = tqdm(sorted(pgn_paths), desc='Analyzing PGNs')
+    for pgn_path in pbar:
+        process_file(pgn_analyzer, cfg, pgn_path, output_dir)
+        update_manifest(manifest, output_dir, pgn_path, cfg.engine.depth)
+    pbar.close()
+    log_cache_stats(*pgn_analyzer.cache_stats)
+    pgn_analyzer.close()
+
+def run_parallel(cfg, pgn_paths, output_dir, manifest):
+    # -- Largest trees first so no long file is left alone at the end -- #
+    pgn_paths = sorted(pgn_paths, key=lambda path: path.stat().st_size, reverse=True)
+    with ProcessPoolExecutor(max_workers=cfg.workers) as pool:
+        futures = {
+            pool.submit(analyze_file, cfg, pgn_path, output_dir): pgn_path for pgn_path in pgn_paths
+        }
+        hits, misses = 0, 0
+        for future in tqdm(as_completed(futures), total=len(futures), desc='Analyzing PGNs'):
+            file_hits, file_misses = future.result()
+            hits, misses = hits + file_hits, misses + file_misses
+            update_manifest(manifest, output_dir, futures[future], cfg.engine.depth)
+    log_cache_stats(hits, misses)
 
 @hydra.main(config_path=Path(__file__).parent, config_name='pgn_analyzer')
 def main(cfg):
@@ -16,15 +95,19 @@ def main(cfg):
     logging.info('Done')
 
     logging.info('Building PGNConverter...')
-    pgn_analyzer = PGNAnalyzer(cfg.engine)
-
-    pbar = tqdm(sorted(list(pgn_directory.glob('**/*.pgn'))), desc='Analyzing PGNs')
-    for pgn_path in pbar:
-        state = pgn_analyzer.run_analysis(pgn_path)
-        pgn_analyzer.save(state, save_filename=f'{output_dir / pgn_path.name}')
-    pbar.close()
+    manifest = load_manifest(output_dir)
+    all_paths = list(pgn_directory.glob('**/*.pgn'))
+    pgn_paths = [
+        pgn_path for pgn_path in all_paths
+        if not is_up_to_date(manifest, output_dir, pgn_path, cfg.engine.depth)
+    ]
+    logging.info(f'{len(pgn_paths)} PGNs to analyse, {len(all_paths) - len(pgn_paths)} up to date')
+    if cfg.workers > 1:
+        run_parallel(cfg, pgn_paths, output_dir, manifest)
+    else:
+        run_sequential(cfg, pgn_paths, output_dir, manifest)
     logging.info('Done')
     sys.exit()
     
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,77 @@
+import chess.pgn as pgn
+
+# -- Shared by the analyzer and the web app, which imports it as pgn_analyzer.pgn_stream -- #
+
+def scan_offsets(file):
+    """Yields the offset of every game in `file`, parsing only its headers."""
+    while True:
+        offset = file.tell()
+        if pgn.read_headers(file) is None:
+            return
+        yield offset
+
+def iter_games(pgn_path):
+    """Streams the games of `pgn_path`, keeping a single one in memory."""
+    with open(pgn_path) as file:
+        while True:
+            game = pgn.read_game(file)
+            if game is None:
+                return
+            yield game
+
+class GameIndex():
+    """
+    Offsets of the games stored in a PGN file.
+
+    Building the index only reads the headers, and game N is then parsed on its
+    own by seeking to its offset, without going through games 0..N-1. `split`
+    cuts the index in smaller ones (e.g. to hand batches of games to workers),
+    each ending where the next one starts.
+    """
+
+    def __init__(self, pgn_path, offsets=None, end=None):
+        self.pgn_path = pgn_path
+        if offsets is None:
+            with open(pgn_path) as file:
+                offsets = list(scan_offsets(file))
+        self.offsets = offsets
+        self.end = end
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        with open(self.pgn_path) as file:
+            for offset in self.offsets:
+                file.seek(offset)
+                yield pgn.read_game(file)
+
+    def read_game(self, index):
+        with open(self.pgn_path) as file:
+            file.seek(self.offsets[index])
+            return pgn.read_game(file)
+
+    def read_headers(self, index):
+        with open(self.pgn_path) as file:
+            file.seek(self.offsets[index])
+            return pgn.read_headers(file)
+
+    def read_text(self, index):
+        """PGN of game `index` as written in the file."""
+        stop = self.offsets[index + 1] if index + 1 < len(self.offsets) else self.end
+        lines = []
+        with open(self.pgn_path) as file:
+            file.seek(self.offsets[index])
+            while stop is None or file.tell() < stop:
+                line = file.readline()
+                if not line:
+                    break
+                lines.append(line)
+        return ''.join(lines).strip()
+
+    def split(self, size):
+        """Indexes of `size` consecutive games covering this one."""
+        for start in range(0, len(self.offsets), size):
+            stop = start + size
+            end = self.offsets[stop] if stop < len(self.offsets) else self.end
+            yield GameIndex(self.pgn_path, self.offsets[start:stop], end)
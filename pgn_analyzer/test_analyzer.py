@@ -0,0 +1,116 @@
+import shutil
+import tempfile
+import unittest
+import chess
+import chess.engine as eng
+import chess.polyglot as polyglot
+
+from pathlib import Path
+from unittest import mock
+from omegaconf import OmegaConf
+from analyzer import AsyncPGNAnalyzer, PGNAnalyzer
+
+REPERTOIRE = '1. e4 e5 (1... c5 2. Nf3 d6 (2... Nc6 3. d4)) 2. Nf3 Nc6 (2... d6 3. d4) 3. Bc4 *\n'
+
+# -- Helpers -- #
+def fake_score(board):
+    return eng.PovScore(eng.Cp(polyglot.zobrist_hash(board) % 200 - 100), chess.WHITE)
+
+class FakeEngine():
+    """Engine scoring positions from their hash, counting its searches."""
+
+    def __init__(self):
+        self.options = {'Clear Hash': None}
+        self.searches = []
+
+    def analyse(self, board, limit, multipv=None):
+        self.searches.append((board.fen(), multipv))
+        if multipv is None:
+            return {'score': fake_score(board)}
+        infos = []
+        for move in board.legal_moves:
+            child = board.copy(stack=False)
+            child.push(move)
+            infos.append({'score': fake_score(child), 'pv': [move]})
+        infos.sort(key=lambda info: -info['score'].pov(board.turn).score())
+        return infos[:multipv]
+
+    def configure(self, options):
+        pass
+
+    def quit(self):
+        pass
+
+class FakeAsyncEngine(FakeEngine):
+    async def analyse(self, board, limit, multipv=None):
+        return FakeEngine.analyse(self, board, limit, multipv)
+
+    async def configure(self, options):
+        pass
+
+    async def quit(self):
+        pass
+
+
+class AnalyzerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.pgn_path = self.folder / 'italian.pgn'
+        self.pgn_path.write_text(REPERTOIRE)
+        self.cfg = OmegaConf.create({
+            'path': 'stockfish', 'depth': 12, 'mate_score': 100, 'multipv': True,
+            'cache': str(self.folder / 'evaluations.sqlite3'), 'concurrency': 1, 'max_in_flight': 4
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def analyze(self, name):
+        engine = FakeEngine()
+        with mock.patch('analyzer.eng.SimpleEngine.popen_uci', return_value=engine):
+            analyzer = PGNAnalyzer(self.cfg, progress=False)
+        output_path = self.folder / name
+        analyzer.run_analysis(self.pgn_path, output_path)
+        analyzer.close()
+        return engine.searches, output_path.read_text()
+
+
+class MultiPVCacheTest(AnalyzerTestCase):
+    def test_branching_positions_are_cached(self):
+        searches, first = self.analyze('first.pgn')
+        self.assertIn(2, [multipv for _, multipv in searches])
+
+        searches, second = self.analyze('second.pgn')
+        self.assertEqual(searches, [])
+        self.assertEqual(second, first)
+
+    def test_new_lines_need_a_wider_search(self):
+        self.analyze('first.pgn')
+        self.pgn_path.write_text(REPERTOIRE.replace('(1... c5 ', '(1... e6) (1... c5 '))
+        searches, _ = self.analyze('second.pgn')
+        self.assertIn(('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1', 3), searches)
+        self.assertNotIn(2, [multipv for _, multipv in searches])
+
+
+class AsyncAnalyzerTest(AnalyzerTestCase):
+    def test_same_scores_as_the_sequential_analyzer(self):
+        self.cfg.multipv, self.cfg.cache = False, None
+        _, sequential = self.analyze('sequential.pgn')
+
+        self.cfg.concurrency = 3
+        engines = [FakeAsyncEngine() for _ in range(self.cfg.concurrency)]
+
+        async def popen_uci(path):
+            return None, engines.pop()
+
+        with mock.patch('analyzer.eng.popen_uci', popen_uci), \
+                mock.patch('analyzer.eng.SimpleEngine.popen_uci', side_effect=AssertionError('engine started')):
+            analyzer = AsyncPGNAnalyzer(self.cfg, progress=False)
+            self.assertIsNone(analyzer.cache)
+            analyzer.run_analysis(self.pgn_path, self.folder / 'concurrent.pgn')
+            analyzer.close()
+        self.assertEqual((self.folder / 'concurrent.pgn').read_text(), sequential)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+import chess
+import chess.engine as eng
+
+from concurrent.futures import ProcessPoolExecutor
+from eval_cache import EvalCache
+
+# -- Helpers -- #
+def random_boards(seed, count):
+    """`count` positions of random games, the same ones for the same seed."""
+    generator, board, boards = random.Random(seed), chess.Board(), []
+    while len(boards) < count:
+        if board.is_game_over():
+            board = chess.Board()
+        board.push(generator.choice(list(board.legal_moves)))
+        boards.append(board.copy(stack=False))
+    return boards
+
+def fill_cache(path, seed, count, search_time):
+    # -- Every put follows a simulated engine search, as in the analyzers -- #
+    cache = EvalCache(path, timeout=1)
+    try:
+        for index, board in enumerate(random_boards(seed, count)):
+            time.sleep(search_time)
+            cache.put(board, 20, eng.Cp(index))
+    finally:
+        cache.close()
+    return count
+
+
+class EvalCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'engine.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_entries_are_reused_at_lower_depths(self):
+        cache = EvalCache(self.path)
+        board = chess.Board()
+        cache.put(board, 20, eng.Cp(30))
+        self.assertEqual(cache.get(board, 18), eng.Cp(30))
+        self.assertIsNone(cache.get(board, 22))
+        cache.close()
+
+        cache = EvalCache(self.path)
+        self.assertEqual(cache.get(board, 20), eng.Cp(30))
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.close()
+
+    def test_deeper_entries_win(self):
+        cache = EvalCache(self.path)
+        board = chess.Board()
+        cache.put(board, 20, eng.Cp(30))
+        cache.commit()
+        cache.put(board, 18, eng.Cp(10))
+        cache.put(board, 24, eng.Mate(5))
+        cache.close()
+
+        cache = EvalCache(self.path)
+        self.assertEqual(cache.get(board, 24), eng.Mate(5))
+        cache.close()
+
+    def test_transpositions_share_an_entry(self):
+        cache = EvalCache(self.path)
+        first, second = chess.Board(), chess.Board()
+        for move in ('Nf3', 'Nf6', 'g3'):
+            first.push_san(move)
+        for move in ('g3', 'Nf6', 'Nf3'):
+            second.push_san(move)
+        cache.put(first, 20, eng.Cp(15))
+        self.assertEqual(cache.get(second, 20), eng.Cp(15))
+        cache.close()
+
+    def test_lines_of_multipv_searches(self):
+        cache = EvalCache(self.path)
+        board = chess.Board()
+        lines = {chess.Move.from_uci('e2e4'): eng.Cp(30), chess.Move.from_uci('d2d4'): eng.Mate(-7)}
+        cache.put_lines(board, 20, 2, lines)
+        self.assertEqual(cache.get_lines(board, 20, 2), lines)
+        cache.close()
+
+        cache = EvalCache(self.path)
+        self.assertEqual(cache.get_lines(board, 18, 1), lines)
+        self.assertIsNone(cache.get_lines(board, 22, 2))
+        self.assertIsNone(cache.get_lines(board, 20, 3))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        # -- Wider searches at the same depth replace narrower ones -- #
+        cache.put_lines(board, 20, 3, {**lines, chess.Move.from_uci('g1f3'): eng.Cp(25)})
+        cache.put_lines(board, 18, 4, lines)
+        cache.close()
+
+        cache = EvalCache(self.path)
+        self.assertEqual(len(cache.get_lines(board, 20, 3)), 3)
+        cache.close()
+
+    def test_pending_entries_do_not_lock_the_file(self):
+        cache = EvalCache(self.path)
+        cache.put(chess.Board(), 20, eng.Cp(30))
+        other = EvalCache(self.path, timeout=1)
+        other.put(random_boards(0, 1)[0], 20, eng.Cp(0))
+        other.close()
+        cache.close()
+
+    def test_workers_share_a_file(self):
+        # -- Each worker commits several batches while the other one is searching -- #
+        count = 3 * EvalCache.COMMIT_EVERY
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(fill_cache, self.path, seed, count, 0.005) for seed in (1, 2)]
+            self.assertEqual([future.result() for future in futures], [count, count])
+
+        cache = EvalCache(self.path)
+        for seed in (1, 2):
+            for board in random_boards(seed, count):
+                self.assertIsNotNone(cache.get(board, 20))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
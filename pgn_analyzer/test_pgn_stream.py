@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+import chess.pgn as pgn
+
+from unittest import mock
+from pgn_stream import GameIndex, iter_games
+
+GAMES = [
+    '[Event "Italian"]\n[Opening "Giuoco Piano"]\n\n1. e4 e5 2. Nf3 Nc6 3. Bc4 Bc5 *',
+    '[Event "Réti"]\n\n1. Nf3 { Flexible, à la Réti } d5 (1... Nf6 2. g3) 2. g3 *',
+    '[Event "Slav"]\n\n1. d4 d5 2. c4 c6 *',
+    '[Event "Empty"]\n\n*',
+    '[Event "Scandinavian"]\n\n1. e4 d5 2. exd5 Qxd5 *',
+]
+
+
+class GameIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'repertoire.pgn')
+        with open(self.path, 'w') as file:
+            file.write('\n\n'.join(GAMES) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_games_are_streamed(self):
+        self.assertEqual([game.headers['Event'] for game in iter_games(self.path)], [
+            'Italian', 'Réti', 'Slav', 'Empty', 'Scandinavian'
+        ])
+
+    def test_random_access(self):
+        index = GameIndex(self.path)
+        self.assertEqual(len(index), len(GAMES))
+        with mock.patch('pgn_stream.pgn.read_game', wraps=pgn.read_game) as read_game:
+            game = index.read_game(4)
+        read_game.assert_called_once()
+        self.assertEqual(game.headers['Event'], 'Scandinavian')
+        self.assertEqual(game.end().board().fen(), 'rnb1kbnr/ppp1pppp/8/3q4/8/8/PPPP1PPP/RNBQKBNR w KQkq - 0 3')
+
+        self.assertEqual(index.read_game(1).next().comment, 'Flexible, à la Réti')
+        self.assertEqual(index.read_headers(0)['Opening'], 'Giuoco Piano')
+        self.assertEqual([game.headers['Event'] for game in index], [
+            game.headers['Event'] for game in iter_games(self.path)
+        ])
+
+    def test_text_as_written(self):
+        index = GameIndex(self.path)
+        self.assertEqual([index.read_text(number) for number in range(len(index))], GAMES)
+
+    def test_split(self):
+        parts = list(GameIndex(self.path).split(2))
+        self.assertEqual([len(part) for part in parts], [2, 2, 1])
+        self.assertEqual(
+            [part.read_text(number) for part in parts for number in range(len(part))], GAMES
+        )
+        self.assertEqual(parts[1].read_game(0).headers['Event'], 'Slav')
+
+    def test_empty_file(self):
+        with open(self.path, 'w'):
+            pass
+        index = GameIndex(self.path)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(list(index.split(2)), [])
+        self.assertEqual(list(iter_games(self.path)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()